@@ -0,0 +1,42 @@
+"""Benchmark of the ExG packet decoding
+
+Compares the vectorized int24 decoder used by the ExG packets with the former per-sample implementation and reports
+the decoding time per packet for the 4 and 8 channel packet layouts.
+
+Usage:
+    python benchmarks/bench_packet.py
+"""
+
+import timeit
+import numpy as np
+from explorepy.packet import Packet, EEG94, EEG98
+
+
+def int24to32_reference(bin_data):
+    """Former per-sample implementation of Packet.int24to32"""
+    return np.asarray([int.from_bytes(bin_data[x:x + 3], byteorder='little', signed=True)
+                       for x in range(0, len(bin_data), 3)])
+
+
+def make_payload(n_sample, n_chan):
+    """Generates a random ExG payload (data + fletcher) with the given layout"""
+    data = np.random.randint(0, 256, size=n_sample * (n_chan + 1) * 3, dtype=np.uint8).tobytes()
+    return data + b'\xaf\xbe\xad\xde'
+
+
+def main():
+    n_repeat = 2000
+    for name, pkt_class, n_sample, n_chan in [('EEG94', EEG94, 33, 4), ('EEG98', EEG98, 16, 8)]:
+        payload = make_payload(n_sample, n_chan)
+        bin_data = payload[:-4]
+        assert np.array_equal(int24to32_reference(bin_data), Packet.int24to32(bin_data)), "Decoder mismatch!"
+
+        t_ref = timeit.timeit(lambda: int24to32_reference(bin_data), number=n_repeat) / n_repeat
+        t_new = timeit.timeit(lambda: Packet.int24to32(bin_data), number=n_repeat) / n_repeat
+        t_pkt = timeit.timeit(lambda: pkt_class(0, payload), number=n_repeat) / n_repeat
+        print("%s (%d samples x %d channels): int24 decode %.2f us -> %.2f us (x%.1f), full packet %.2f us"
+              % (name, n_sample, n_chan, t_ref * 1e6, t_new * 1e6, t_ref / t_new, t_pkt * 1e6))
+
+
+if __name__ == '__main__':
+    main()
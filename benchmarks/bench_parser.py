@@ -0,0 +1,89 @@
+"""Benchmark of the packet parser
+
+Parses a synthetic stream of 8 channel ExG and orientation packets from an in-memory file and from a memory-mapped
+BIN file, and reports the parsing throughput and the number of read calls issued to the source per packet.
+
+Usage:
+    python benchmarks/bench_parser.py
+"""
+
+import io
+import os
+import struct
+import tempfile
+import time
+import numpy as np
+from explorepy.packet import PACKET_ID, FLETCHER
+from explorepy.parser import Parser
+
+
+class CountingFile(io.BytesIO):
+    """In-memory file which counts the read calls"""
+    n_calls = 0
+
+    def read(self, *args):
+        self.n_calls += 1
+        return super().read(*args)
+
+    def readinto(self, buffer):
+        self.n_calls += 1
+        return super().readinto(buffer)
+
+
+def make_packet(pid, cnt, timestamp, bin_data):
+    return struct.pack('<BBHI', pid, cnt % 256, len(bin_data) + 8, timestamp) + bin_data + FLETCHER
+
+
+def make_stream(duration, sampling_rate=250, n_chan=8, n_sample=16):
+    """Generates the byte stream of a device with the given sampling rate and duration (in seconds)"""
+    rng = np.random.RandomState(42)
+    packets = []
+    n_packet = int(duration * sampling_rate / n_sample)
+    cnt = 0
+    for i in range(n_packet):
+        timestamp = int(i * n_sample * 10000 / sampling_rate)
+        exg = rng.randint(0, 256, size=n_sample * (n_chan + 1) * 3, dtype=np.uint8).tobytes()
+        packets.append(make_packet(PACKET_ID.EEG98, cnt, timestamp, exg))
+        cnt += 1
+        if i % max(1, sampling_rate // n_sample // 20) == 0:
+            orn = rng.randint(-1000, 1000, size=9).astype('<i2').tobytes()
+            packets.append(make_packet(PACKET_ID.ORN, cnt, timestamp, orn))
+            cnt += 1
+    return b''.join(packets)
+
+
+def parse_all(parser):
+    """Parses all packets and returns the number of packets and the elapsed time"""
+    n_packet = 0
+    t_start = time.perf_counter()
+    while True:
+        try:
+            parser.parse_packet(mode=None)
+        except ValueError:
+            break
+        n_packet += 1
+    return n_packet, time.perf_counter() - t_start
+
+
+def main():
+    duration = 600
+    stream = make_stream(duration)
+
+    fid = CountingFile(stream)
+    n_packet, elapsed = parse_all(Parser(fid=fid))
+    print("Buffered read: %d packets (%.1f MB, %d s of data) parsed in %.3f s: %.1f us/packet, %.1fx real-time"
+          % (n_packet, len(stream) / 1e6, duration, elapsed, elapsed / n_packet * 1e6, duration / elapsed))
+    print("Read calls per packet: %.3f" % (fid.n_calls / n_packet))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bin_file = os.path.join(tmp_dir, 'bench.BIN')
+        with open(bin_file, 'wb') as f_bin:
+            f_bin.write(stream)
+        with open(bin_file, 'rb') as f_bin:
+            n_packet, elapsed = parse_all(Parser(fid=f_bin, use_mmap=True))
+        print("Memory-mapped: %d packets parsed in %.3f s: %.1f us/packet, %.1fx real-time"
+              % (n_packet, elapsed, elapsed / n_packet * 1e6, duration / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Benchmark of the acquisition chain at 250, 500 and 1000 SPS
+
+Runs synthetic 8 channel streams through the parser (with sampling rate detection), the real-time filters, the csv
+recording with the writer thread, the chunked lsl outlet and a lsl outlet resampled to 100 Hz, and reports how much
+faster than real-time each chain runs.
+
+Usage:
+    python benchmarks/bench_sampling_rate.py
+"""
+
+import io
+import os
+import time
+from pylsl import StreamInfo, StreamOutlet
+from bench_parser import make_stream
+from explorepy.outlets import ChunkedOutlet
+from explorepy.parser import Parser
+from explorepy.pipeline import Pipeline, Resample
+from explorepy.writers import WriterThread, create_csv_writers
+
+DURATION = 60
+N_CHAN = 8
+
+
+def run(stream, sink):
+    """Parses the stream and passes every packet to the sink; returns the elapsed time and the detected rate"""
+    parser = Parser(fid=io.BytesIO(stream), bp_freq=(1, 30), notch_freq=50)
+    t_start = time.perf_counter()
+    sampling_rate = parser.detect_sampling_rate()
+    sink = sink(parser)
+    while True:
+        try:
+            sink.send(parser.parse_packet(mode=None))
+        except ValueError:
+            break
+    sink.close()
+    return time.perf_counter() - t_start, sampling_rate
+
+
+def filter_sink(parser):
+    while True:
+        packet = yield
+        if hasattr(packet, 'apply_pipeline'):
+            packet.apply_pipeline(parser.pipeline)
+
+
+def record_sink(parser):
+    writer_thread = WriterThread()
+    with open(os.devnull, 'w') as f_null:
+        exg_writer, orn_writer, _ = create_csv_writers(f_null, f_null, f_null, sampling_rate=parser.sampling_rate,
+                                                       writer_thread=writer_thread)
+        try:
+            while True:
+                packet = yield
+                if hasattr(packet, 'apply_filter'):
+                    packet.write_to_csv(exg_writer)
+                elif hasattr(packet, 'acc'):
+                    packet.write_to_csv(orn_writer)
+        finally:
+            exg_writer.flush()
+            orn_writer.flush()
+            writer_thread.stop()
+
+
+def lsl_sink(parser):
+    info = StreamInfo('Benchmark', 'ExG', N_CHAN, parser.sampling_rate, 'float32', 'bench')
+    outlet = ChunkedOutlet(StreamOutlet(info), sampling_rate=parser.sampling_rate)
+    try:
+        while True:
+            packet = yield
+            if hasattr(packet, 'apply_filter'):
+                packet.push_to_lsl(outlet)
+    finally:
+        outlet.flush()
+
+
+def resampled_lsl_sink(parser):
+    resampler = Pipeline([Resample.from_rates(parser.sampling_rate, 100)], sampling_rate=parser.sampling_rate)
+    info = StreamInfo('Benchmark', 'ExG', N_CHAN, resampler.sampling_rate_out, 'float32', 'bench_100')
+    outlet = ChunkedOutlet(StreamOutlet(info), sampling_rate=resampler.sampling_rate_out)
+    try:
+        while True:
+            packet = yield
+            if hasattr(packet, 'apply_filter'):
+                data = resampler.apply(packet.data)
+                if data.shape[1]:
+                    outlet.push(packet.timestamp + resampler.time_shift, data.T)
+    finally:
+        outlet.flush()
+
+
+def start(sink):
+    def create(parser):
+        generator = sink(parser)
+        next(generator)
+        return generator
+    return create
+
+
+def main():
+    for sampling_rate in (250, 500, 1000):
+        stream = make_stream(DURATION, sampling_rate=sampling_rate, n_chan=N_CHAN)
+        for name, sink in (('filter', filter_sink), ('csv record', record_sink), ('lsl', lsl_sink),
+                           ('lsl 100 Hz', resampled_lsl_sink)):
+            elapsed, detected_rate = run(stream, start(sink))
+            print("%4d SPS (detected %4d), %-10s: %d s of data in %.3f s, %.1fx real-time"
+                  % (sampling_rate, detected_rate, name, DURATION, elapsed, DURATION / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,16 +25,33 @@ def main():
                             -f --filename   The name of the new CSV Files. 
                             -o --overwrite  Overwrite already existing files with the same name.
                             -d --duration   Recording duration in seconds
+                            -t --type       Output file type, csv, bdf, exz or npy (default csv)
+                            -s --segment    Split the recording into segments of the given duration in seconds
+                            -r --raw        Also save the raw data of the device to a BIN file
+                            -g --gap        Fill lost ExG samples with nan, hold (last value) or interpolate
                             
     push2lsl                Streams Data to Lab stream layer. Inputs: Name or Address and Channel number (either 4 or 8)
                             -a --address    Device MAC address (Form XX:XX:XX:XX:XX:XX). 
                             -n --name       Device name (e.g. Explore_12AB).
                             -c --channels   Number of channels. This is necessary for push2lsl
+                            -k --chunk      Number of ExG samples per lsl chunk (default: samples of one packet)
+                            -r --resample   Sampling rate of an additional resampled ExG stream (e.g. 100)
                             
     
     bin2csv                Takes a Binary file and converts it to 2 CSV files (orientation and Body)
                             -i --inputfile  Name of the input file
                             -o --overwrite  Overwrite already existing files with the same name.
+                            -j --jobs       Number of parallel worker processes (default 1)
+                            -t --type       Output file type, csv, bdf, exz or npy (default csv)
+
+
+    filter_npy              Zero-phase filtering of an npy recording
+                            -i --inputfile  Name of the input file
+                            -f --outputfile Name of the output file
+                            -lf --lowfreq   Low cut-off frequency of the bandpass filter
+                            -hf --highfreq  High cut-off frequency of the bandpass filter
+                            -nf --notchfreq Frequency of the notch filter
+                            -j --jobs       Number of parallel threads (default 1)
                         
                             
     visualize               Visualizes real-time data in a browser-based dashboard
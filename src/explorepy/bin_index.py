@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Byte-offset index of BIN recordings for direct access to time ranges"""
+import os
+from contextlib import closing
+import numpy as np
+from explorepy.packet import PACKET_SCHEMA, EEG, Orientation, MarkerEvent, Environment
+from explorepy.parser import Parser, MappedBuffer, BlockBuilder, HEADER, HEADER_SIZE, generate_packet
+from explorepy.timesync import TIMESTAMP_UNIT, unwrap_counter
+
+PACKET_KINDS = {'exg': EEG, 'orn': Orientation, 'marker': MarkerEvent, 'env': Environment}
+
+
+def get_index_file(bin_file):
+    """Returns the name of the index sidecar file of a BIN file"""
+    return os.path.splitext(bin_file)[0] + '_index.npz'
+
+
+class BinIndex:
+    """Index of the packets in a BIN file
+
+    The byte offset, packet ID and device timestamp of every valid packet are kept in compact numpy arrays, so time
+    ranges can be located without parsing the file.
+    """
+
+    def __init__(self, offset, pid, timestamp, file_size, sampling_rate=None):
+        """
+        Args:
+            offset (np.ndarray): Byte offset of each packet in the file
+            pid (np.ndarray): Packet ID of each packet
+            timestamp (np.ndarray): Device timestamp of each packet (in .1 ms)
+            file_size (int): Size of the indexed file in bytes
+            sampling_rate (float): Sampling rate of ExG data (None if unknown, e.g. in index files of older versions)
+        """
+        self.offset = offset
+        self.pid = pid
+        self.timestamp = timestamp
+        self.file_size = file_size
+        self.sampling_rate = sampling_rate
+
+    def __len__(self):
+        return len(self.offset)
+
+    @classmethod
+    def build(cls, bin_file):
+        """Builds the index of a BIN file in one pass over the packet headers
+
+        Args:
+            bin_file (str): Binary file full address
+
+        Returns:
+            BinIndex object
+        """
+        file_size = os.path.getsize(bin_file)
+        # Each packet has at least a header and a fletcher
+        max_packets = file_size // (HEADER_SIZE + 4)
+        offset = np.empty(max_packets, dtype=np.int64)
+        pid = np.empty(max_packets, dtype=np.uint8)
+        timestamp = np.empty(max_packets, dtype=np.uint32)
+        n_packet = 0
+        with open(bin_file, "rb") as f_bin, Parser(fid=f_bin, use_mmap=True) as parser:
+            while True:
+                try:
+                    packet_pid, _, packet_ts, payload = parser.read_raw_packet()
+                except ValueError:
+                    break
+                offset[n_packet] = parser.position - HEADER_SIZE - len(payload)
+                pid[n_packet] = packet_pid
+                timestamp[n_packet] = packet_ts
+                n_packet += 1
+            # The sampling rate is taken from the device info or the ExG timestamps at the start of the file
+            with Parser(fid=f_bin, use_mmap=True) as rate_parser:
+                sampling_rate = rate_parser.detect_sampling_rate()
+        return cls(offset[:n_packet].copy(), pid[:n_packet].copy(), timestamp[:n_packet].copy(), file_size,
+                   sampling_rate)
+
+    def save(self, index_file):
+        """Saves the index in a npz file
+
+        Args:
+            index_file (str): Index file name
+        """
+        with open(index_file, "wb") as f_index:
+            np.savez(f_index, offset=self.offset, pid=self.pid, timestamp=self.timestamp,
+                     file_size=np.int64(self.file_size), sampling_rate=np.float64(self.sampling_rate))
+
+    @classmethod
+    def load(cls, index_file):
+        """Loads an index from a npz file
+
+        Args:
+            index_file (str): Index file name
+
+        Returns:
+            BinIndex object
+        """
+        with np.load(index_file) as data:
+            sampling_rate = float(data['sampling_rate']) if 'sampling_rate' in data else None
+            return cls(data['offset'], data['pid'], data['timestamp'], int(data['file_size']), sampling_rate)
+
+    @property
+    def time(self):
+        """Packet times in seconds relative to the first packet (as given by the parser)"""
+        if not len(self):
+            return np.empty(0)
+        return (unwrap_counter(self.timestamp) - int(self.timestamp[0])) * TIMESTAMP_UNIT
+
+    def select(self, t_start, t_end, kinds=("exg", "orn", "marker"), sampling_rate=None):
+        """Finds the packets of the given kinds which have data in the time range [t_start, t_end)
+
+        Args:
+            t_start (float): Start time in seconds (relative to the first packet)
+            t_end (float): End time in seconds (relative to the first packet)
+            kinds (tuple): Kinds of packets {'exg', 'orn', 'marker', 'env'}
+            sampling_rate (float): Sampling rate of ExG data (if None, the sampling rate of the index is used)
+
+        Returns:
+            Indices of the selected packets
+        """
+        if sampling_rate is None:
+            sampling_rate = self.sampling_rate
+        packet_time = self.time
+        pid_mask = np.zeros(256, dtype=bool)
+        duration = np.zeros(256)
+        for pid, schema in PACKET_SCHEMA.items():
+            if any(issubclass(schema.packet_class, PACKET_KINDS[kind]) for kind in kinds):
+                pid_mask[pid] = True
+                if schema.n_sample is not None:
+                    duration[pid] = schema.n_sample / sampling_rate
+        # ExG packets starting before t_start may still contain samples of the range
+        in_range = (packet_time + duration[self.pid] > t_start) & (packet_time < t_end)
+        return np.flatnonzero(pid_mask[self.pid] & in_range)
+
+
+def get_index(bin_file, rebuild=False):
+    """Loads the index of a BIN file from its sidecar file, or builds and saves it if it does not exist or is outdated
+
+    If the sidecar file cannot be written (e.g. read-only directory), the index is only kept in memory.
+
+    Args:
+        bin_file (str): Binary file full address
+        rebuild (bool): Rebuild the index even if a valid sidecar file exists
+
+    Returns:
+        BinIndex object
+    """
+    index_file = get_index_file(bin_file)
+    if not rebuild and os.path.isfile(index_file):
+        index = BinIndex.load(index_file)
+        if index.file_size == os.path.getsize(bin_file) and index.sampling_rate is not None:
+            return index
+    index = BinIndex.build(bin_file)
+    try:
+        index.save(index_file)
+    except OSError:
+        pass
+    return index
+
+
+def read_range(bin_file, t_start, t_end, kinds=("exg", "orn", "marker"), sampling_rate=None):
+    """Reads the data of a time range of a BIN file
+
+    Only the packets of the range are decoded; they are located with the index of the file, which is built on the
+    first call.
+
+    Args:
+        bin_file (str): Binary file full address
+        t_start (float): Start time in seconds (relative to the first packet of the file)
+        t_end (float): End time in seconds (relative to the first packet of the file)
+        kinds (tuple): Kinds of packets to be read {'exg', 'orn', 'marker', 'env'}
+        sampling_rate (float): Sampling rate of ExG data (if None, the sampling rate detected when the index was built)
+
+    Returns:
+        DataBlock object
+    """
+    assert t_start < t_end, "End time must be larger than start time"
+    assert set(kinds) <= set(PACKET_KINDS), "Invalid packet kind! Valid kinds are: " + str(list(PACKET_KINDS))
+    index = get_index(bin_file)
+    if sampling_rate is None:
+        sampling_rate = index.sampling_rate
+    selected = index.select(t_start, t_end, kinds, sampling_rate)
+    builder = BlockBuilder(max_packets=max(len(selected), 1), sampling_rate=sampling_rate)
+    if len(index):
+        with open(bin_file, "rb") as f_bin, closing(MappedBuffer(f_bin)) as stream:
+            for offset, packet_time in zip(index.offset[selected], index.time[selected]):
+                stream.seek(offset)
+                pid, _, payload_len, _ = HEADER.unpack_from(stream.peek(HEADER_SIZE))
+                payload = stream.peek(payload_len + 4)[HEADER_SIZE:]
+                builder.add(generate_packet(pid, packet_time, payload))
+    block = builder.get_block()
+
+    # Trim ExG samples of the boundary packets
+    exg_mask = (block.exg_timestamp >= t_start) & (block.exg_timestamp < t_end)
+    block.exg = block.exg[:, exg_mask]
+    block.exg_timestamp = block.exg_timestamp[exg_mask]
+    return block
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""Compressed, chunked recording format (EXZ)
+
+An EXZ file consists of a file header, a sequence of compressed chunks and a footer index::
+
+    file header | chunk header | chunk | chunk header | chunk | ... | index (json) | index size | magic
+
+Each chunk holds about chunk_duration seconds of data: ExG samples as int32 ADC counts (delta encoded along time),
+orientation rows and markers, each with their timestamps. The footer index lists the byte offset and the time range of
+every chunk, so a time range can be read by decompressing only the chunks it overlaps. As each chunk has its own
+header, a file without footer (e.g. after a crash) can still be read by scanning the chunks.
+"""
+import json
+import lzma
+import struct
+import zlib
+import numpy as np
+from explorepy.parser import DataBlock
+from explorepy.timesync import sample_times
+from explorepy.writers import StreamWriter
+
+EXZ_MAGIC = b'EXPLOREZ'
+CHUNK_MAGIC = b'CHNK'
+FILE_HEADER = struct.Struct('<8s8sd')  # magic, codec, sampling rate
+CHUNK_HEADER = struct.Struct('<4sIIIIIddd')  # magic, size, n_chan, n_exg, n_orn, n_marker, resolution, t_start, t_end
+FOOTER = struct.Struct('<Q8s')  # index size, magic
+CODECS = {'zlib': (zlib.compress, zlib.decompress),
+          'lzma': (lzma.compress, lzma.decompress)}
+
+
+class ChunkedWriter:
+    """Writer of EXZ files
+
+    The writer takes ExG data like the other file writers (write method) and orientation and marker rows through
+    orn_writer and marker_writer. Complete chunks are compressed and written by the writer thread if one is given.
+    """
+
+    def __init__(self, fid, sampling_rate=250, chunk_duration=10, codec='zlib', writer_thread=None):
+        """
+        Args:
+            fid (file object): Output file object (binary mode)
+            sampling_rate (float): Sampling rate of ExG data
+            chunk_duration (float): Duration of ExG data in each chunk in seconds
+            codec (str): Compression codec {'zlib', 'lzma'}
+            writer_thread (WriterThread): Writer thread for compressing and writing chunks in the background (if None,
+                chunks are written directly)
+        """
+        assert codec in CODECS, "Invalid codec! Valid codecs are: " + str(list(CODECS))
+        self.fid = fid
+        self.sampling_rate = sampling_rate
+        self.chunk_size = int(chunk_duration * sampling_rate)
+        self.codec = codec
+        self.writer_thread = writer_thread
+        self.index = []
+        self._n_chan = None
+        self._resolution = None
+        self._n_exg = 0
+        self._exg, self._exg_ts = [], []
+        self._orn, self._orn_ts = [], []
+        self._marker, self._marker_ts = [], []
+        self.fid.write(FILE_HEADER.pack(EXZ_MAGIC, codec.encode('ascii'), sampling_rate))
+
+    def write(self, timestamp, data, resolution=None):
+        """Adds ExG samples to the current chunk
+
+        Args:
+            timestamp (float or np.ndarray): Timestamp of the first sample or of each sample
+            data (np.ndarray): ExG data in Volts with shape (n_sample, n_chan)
+            resolution (float): Volts per ADC count of the data
+        """
+        data = np.asarray(data)
+        if self._n_chan is None:
+            assert resolution is not None, "ADC resolution is needed for EXZ files!"
+            self._n_chan = data.shape[1]
+            self._resolution = resolution
+        assert data.shape[1] == self._n_chan, "Number of channels has changed!"
+        if np.isscalar(timestamp):
+            timestamp = sample_times(timestamp, data.shape[0], self.sampling_rate)
+        self._exg.append(np.rint(data / self._resolution).astype(np.int32))
+        self._exg_ts.append(np.asarray(timestamp, dtype=np.float64))
+        self._n_exg += data.shape[0]
+        if self._n_exg >= self.chunk_size:
+            self._write_chunk()
+
+    def write_orn(self, timestamp, data):
+        """Adds orientation rows (acc, gyro, mag) to the current chunk"""
+        data = np.asarray(data, dtype=np.float64)
+        self._orn.append(data)
+        self._orn_ts.append(np.broadcast_to(np.asarray(timestamp, dtype=np.float64), data.shape[:1]))
+
+    def write_marker(self, timestamp, data):
+        """Adds marker rows (marker code) to the current chunk"""
+        data = np.asarray(data)
+        self._marker.append(data[:, 0].astype(np.int32))
+        self._marker_ts.append(np.broadcast_to(np.asarray(timestamp, dtype=np.float64), data.shape[:1]))
+
+    @property
+    def orn_writer(self):
+        """Writer object adding orientation rows to the file"""
+        return StreamWriter(self.write_orn)
+
+    @property
+    def marker_writer(self):
+        """Writer object adding marker rows to the file"""
+        return StreamWriter(self.write_marker)
+
+    def _write_chunk(self):
+        n_chan = self._n_chan or 0
+        exg = np.concatenate(self._exg) if self._exg else np.empty((0, n_chan), dtype=np.int32)
+        exg_ts = np.concatenate(self._exg_ts) if self._exg_ts else np.empty(0)
+        orn = np.concatenate(self._orn) if self._orn else np.empty((0, 9))
+        orn_ts = np.concatenate(self._orn_ts) if self._orn_ts else np.empty(0)
+        marker = np.concatenate(self._marker) if self._marker else np.empty(0, dtype=np.int32)
+        marker_ts = np.concatenate(self._marker_ts) if self._marker_ts else np.empty(0)
+        self._n_exg = 0
+        self._exg, self._exg_ts = [], []
+        self._orn, self._orn_ts = [], []
+        self._marker, self._marker_ts = [], []
+        all_ts = np.concatenate((exg_ts, orn_ts, marker_ts))
+        if not len(all_ts):
+            return
+        # Neighbouring samples are close to each other, so the differences compress much better than the counts
+        exg_delta = np.diff(exg.T, axis=1, prepend=0).astype('<i4')
+        payload = b''.join([exg_ts.astype('<f8').tobytes(), exg_delta.tobytes(),
+                            orn_ts.astype('<f8').tobytes(), orn.astype('<f8').tobytes(),
+                            marker_ts.astype('<f8').tobytes(), marker.astype('<i4').tobytes()])
+        header = (n_chan, len(exg_ts), len(orn_ts), len(marker_ts), self._resolution or 0.,
+                  all_ts.min(), all_ts.max())
+        if self.writer_thread is None:
+            self._compress_chunk(header, payload)
+        else:
+            self.writer_thread.put(self._compress_chunk, header, payload, block=True)
+
+    def _compress_chunk(self, header, payload):
+        compressed = CODECS[self.codec][0](payload)
+        offset = self.fid.tell()
+        self.fid.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(compressed), *header) + compressed)
+        self.index.append((offset, header[-2], header[-1]))
+
+    def flush(self):
+        """Chunks are written as soon as they are complete; the last chunk is written by close()"""
+        pass
+
+    def close(self):
+        """Writes the last chunk and the footer index
+
+        If a writer thread is used, it has to be stopped before closing, so that all chunks are in the file.
+        """
+        self.writer_thread = None
+        self._write_chunk()
+        index = json.dumps({'chunks': self.index}).encode('ascii')
+        self.fid.write(index + FOOTER.pack(len(index), EXZ_MAGIC))
+        self.fid.flush()
+
+
+class ChunkedReader:
+    """Reader of EXZ files which decompresses only the chunks of the requested time range"""
+
+    def __init__(self, file_name):
+        """
+        Args:
+            file_name (str): EXZ file name
+        """
+        self.fid = open(file_name, "rb")
+        magic, codec, self.sampling_rate = FILE_HEADER.unpack(self.fid.read(FILE_HEADER.size))
+        assert magic == EXZ_MAGIC, "File is not an EXZ file!"
+        self.codec = codec.rstrip(b'\x00').decode('ascii')
+        chunks = self._read_index()
+        if chunks is None:
+            chunks = self._scan_chunks()
+        self.offset = np.array([chunk[0] for chunk in chunks], dtype=np.int64)
+        self.t_start = np.array([chunk[1] for chunk in chunks])
+        self.t_end = np.array([chunk[2] for chunk in chunks])
+
+    def __len__(self):
+        return len(self.offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.fid.close()
+
+    def _read_index(self):
+        file_size = self.fid.seek(0, 2)
+        if file_size < FILE_HEADER.size + FOOTER.size:
+            return None
+        self.fid.seek(file_size - FOOTER.size)
+        index_size, magic = FOOTER.unpack(self.fid.read(FOOTER.size))
+        if magic != EXZ_MAGIC:
+            return None
+        self.fid.seek(file_size - FOOTER.size - index_size)
+        return json.loads(self.fid.read(index_size).decode('ascii'))['chunks']
+
+    def _scan_chunks(self):
+        chunks = []
+        offset = FILE_HEADER.size
+        while True:
+            self.fid.seek(offset)
+            header = self.fid.read(CHUNK_HEADER.size)
+            if len(header) < CHUNK_HEADER.size:
+                break
+            magic, size, _, _, _, _, _, t_start, t_end = CHUNK_HEADER.unpack(header)
+            if magic != CHUNK_MAGIC or len(self.fid.read(size)) < size:
+                break
+            chunks.append((offset, t_start, t_end))
+            offset += CHUNK_HEADER.size + size
+        return chunks
+
+    def _read_chunk(self, offset):
+        self.fid.seek(offset)
+        _, size, n_chan, n_exg, n_orn, n_marker, resolution, _, _ = \
+            CHUNK_HEADER.unpack(self.fid.read(CHUNK_HEADER.size))
+        payload = CODECS[self.codec][1](self.fid.read(size))
+        sizes = [8 * n_exg, 4 * n_chan * n_exg, 8 * n_orn, 72 * n_orn, 8 * n_marker, 4 * n_marker]
+        parts = np.split(np.frombuffer(payload, dtype=np.uint8), np.cumsum(sizes)[:-1])
+        exg_counts = np.cumsum(parts[1].view('<i4').reshape(n_chan, n_exg), axis=1, dtype=np.int32)
+        return (exg_counts * resolution, parts[0].view('<f8'), parts[3].view('<f8').reshape(n_orn, 9),
+                parts[2].view('<f8'), parts[5].view('<i4'), parts[4].view('<f8'))
+
+    def read(self, t_start=-np.inf, t_end=np.inf):
+        """Reads the data of the time range [t_start, t_end)
+
+        Args:
+            t_start (float): Start time in seconds
+            t_end (float): End time in seconds
+
+        Returns:
+            DataBlock object (without environment data)
+        """
+        selected = np.flatnonzero((self.t_end >= t_start) & (self.t_start < t_end))
+        chunks = [self._read_chunk(offset) for offset in self.offset[selected]]
+        n_chan = max([chunk[0].shape[0] for chunk in chunks], default=0)
+        exg = np.concatenate([np.empty((n_chan, 0))] + [chunk[0] for chunk in chunks if chunk[1].size], axis=1)
+        values = [np.concatenate([np.empty(0)] + [chunk[i] for chunk in chunks]) for i in (1, 3, 5)]
+        orn = np.concatenate([np.empty((0, 9))] + [chunk[2] for chunk in chunks])
+        marker = np.concatenate([np.empty(0, dtype=np.int32)] + [chunk[4] for chunk in chunks])
+        exg_mask, orn_mask, marker_mask = [(ts >= t_start) & (ts < t_end) for ts in values]
+        return DataBlock(exg=exg[:, exg_mask], exg_timestamp=values[0][exg_mask],
+                         orn=orn[orn_mask], orn_timestamp=values[1][orn_mask],
+                         marker=marker[marker_mask], marker_timestamp=values[2][marker_mask],
+                         env=np.empty((0, 3)), env_timestamp=np.empty(0))
@@ -3,6 +3,7 @@ import sys
 import argparse
 from explorepy.tools import bin2csv, bt_scan
 from explorepy.explore import Explore
+from explorepy.offline import filter_npy
 from explorepy.command import Command
 
 
@@ -64,6 +65,20 @@ class CLI:
         parser.add_argument("-d", "--duration", type=int, default=None,
                             help="Recording duration in seconds")
 
+        parser.add_argument("-t", "--type",
+                            dest="file_type", type=str, default='csv', choices=['csv', 'bdf', 'exz', 'npy'],
+                            help="Output file type.")
+
+        parser.add_argument("-s", "--segment", type=float, default=None,
+                            help="Split the recording into segments of the given duration in seconds")
+
+        parser.add_argument("-r", "--raw", action='store_true',
+                            help="Also save the raw data of the device to a BIN file")
+
+        parser.add_argument("-g", "--gap",
+                            dest="gap_policy", type=str, default=None, choices=['nan', 'hold', 'interpolate'],
+                            help="Fill the ExG samples lost on the link with NaN, the last value or interpolated values")
+
         args = parser.parse_args(sys.argv[2:])
 
         if args.name is None:
@@ -72,7 +87,9 @@ class CLI:
             explorer.connect(device_name=args.name)
 
         assert (args.filename is not None), "Missing Filename"
-        explorer.record_data(file_name=args.filename, do_overwrite=args.overwrite, duration=args.duration)
+        explorer.record_data(file_name=args.filename, do_overwrite=args.overwrite, duration=args.duration,
+                             file_type=args.file_type, segment_duration=args.segment, save_raw=args.raw,
+                             gap_policy=args.gap_policy)
 
     @staticmethod
     def push2lsl():
@@ -92,6 +109,14 @@ class CLI:
                             dest="channels", type=int, default=None,
                             help="the device's number of channels")
 
+        parser.add_argument("-k", "--chunk",
+                            dest="chunk", type=int, default=None,
+                            help="Number of ExG samples per lsl chunk (default: samples of one packet)")
+
+        parser.add_argument("-r", "--resample",
+                            dest="resample", type=float, default=None,
+                            help="Sampling rate of an additional resampled ExG stream.")
+
         args = parser.parse_args(sys.argv[2:])
 
         if args.name is None:
@@ -99,7 +124,7 @@ class CLI:
         else:
             explorer.connect(device_name=args.name)
 
-        explorer.push2lsl(n_chan=args.channels)
+        explorer.push2lsl(n_chan=args.channels, chunk_size=args.chunk, resampled_rate=args.resample)
 
     @staticmethod
     def bin2csv():
@@ -113,9 +138,53 @@ class CLI:
         parser.add_argument("-o", "--overwrite", action='store_false',
                             help="Overwrite files with same name.")
 
+        parser.add_argument("-j", "--jobs",
+                            dest="jobs", type=int, default=1,
+                            help="Number of parallel worker processes.")
+
+        parser.add_argument("-t", "--type",
+                            dest="file_type", type=str, default='csv', choices=['csv', 'bdf', 'exz', 'npy'],
+                            help="Output file type.")
+
+        args = parser.parse_args(sys.argv[2:])
+
+        bin2csv(args.inputfile, args.overwrite, workers=args.jobs, file_type=args.file_type)
+
+    @staticmethod
+    def filter_npy():
+        parser = argparse.ArgumentParser(
+            description='Zero-phase filtering of an npy recording')
+
+        parser.add_argument("-i", "--inputfile",
+                            dest="inputfile", type=str, default=None,
+                            help="Name of the npy file.")
+
+        parser.add_argument("-f", "--outputfile",
+                            dest="outputfile", type=str, default=None,
+                            help="Name of the filtered npy file.")
+
+        parser.add_argument("-lf", "--lowfreq",
+                            dest="lowfreq", type=float, default=None,
+                            help="Low cut-off frequency of the bandpass filter.")
+
+        parser.add_argument("-hf", "--highfreq",
+                            dest="highfreq", type=float, default=None,
+                            help="High cut-off frequency of the bandpass filter.")
+
+        parser.add_argument("-nf", "--notchfreq",
+                            dest="notchfreq", type=int, default=None,
+                            help="Frequency of notch filter.")
+
+        parser.add_argument("-j", "--jobs",
+                            dest="jobs", type=int, default=1,
+                            help="Number of parallel threads.")
+
         args = parser.parse_args(sys.argv[2:])
 
-        bin2csv(args.inputfile, args.overwrite)
+        bp_freq = None
+        if args.lowfreq is not None or args.highfreq is not None:
+            bp_freq = (args.lowfreq, args.highfreq)
+        filter_npy(args.inputfile, args.outputfile, bp_freq=bp_freq, notch_freq=args.notchfreq, n_jobs=args.jobs)
 
     @staticmethod
     def visualize():
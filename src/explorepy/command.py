@@ -131,6 +131,7 @@ class SetSPS(Command2B):
         """
         super().__init__()
         self.opcode = OpcodeID.CMD_SPS_SET
+        self.sps_rate = sps_rate
         if sps_rate == 250:
             self.param = b'\x01'
         elif sps_rate == 500:
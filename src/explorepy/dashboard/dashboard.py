@@ -41,8 +41,9 @@ FFT_COLORS = Colorblind[8]
 class Dashboard:
     """Explorepy dashboard class"""
 
-    def __init__(self, n_chan, mode="signal"):
+    def __init__(self, n_chan, mode="signal", sampling_rate=EEG_SRATE):
         self.n_chan = n_chan
+        self.sampling_rate = sampling_rate
         self.y_unit = DEFAULT_SCALE
         self.offsets = np.arange(1, self.n_chan + 1)[:, np.newaxis].astype(float)
         self.chan_key_list = ['Ch' + str(i + 1) for i in range(self.n_chan)]
@@ -171,7 +172,7 @@ class Dashboard:
         new_data['t'] = time_vector
         if self.recording==True:
             pickle.dump(new_data,self.file_dump)
-        self.exg_source.stream(new_data, rollover=2 * EEG_SRATE * WIN_LENGTH)
+        self.exg_source.stream(new_data, rollover=int(2 * self.sampling_rate * WIN_LENGTH))
 
     @gen.coroutine
     def update_orn(self, timestamp, orn_data):
@@ -224,9 +225,9 @@ class Dashboard:
         exg_data = np.array([self.exg_source.data[key] for key in self.chan_key_list])
 
         # Check if the length of data is enough for FFT
-        if exg_data.shape[1] < EEG_SRATE * 4.5:
+        if exg_data.shape[1] < self.sampling_rate * 4.5:
             return
-        fft_content, freq = get_fft(exg_data)
+        fft_content, freq = get_fft(exg_data, self.sampling_rate)
         data = dict(zip(self.chan_key_list, fft_content))
         data['f'] = freq
         self.fft_source.data = data
@@ -238,7 +239,7 @@ class Dashboard:
             self.heart_rate_source.stream({'heart_rate': ['NA']}, rollover=1)
             return
         if self.rr_estimator is None:
-            self.rr_estimator = HeartRateEstimator()
+            self.rr_estimator = HeartRateEstimator(fs=self.sampling_rate)
             # Init R-peaks plot
             self.exg_plot.circle(x='t', y='r_peak', source=self.r_peak_source,
                                  fill_color="red", size=8)
@@ -471,12 +472,12 @@ class Dashboard:
             plot.x_range.min_interval = t_length
 
 
-def get_fft(exg):
+def get_fft(exg, sampling_rate=EEG_SRATE):
     """Compute FFT"""
     n_chan, n_sample = exg.shape
-    L = n_sample / EEG_SRATE
+    L = n_sample / sampling_rate
     n = 1024
-    freq = EEG_SRATE * np.arange(int(n / 2)) / n
+    freq = sampling_rate * np.arange(int(n / 2)) / n
     fft_content = np.fft.fft(exg, n=n) / n
     fft_content = np.abs(fft_content[:, range(int(n / 2))])
     return fft_content[:, 1:], freq[1:]
@@ -4,13 +4,16 @@ from explorepy.bt_client import BtClient
 from explorepy.parser import Parser
 from explorepy.dashboard.dashboard import Dashboard
 import bluetooth
-import csv
 import os
 import time
+from contextlib import ExitStack
 from pylsl import StreamInfo, StreamOutlet
 from threading import Thread, Timer
 from datetime import datetime
-from explorepy.packet import CommandRCV, CommandStatus, CalibrationInfo, MarkerEvent
+from explorepy.packet import CommandRCV, CommandStatus, CalibrationInfo, MarkerEvent, EEG
+from explorepy.outlets import ChunkedOutlet
+from explorepy.pipeline import Pipeline, Resample
+from explorepy.writers import WriterThread, SegmentedRecording, RawWriter, get_out_files, open_file_writers
 
 class Explore:
     r"""Mentalab Explore device"""
@@ -23,6 +26,7 @@ class Explore:
         self.socket = None
         self.parser = None
         self.m_dashboard = None
+        self.writer_thread = None
         for i in range(n_device):
             self.device.append(BtClient())
         self.is_connected = False
@@ -88,93 +92,202 @@ class Explore:
 
         print("Data acquisition stopped after ", duration, " seconds.")
 
-    def record_data(self, file_name, do_overwrite=False, device_id=0, duration=None):
+    def record_data(self, file_name, do_overwrite=False, device_id=0, duration=None, max_queue=64, file_type='csv',
+                    segment_duration=None, segment_size=None, save_raw=False, fsync_interval=1., gap_policy=None,
+                    pipeline=None):
         r"""Records the data in real-time
 
+        Files are written by a background writer thread, so that slow disk writes do not delay reading from the
+        device. During the recording, the queue depth and the number of dropped blocks can be checked in
+        `self.writer_thread`.
+
+        If the sampling rate of the device changes during the recording, csv recordings continue with the new rate;
+        the other file types and segmented recordings have one sampling rate, so the recording is stopped with a
+        RuntimeError.
+
         Args:
             file_name (str): output file name
             device_id (int): device id (not needed in the current version)
             do_overwrite (bool): Overwrite if files exist already
             duration (float): Duration of recording in seconds (if None records endlessly).
+            max_queue (int): Maximum number of data blocks waiting to be written to disk
+            file_type (str): File type {'csv', 'bdf', 'exz', 'npy'}. In BDF files, markers are stored as annotations
+                and orientation data is written to a csv file. EXZ files are compressed files with all data (see
+                explorepy.chunked). With 'npy', ExG data is written to a memory-mapped .npy file with a JSON sidecar
+                file containing the markers and orientation data is written to a csv file.
+            segment_duration (float): If given, the recording is split into segments of this duration in seconds
+            segment_size (int): If given, the recording is split into segments of about this size in bytes
+            save_raw (bool): Also save the raw bytes received from the device to file_name.BIN, from which the
+                recording can be rebuilt with bin2csv
+            fsync_interval (float): Time in seconds between syncs of the raw file to disk
+            gap_policy (str): Filling of ExG samples lost on the link {'nan', 'hold', 'interpolate', None}. NaN values
+                can only be stored in csv and npy files.
+            pipeline (explorepy.pipeline.Pipeline): Processing of ExG data before it is written (e.g. filters or
+                decimation), no processing if None
+
+        For segmented recordings, the files of each segment get the segment number as suffix (e.g. name_001_ExG.csv)
+        and name_manifest.json lists the files and the time range of every segment.
         """
         assert self.is_connected, "Explore device is not connected. Please connect the device first."
 
         # Check invalid characters
         if set(r'[<>/{}[\]~`]*%').intersection(file_name):
             raise ValueError("Invalid character in file name")
+        assert gap_policy != 'nan' or file_type in ('csv', 'npy'), "NaN gaps can only be stored in csv and npy files!"
+        assert gap_policy != 'nan' or pipeline is None, "NaN gaps can not be processed by a pipeline!"
 
         time_offset = None
-        exg_out_file = file_name + "_ExG.csv"
-        orn_out_file = file_name + "_ORN.csv"
-        marker_out_file = file_name + "_Marker.csv"
-
-        if not do_overwrite:
-            assert not os.path.isfile(exg_out_file), exg_out_file + " already exists!"
-            assert not os.path.isfile(orn_out_file), orn_out_file + " already exists!"
-            assert not os.path.isfile(marker_out_file), marker_out_file + " already exists!"
-
-        with open(exg_out_file, "w") as f_exg, open(orn_out_file, "w") as f_orn, open(marker_out_file, "w") as f_marker:
-            f_orn.write("TimeStamp,ax,ay,az,gx,gy,gz,mx,my,mz\n")
-            # f_orn.write(
-            #     "hh:mm:ss,mg/LSB,mg/LSB,mg/LSB,mdps/LSB,mdps/LSB,mdps/LSB,mgauss/LSB,mgauss/LSB,mgauss/LSB\n")
-            f_exg.write("TimeStamp,ch1,ch2,ch3,ch4,ch5,ch6,ch7,ch8\n")
-            f_marker.write("TimeStamp,Marker_code\n")
-
-            csv_exg = csv.writer(f_exg, delimiter=",")
-            csv_orn = csv.writer(f_orn, delimiter=",")
-            csv_marker = csv.writer(f_marker, delimiter=",")
-
-            is_acquiring = [True]
-
-            def stop_acquiring(flag):
-                flag[0] = False
-
-            if duration is not None:
-                Timer(duration, stop_acquiring, [is_acquiring]).start()
-                print("Start recording for ", duration, " seconds...")
-            else:
-                print("Recording...")
+        is_segmented = segment_duration is not None or segment_size is not None
+        if is_segmented:
+            out_files = SegmentedRecording.get_segment_files(file_name, file_type, 1)
+            out_files['manifest'] = file_name + '_manifest.json'
+        else:
+            out_files = get_out_files(file_name, file_type)
 
-            while is_acquiring[0]:
-                try:
-                    # self.parser.parse_packet()
-                    packet = self.parser.parse_packet(mode="record", csv_files=(csv_exg, csv_orn, csv_marker))
-                    if time_offset is not None:
-                        packet.timestamp = packet.timestamp-time_offset
-                    else:
-                        time_offset = packet.timestamp
+        if save_raw:
+            out_files['raw'] = file_name + '.BIN'
 
-                except ValueError:
-                    # If value error happens, scan again for devices and try to reconnect (see reconnect function)
-                    print("Disconnected, scanning for last connected device")
-                    self.parser.socket = self.device[device_id].bt_connect()
-                except bluetooth.BluetoothError as error:
-                    print("Bluetooth Error: Timeout, attempting reconnect. Error: ", error)
-                    self.parser.socket = self.device[device_id].bt_connect()
+        if not do_overwrite:
+            for out_file in out_files.values():
+                assert not os.path.isfile(out_file), out_file + " already exists!"
+
+        with ExitStack() as stack:
+            self.writer_thread = WriterThread(max_queue=max_queue)
+            csv_files, recording, file_writer, raw_writer, timer = (), None, None, None, None
+            previous_gap_policy = self.parser.gap_policy
+            self.parser.gap_policy = gap_policy
+
+            def update_sampling_rate(new_rate):
+                # Only csv files have a timestamp for each sample; the other files have one sampling rate
+                if file_type != 'csv' or is_segmented:
+                    raise RuntimeError("The sampling rate of the device has changed during the recording, which is "
+                                       "not supported for " + ('segmented' if is_segmented else file_type) +
+                                       " recordings!")
+                if pipeline is not None:
+                    pipeline.set_sampling_rate(new_rate)
+                    new_rate = pipeline.sampling_rate_out
+                csv_files[0].sampling_rate = new_rate
+                print("The sampling rate has changed to ", new_rate, " Hz.")
+
+            # The files are completed and closed even if the recording is interrupted (e.g. by Ctrl-C)
+            try:
+                if save_raw:
+                    raw_writer = RawWriter(stack.enter_context(open(out_files['raw'], "wb")),
+                                           fsync_interval=fsync_interval, writer_thread=self.writer_thread)
+                    self.parser.raw_tee = raw_writer
+                sampling_rate = self.parser.detect_sampling_rate()
+                if pipeline is not None:
+                    pipeline.set_sampling_rate(sampling_rate)
+                    sampling_rate = pipeline.sampling_rate_out
+                if is_segmented:
+                    recording = SegmentedRecording(file_name, file_type, sampling_rate=sampling_rate,
+                                                   writer_thread=self.writer_thread, segment_duration=segment_duration,
+                                                   segment_size=segment_size)
+                    csv_files = recording.writers
+                else:
+                    csv_files, file_writer = open_file_writers(stack, file_type, out_files,
+                                                               sampling_rate=sampling_rate,
+                                                               writer_thread=self.writer_thread)
+                self.parser.sampling_rate_callbacks.append(update_sampling_rate)
+
+                is_acquiring = [True]
+
+                def stop_acquiring(flag):
+                    flag[0] = False
+
+                if duration is not None:
+                    timer = Timer(duration, stop_acquiring, [is_acquiring])
+                    timer.start()
+                    print("Start recording for ", duration, " seconds...")
+                else:
+                    print("Recording...")
+
+                while is_acquiring[0]:
+                    try:
+                        # self.parser.parse_packet()
+                        packet = self.parser.parse_packet(mode="record", csv_files=csv_files, pipeline=pipeline)
+                        if time_offset is not None:
+                            packet.timestamp = packet.timestamp-time_offset
+                        else:
+                            time_offset = packet.timestamp
+
+                    except ValueError:
+                        # If value error happens, scan again for devices and try to reconnect (see reconnect function)
+                        print("Disconnected, scanning for last connected device")
+                        self.parser.socket = self.device[device_id].bt_connect()
+                    except bluetooth.BluetoothError as error:
+                        print("Bluetooth Error: Timeout, attempting reconnect. Error: ", error)
+                        self.parser.socket = self.device[device_id].bt_connect()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                for csv_writer in csv_files:
+                    csv_writer.flush()
+                if recording is not None:
+                    recording.close()
+                self.parser.raw_tee = None
+                self.writer_thread.stop()
+                if raw_writer is not None:
+                    raw_writer.close()
+                if file_writer is not None:
+                    file_writer.close()
+                self.parser.gap_policy = previous_gap_policy
+                if update_sampling_rate in self.parser.sampling_rate_callbacks:
+                    self.parser.sampling_rate_callbacks.remove(update_sampling_rate)
             print("Recording finished after ", duration, " seconds.")
-            f_marker.close()
-            f_exg.close()
-            f_orn.close()
-
-    def push2lsl(self, n_chan, device_id=0, duration=None):
+            if self.writer_thread.dropped_blocks:
+                print(self.writer_thread.dropped_blocks, " data blocks could not be written in time and have been "
+                                                         "dropped.")
+            if self.parser.packets_dropped:
+                print(self.parser.packets_dropped, " corrupt packets (", self.parser.bytes_skipped,
+                      " bytes) have been skipped.")
+            if self.parser.sequence.n_lost:
+                print(self.parser.sequence)
+                if self.parser.samples_filled:
+                    print(self.parser.samples_filled, " missing ExG samples have been filled.")
+
+    def push2lsl(self, n_chan, device_id=0, duration=None, chunk_size=None, pipeline=None, resampled_rate=None):
         r"""Push samples to two lsl streams
 
+        Samples are pushed in chunks with timestamps from the device clock, mapped to the lsl clock by the clock
+        synchronization of the parser.
+
         Args:
             device_id (int): device id (not needed in the current version)
             n_chan (int): Number of channels (4 or 8)
             duration (float): duration of data acquiring (if None it streams endlessly).
+            chunk_size (int): Number of ExG samples per chunk (if None, the samples of each packet are pushed as one
+                chunk). Larger chunks need less processing but increase the latency.
+            pipeline (explorepy.pipeline.Pipeline): Processing of ExG data before it is pushed (e.g. filters or
+                decimation), no processing if None
+            resampled_rate (float): If given, the ExG data is also pushed to a second stream resampled to this rate
+                (e.g. for consumers which only need 100 Hz)
         """
 
         assert (n_chan is not None), "Number of channels missing"
         assert self.is_connected, "Explore device is not connected. Please connect the device first."
 
         info_orn = StreamInfo('Explore', 'Orientation', 9, 20, 'float32', 'ORN')
-        info_exg = StreamInfo('Explore', 'ExG', n_chan, 250, 'float32', 'ExG')
+        sampling_rate = self.parser.detect_sampling_rate()
+        if pipeline is not None:
+            pipeline.configure(n_chan, sampling_rate)
+            n_chan, sampling_rate = pipeline.n_chan_out, pipeline.sampling_rate_out
+        info_exg = StreamInfo('Explore', 'ExG', n_chan, sampling_rate, 'float32', 'ExG')
         info_marker = StreamInfo('Explore', 'Markers', 1, 0, 'int32', 'Marker')
 
-        orn_outlet = StreamOutlet(info_orn)
-        exg_outlet = StreamOutlet(info_exg)
-        marker_outlet = StreamOutlet(info_marker)
+        clock = self.parser.clock
+        orn_outlet = ChunkedOutlet(StreamOutlet(info_orn), sampling_rate=20, chunk_size=1, clock=clock)
+        exg_outlet = ChunkedOutlet(StreamOutlet(info_exg), sampling_rate=sampling_rate,
+                                   chunk_size=chunk_size, clock=clock)
+        resampled_outlet = None
+        if resampled_rate is not None:
+            resampler = Pipeline([Resample.from_rates(sampling_rate, resampled_rate)], sampling_rate=sampling_rate,
+                                 n_chan=n_chan)
+            info_resampled = StreamInfo('Explore', 'ExG', n_chan, resampler.sampling_rate_out, 'float32',
+                                        'ExG_' + str(resampler.sampling_rate_out))
+            resampled_outlet = ChunkedOutlet(StreamOutlet(info_resampled), sampling_rate=resampler.sampling_rate_out,
+                                             chunk_size=chunk_size, clock=clock)
+        marker_outlet = ChunkedOutlet(StreamOutlet(info_marker), sampling_rate=0, clock=clock)
 
         is_acquiring = [True]
 
@@ -187,25 +300,41 @@ class Explore:
         else:
             print("Pushing to lsl...")
 
-        while is_acquiring[0]:
+        def refuse_sampling_rate(new_rate):
+            raise RuntimeError("The sampling rate of the device has changed to " + str(new_rate) + " Hz, which is not "
+                               "supported by the running lsl streams!")
 
-            try:
-                self.parser.parse_packet(mode="lsl", outlets=(orn_outlet, exg_outlet, marker_outlet))
-            except ValueError:
-                # If value error happens, scan again for devices and try to reconnect (see reconnect function)
-                print("Disconnected, scanning for last connected device")
-                self.socket = self.device[device_id].bt_connect()
-                time.sleep(1)
-                self.parser = Parser(self.socket)
+        # The lsl streams have a fixed nominal rate
+        self.parser.sampling_rate_callbacks.append(refuse_sampling_rate)
+        try:
+            while is_acquiring[0]:
 
-            except bluetooth.BluetoothError as error:
-                print("Bluetooth Error: Timeout, attempting reconnect. Error: ", error)
-                self.socket = self.device[device_id].bt_connect()
-                time.sleep(1)
-                self.parser = Parser(self.socket)
+                try:
+                    packet = self.parser.parse_packet(mode="lsl", outlets=(orn_outlet, exg_outlet, marker_outlet),
+                                                      pipeline=pipeline)
+                    if resampled_outlet is not None and isinstance(packet, EEG):
+                        resampled = resampler.apply(packet.data)
+                        if resampled.shape[1]:
+                            resampled_outlet.push(packet.timestamp + resampler.time_shift, resampled.T)
+                except ValueError:
+                    # If value error happens, scan again for devices and try to reconnect (see reconnect function)
+                    print("Disconnected, scanning for last connected device")
+                    self.parser.socket = self.device[device_id].bt_connect()
+                    time.sleep(1)
+
+                except bluetooth.BluetoothError as error:
+                    print("Bluetooth Error: Timeout, attempting reconnect. Error: ", error)
+                    self.parser.socket = self.device[device_id].bt_connect()
+                    time.sleep(1)
+        finally:
+            self.parser.sampling_rate_callbacks.remove(refuse_sampling_rate)
+
+        exg_outlet.flush()
+        if resampled_outlet is not None:
+            resampled_outlet.flush()
         print("Data acquisition finished after ", duration, " seconds.")
 
-    def visualize(self, n_chan, device_id=0, bp_freq=(1, 30), notch_freq=50):
+    def visualize(self, n_chan, device_id=0, bp_freq=(1, 30), notch_freq=50, display_rate=None):
         r"""Visualization of the signal in the dashboard
         Args:
             n_chan (int): Number of channels device_id (int): Device ID (in case of multiple device connection)
@@ -213,20 +342,39 @@ class Explore:
             bp_freq (tuple): Bandpass filter cut-off frequencies (low_cutoff_freq, high_cutoff_freq), No bandpass filter
             if it is None.
             notch_freq (int): Line frequency for notch filter (50 or 60 Hz), No notch filter if it is None
+            display_rate (float): If given, ExG data is resampled to this rate for the dashboard, which reduces the
+                number of points to draw
         """
         assert self.is_connected, "Explore device is not connected. Please connect the device first."
 
-        self.m_dashboard = Dashboard(n_chan=n_chan)
+        # The filters of the connection's parser are replaced, so no bytes already read from the socket are lost
+        self.parser.set_filters(bp_freq=bp_freq, notch_freq=notch_freq)
+        sampling_rate = self.parser.detect_sampling_rate()
+        if display_rate is not None:
+            # The resampling stage keeps the display rate if the sampling rate of the device changes
+            stages = self.parser.pipeline.stages if self.parser.pipeline is not None else []
+            self.parser.pipeline = Pipeline(stages + [Resample.from_rates(sampling_rate, display_rate)],
+                                            sampling_rate=sampling_rate)
+            sampling_rate = self.parser.pipeline.sampling_rate_out
+        self.m_dashboard = Dashboard(n_chan=n_chan, sampling_rate=sampling_rate)
+        self._follow_sampling_rate()
         self.m_dashboard.start_server()
 
         thread = Thread(target=self._io_loop)
         thread.setDaemon(True)
         thread.start()
 
-        self.parser = Parser(socket=self.socket, bp_freq=bp_freq, notch_freq=notch_freq)
-
         self.m_dashboard.start_loop()
 
+    def _follow_sampling_rate(self):
+        """Keeps the sampling rate of the dashboard up to date if the sampling rate of the device changes"""
+        if self._update_dashboard_rate not in self.parser.sampling_rate_callbacks:
+            self.parser.sampling_rate_callbacks.append(self._update_dashboard_rate)
+
+    def _update_dashboard_rate(self, sampling_rate):
+        pipeline = self.parser.pipeline
+        self.m_dashboard.sampling_rate = sampling_rate if pipeline is None else pipeline.sampling_rate_out
+
     def _io_loop(self, device_id=0, mode="visualize"):
         is_acquiring = True
 
@@ -260,15 +408,16 @@ class Explore:
         """
         assert self.is_connected, "Explore device is not connected. Please connect the device first."
         try:
-            self.m_dashboard = Dashboard(n_chan=n_chan, mode="impedance")
+            self.parser.set_filters(bp_freq=(61, 64), notch_freq=notch_freq)
+            self.m_dashboard = Dashboard(n_chan=n_chan, mode="impedance",
+                                         sampling_rate=self.parser.detect_sampling_rate())
+            self._follow_sampling_rate()
             self.m_dashboard.start_server()
 
             thread = Thread(target=self._io_loop, args=(device_id, "impedance",))
             thread.setDaemon(True)
             thread.start()
 
-            self.parser = Parser(socket=self.socket, bp_freq=(61, 64), notch_freq=notch_freq)
-
             # Activate impedance measurement mode in the device
             from explorepy import command
             imp_activate_cmd = command.ZmeasurementEnable()
@@ -290,7 +439,7 @@ class Explore:
         Returns:
 
         """
-        from explorepy.command import send_command
+        from explorepy.command import send_command, SetSPS
 
         assert self.is_connected, "Explore device is not connected. Please connect the device first."
 
@@ -348,6 +497,9 @@ class Explore:
                 self.parser.socket = self.device[device_id].bt_connect()
         if not command_processed:
             print("No status message has been received after ", waiting_time, " seconds. Please send the command again")
+        elif isinstance(command, SetSPS):
+            # Filters and writers of the following acquisitions use the new rate
+            self.parser.sampling_rate = command.sps_rate
 
 
 if __name__ == '__main__':
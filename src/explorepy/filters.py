@@ -1,71 +1,179 @@
+import json
 import numpy as np
-from scipy.signal import butter, lfilter, iirnotch, iirfilter
+from scipy.signal import butter, sosfilt
+
+# Filter designs shared by all Filter objects of the process, keyed by (type, sampling rate, band, order)
+_design_cache = {}
+
+
+def design_sos(btype, band, order, sampling_rate):
+    """Designs a Butterworth filter as second-order sections
+
+    Designs are cached, so filters with the same parameters (e.g. after a reconnection or in several parsers) are only
+    designed once per process. The cached arrays are read-only; a copy is returned, so it can be passed to the scipy
+    filter functions and changed by the caller.
+
+    Args:
+        btype (str): Filter type {'band', 'bandstop', 'lowpass', 'highpass'}
+        band (tuple): Cut-off frequency or tuple of (low, high) cut-off frequencies in Hz
+        order (int): Filter order
+        sampling_rate (float): Sampling rate in Hz
+
+    Returns:
+        np.ndarray of second-order sections
+    """
+    key = (btype, float(sampling_rate), tuple(float(freq) for freq in np.atleast_1d(band)), int(order))
+    sos = _design_cache.get(key)
+    if sos is None:
+        sos = butter(order, key[2] if len(key[2]) > 1 else key[2][0], btype=btype, output='sos', fs=key[1])
+        sos.setflags(write=False)
+        _design_cache[key] = sos
+    return sos.copy()
+
+
+def save_design_cache(file_name):
+    """Saves the cached filter designs to a npz file
+
+    Args:
+        file_name (str): Output file name
+    """
+    with open(file_name, "wb") as f_cache:
+        np.savez(f_cache, **{json.dumps(key): sos for key, sos in _design_cache.items()})
+
+
+def load_design_cache(file_name):
+    """Adds the filter designs of a file written by save_design_cache to the cache
+
+    Args:
+        file_name (str): Cache file name
+    """
+    with np.load(file_name) as data:
+        for name in data.files:
+            btype, sampling_rate, band, order = json.loads(name)
+            sos = data[name]
+            sos.setflags(write=False)
+            _design_cache.setdefault((btype, sampling_rate, tuple(band), order), sos)
 
 
 class Filter:
-    def __init__(self, l_freq, h_freq, line_freq=50, order=5):
+    """Real-time ExG filter
+
+    Filters are designed as second-order sections (SOS), which stay numerically stable for narrow bands and high
+    sampling rates. apply() runs the notch filter, the bandpass filter and any added stages as one cascade; the filter
+    states are carried from call to call, so consecutive packets are filtered like one continuous signal.
+    """
+
+    def __init__(self, l_freq, h_freq, line_freq=50, order=5, sampling_rate=250.):
+        """
+        Args:
+            l_freq (float): Low cut-off frequency of the bandpass filter (None for no bandpass filter in apply)
+            h_freq (float): High cut-off frequency of the bandpass filter
+            line_freq (float): Line frequency for the notch filter (None for no notch filter in apply)
+            order (int): Order of the bandpass filter
+            sampling_rate (float): Sampling rate of the data
+        """
         self.low_cutoff_freq = l_freq
         self.high_cutoff_freq = h_freq
         self.line_freq = line_freq
-        self.sample_frequency = 250.0
+        self.sample_frequency = float(sampling_rate)
         self.order = order
         self.bp_param = None
         self.notch_param = None
         self.bp_param_test = None
+        self.cascade_param = None
+        self.extra_stages = []
+
+    @staticmethod
+    def _init_param(sos, nchan):
+        # States are kept in the layout of sosfilt (n_sections, n_chan, 2)
+        return {'sos': np.ascontiguousarray(sos, dtype=np.float64), 'zi': np.zeros((sos.shape[0], nchan, 2))}
+
+    def _design_bandpass(self, low_freq, high_freq):
+        return design_sos('band', (low_freq, high_freq), self.order, self.sample_frequency)
+
+    def _design_notch(self):
+        return design_sos('bandstop', (self.line_freq - 2, self.line_freq + 2), 5, self.sample_frequency)
 
     def _design_filter(self, nchan):
-        nyq = 0.5 * self.sample_frequency
-        low_freq = self.low_cutoff_freq / nyq
-        high_freq = self.high_cutoff_freq / nyq
-        b, a = butter(self.order, [low_freq, high_freq], btype='band')
-        zi = np.zeros((nchan, self.order*2))
-        self.bp_param = {'a': a, 'b': b, 'zi': zi}
+        self.bp_param = self._init_param(self._design_bandpass(self.low_cutoff_freq, self.high_cutoff_freq), nchan)
 
     def _design_filter_test(self, nchan):
-        nyq = 0.5 * self.sample_frequency
-        low_freq = (self.low_cutoff_freq+4) / nyq
-        high_freq = (self.high_cutoff_freq+4) / nyq
-        b, a = butter(self.order, [low_freq, high_freq], btype='band')
-        zi = np.zeros((nchan, self.order*2))
-        self.bp_param_test = {'a': a, 'b': b, 'zi': zi}
+        self.bp_param_test = self._init_param(self._design_bandpass(self.low_cutoff_freq + 4,
+                                                                    self.high_cutoff_freq + 4), nchan)
 
     def _design_notch_filter(self, nchan):
-        # Q = 50
-        # b, a = iirnotch(self.line_freq, Q, self.sample_frequency)
-        nyq = 0.5 * self.sample_frequency
-        low_freq = (self.line_freq-2) / nyq
-        high_freq = (self.line_freq+2) / nyq
-        b, a = iirfilter(5, [low_freq, high_freq], btype='bandstop', ftype='butter')
-        zi = np.zeros((nchan, 10))
-        self.notch_param = {'a': a, 'b': b, 'zi': zi}
+        self.notch_param = self._init_param(self._design_notch(), nchan)
+
+    def _design_cascade(self, nchan):
+        stages = []
+        if self.line_freq:
+            stages.append(self._design_notch())
+        if self.low_cutoff_freq is not None:
+            stages.append(self._design_bandpass(self.low_cutoff_freq, self.high_cutoff_freq))
+        stages += self.extra_stages
+        assert stages, "No filter stage has been defined!"
+        self.cascade_param = self._init_param(np.concatenate(stages), nchan)
+
+    @staticmethod
+    def _run(param, raw_data, out=None):
+        raw_data = np.asarray(raw_data)
+        if len(raw_data.shape) < 2:
+            raw_data = raw_data[np.newaxis, :]
+        if out is None or not (out.flags.c_contiguous and out.dtype == np.float64):
+            out = np.array(raw_data, dtype=np.float64, order='C')
+        elif out is not raw_data:
+            out[...] = raw_data
+        out[...], param['zi'] = sosfilt(param['sos'], out, zi=param['zi'])
+        return out
+
+    def set_sampling_rate(self, sampling_rate):
+        """Changes the sampling rate; the filters are designed again for the new rate at the next call
+
+        Args:
+            sampling_rate (float): Sampling rate of the data
+        """
+        if float(sampling_rate) != self.sample_frequency:
+            self.sample_frequency = float(sampling_rate)
+            self.bp_param = self.notch_param = self.bp_param_test = self.cascade_param = None
+
+    def add_stage(self, sos):
+        """Adds a filter stage to the cascade of apply (after the notch and bandpass filters)
+
+        Args:
+            sos (np.ndarray): Second-order sections of the filter with shape (n_sections, 6)
+        """
+        self.extra_stages.append(np.atleast_2d(sos))
+        self.cascade_param = None
+
+    def apply(self, raw_data, out=None):
+        """Filters the data with all stages (notch, bandpass and added stages) in one pass
+
+        Args:
+            raw_data (np.ndarray): Data with shape (n_chan, n_sample)
+            out (np.ndarray): Preallocated output array of the same shape (float64, C-contiguous); it may be raw_data
+                itself for filtering in place. If None, a new array is returned.
+
+        Returns:
+            Filtered data
+        """
+        if self.cascade_param is None:
+            self._design_cascade(nchan=np.atleast_2d(raw_data).shape[0])
+        return self._run(self.cascade_param, raw_data, out)
 
     def apply_bp_filter(self, raw_data):
-        if len(raw_data.shape) < 2:
-            raw_data = np.array(raw_data)[np.newaxis, :]
         if self.bp_param is None:
-            self._design_filter(nchan=raw_data.shape[0])
-
-        filtered_data, zi = lfilter(self.bp_param['b'], self.bp_param['a'], raw_data, zi=self.bp_param['zi'])
-        self.bp_param['zi'] = zi
-        return filtered_data
+            self._design_filter(nchan=np.atleast_2d(raw_data).shape[0])
+        return self._run(self.bp_param, raw_data)
 
     def apply_bp_filter_noise(self, raw_data):
-        if len(raw_data.shape) < 2:
-            raw_data = np.array(raw_data)[np.newaxis, :]
         if self.bp_param_test is None:
-            self._design_filter_test(nchan=raw_data.shape[0])
-
-        filtered_data, zi = lfilter(self.bp_param_test['b'], self.bp_param_test['a'], raw_data, zi=self.bp_param_test['zi'])
-        self.bp_param_test['zi'] = zi
-        return filtered_data
+            self._design_filter_test(nchan=np.atleast_2d(raw_data).shape[0])
+        return self._run(self.bp_param_test, raw_data)
 
     def apply_notch_filter(self, raw_data):
         if self.notch_param is None:
-            self._design_notch_filter(nchan=raw_data.shape[0])
-
-        filtered_data, zi = lfilter(self.notch_param['b'], self.notch_param['a'], raw_data, zi=self.notch_param['zi'])
-        self.notch_param['zi'] = zi
-        return filtered_data
+            self._design_notch_filter(nchan=np.atleast_2d(raw_data).shape[0])
+        return self._run(self.notch_param, raw_data)
 
 
 if __name__ == '__main__':
@@ -79,13 +187,13 @@ if __name__ == '__main__':
     x_noisy = x + .2 * np.random.rand(4, n_sample) + np.cos(2 * np.pi * 50 * t) + .5
 
     filt = Filter(l_freq=20, h_freq=30, line_freq=50)
-    x_filt = filt.apply_notch_filter(filt.apply_bp_filter(x_noisy))
+    x_filt = filt.apply(x_noisy)
 
     # test real-time filtering
     x_filt_realtime = np.zeros((4, 0))
     for i in range(n_chunk):
         x_filt_realtime = np.concatenate((x_filt_realtime,
-                                          filt.apply_notch_filter(filt.apply_bp_filter(x_noisy[:, i * 33:(i + 1) * 33])))
+                                          filt.apply(x_noisy[:, i * 33:(i + 1) * 33]))
                                          , axis=1)
         # Only notch filter
         # x_filt_realtime = np.concatenate((x_filt_realtime,
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Zero-phase filtering of recordings of any length
+
+The forward-backward filtering of scipy's sosfiltfilt is done chunk by chunk: the forward pass runs from the start to
+the end of the recording and writes its output to the output array, the backward pass then runs from the end to the
+start over the same array with the filter state carried between chunks. The signal is extended at both edges by odd
+reflection like in sosfiltfilt, so the result equals sosfiltfilt of the whole recording while only one chunk per
+channel group is held in memory.
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.signal import sosfilt, sosfilt_zi
+from explorepy.filters import design_sos
+
+
+def get_padlen(sos):
+    """Length of the edge extensions (as in scipy.signal.sosfiltfilt)"""
+    n_taps = 2 * sos.shape[0] + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return 3 * n_taps
+
+
+def _filtfilt_columns(sos, x, out, columns, chunk_size, padlen):
+    n_sample = x.shape[0]
+    zi = sosfilt_zi(sos)[:, :, np.newaxis]
+
+    # Forward pass, starting with the odd extension of the first samples
+    head = np.asarray(x[:padlen + 1, columns], dtype=np.float64)
+    front = 2 * head[0] - head[padlen:0:-1]
+    # The end is read first, as the output may be the input array itself
+    tail = np.asarray(x[n_sample - padlen - 1:, columns], dtype=np.float64)
+    back = 2 * tail[-1] - tail[-2::-1]
+    _, state = sosfilt(sos, front, axis=0, zi=zi * front[0])
+    for start in range(0, n_sample, chunk_size):
+        stop = min(start + chunk_size, n_sample)
+        out[start:stop, columns], state = sosfilt(sos, np.asarray(x[start:stop, columns], dtype=np.float64), axis=0,
+                                                  zi=state)
+    back_out, _ = sosfilt(sos, back, axis=0, zi=state)
+
+    # Backward pass from the end of the extension
+    _, state = sosfilt(sos, back_out[::-1], axis=0, zi=zi * back_out[-1])
+    for stop in range(n_sample, 0, -chunk_size):
+        start = max(stop - chunk_size, 0)
+        chunk, state = sosfilt(sos, np.asarray(out[start:stop, columns])[::-1], axis=0, zi=state)
+        out[start:stop, columns] = chunk[::-1]
+
+
+def filtfilt_chunked(sos, x, out=None, chunk_size=1 << 16, n_jobs=1):
+    """Zero-phase filtering of long signals in chunks
+
+    Args:
+        sos (np.ndarray): Second-order sections of the filter
+        x (array-like): Signal with shape (n_sample, n_chan), e.g. a memory-mapped array
+        out (array-like): Output array of the same shape (e.g. a memory-mapped array); it may be x itself. If None, a
+            new array is returned.
+        chunk_size (int): Number of samples per chunk
+        n_jobs (int): Number of threads; the channels are split between them
+
+    Returns:
+        Filtered signal (out)
+    """
+    padlen = get_padlen(sos)
+    assert x.shape[0] > padlen, "The signal must be longer than " + str(padlen) + " samples!"
+    if out is None:
+        out = np.empty(x.shape)
+    column_groups = [group for group in np.array_split(np.arange(x.shape[1]), n_jobs) if len(group)]
+    # Slices keep the reads and writes of a group contiguous in the rows
+    column_groups = [slice(group[0], group[-1] + 1) for group in column_groups]
+    if len(column_groups) == 1:
+        _filtfilt_columns(sos, x, out, column_groups[0], chunk_size, padlen)
+    else:
+        # sosfilt releases the GIL, so the channel groups run in parallel in threads
+        with ThreadPoolExecutor(max_workers=len(column_groups)) as executor:
+            for result in [executor.submit(_filtfilt_columns, sos, x, out, columns, chunk_size, padlen)
+                           for columns in column_groups]:
+                result.result()
+    return out
+
+
+def filter_npy(in_file, out_file, bp_freq=None, notch_freq=None, order=5, chunk_duration=60, n_jobs=1):
+    """Zero-phase filtering of an npy recording (see Explore.record_data and bin2csv with file_type='npy')
+
+    The output file has the same layout as the input (timestamp column and ExG channels) and gets a copy of the sidecar
+    file.
+
+    Args:
+        in_file (str): Input npy file
+        out_file (str): Output npy file
+        bp_freq (tuple): Bandpass cut-off frequencies (low, high); with a None cut-off a highpass or lowpass filter is
+            used, no bandpass filter if None
+        notch_freq (float): Line frequency for the notch filter (50 or 60 Hz), no notch filter if None
+        order (int): Order of the bandpass filter
+        chunk_duration (float): Duration of the chunks in seconds
+        n_jobs (int): Number of threads
+    """
+    assert bp_freq is not None or notch_freq is not None, "No filter has been selected!"
+    in_sidecar = os.path.splitext(in_file)[0] + '.json'
+    with open(in_sidecar) as f_sidecar:
+        sidecar = json.load(f_sidecar)
+    sampling_rate = sidecar['sampling_rate']
+    stages = []
+    if notch_freq is not None:
+        stages.append(design_sos('bandstop', (notch_freq - 2, notch_freq + 2), 5, sampling_rate))
+    if bp_freq is not None:
+        low_freq, high_freq = bp_freq
+        if low_freq is None:
+            stages.append(design_sos('lowpass', high_freq, order, sampling_rate))
+        elif high_freq is None:
+            stages.append(design_sos('highpass', low_freq, order, sampling_rate))
+        else:
+            stages.append(design_sos('band', (low_freq, high_freq), order, sampling_rate))
+
+    data = np.load(in_file, mmap_mode='r')
+    out = np.lib.format.open_memmap(out_file, mode='w+', dtype=np.float64, shape=data.shape)
+    out[:, 0] = data[:, 0]
+    filtfilt_chunked(np.concatenate(stages), data[:, 1:], out=out[:, 1:],
+                     chunk_size=int(chunk_duration * sampling_rate), n_jobs=n_jobs)
+    out.flush()
+    del out
+    with open(os.path.splitext(out_file)[0] + '.json', 'w') as f_sidecar:
+        json.dump(dict(sidecar, filters={'bp_freq': bp_freq, 'notch_freq': notch_freq, 'order': order,
+                                         'zero_phase': True}), f_sidecar)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Lab streaming layer outlets which push chunks of samples with timestamps from the device clock"""
+import numpy as np
+from pylsl import local_clock
+
+
+class ChunkedOutlet:
+    """Wrapper of an lsl StreamOutlet which collects samples and pushes them in chunks
+
+    Samples are timestamped from the device clock instead of their arrival time, so the jitter of the Bluetooth link
+    does not show up in the timestamps. Device times are mapped to the lsl clock by the offset measured when the first
+    samples arrive, or by a ClockSync object which also corrects the drift of the device clock. Each chunk is pushed
+    with the timestamp of its last sample; the timestamps of the other samples are derived by lsl from the sampling
+    rate, therefore a chunk is pushed early if samples are missing.
+    """
+
+    def __init__(self, outlet, sampling_rate, chunk_size=None, clock=None):
+        """
+        Args:
+            outlet (pylsl.StreamOutlet): lsl stream outlet
+            sampling_rate (float): Sampling rate of the stream (0 for irregular streams, e.g. markers)
+            chunk_size (int): Number of samples per chunk (if None, the samples of each packet are pushed as one chunk)
+            clock (explorepy.timesync.ClockSync): Clock synchronization of the device (if None, a fixed offset is used)
+        """
+        self.outlet = outlet
+        self.sampling_rate = sampling_rate
+        self.chunk_size = chunk_size
+        self.clock = clock
+        self.time_offset = None
+        self._chunk = []
+        self._n_sample = 0
+        self._last_time = None
+
+    def device_to_host(self, timestamp):
+        """Maps device times (in seconds) to the lsl clock"""
+        if self.clock is not None and self.clock.offset is not None:
+            return self.clock.device_to_host(timestamp)
+        return np.asarray(timestamp) + self.time_offset
+
+    def push(self, timestamp, data):
+        """Adds samples to the current chunk and pushes it when it is full
+
+        Args:
+            timestamp (float or np.ndarray): Device time of the first sample or of each sample in seconds
+            data (np.ndarray): Samples with shape (n_sample, n_chan)
+        """
+        data = np.asarray(data)
+        n_new = data.shape[0]
+        if np.isscalar(timestamp):
+            first_time = timestamp
+            last_time = timestamp + (n_new - 1) / self.sampling_rate if self.sampling_rate else timestamp
+        else:
+            first_time, last_time = timestamp[0], timestamp[-1]
+        if self.time_offset is None:
+            self.time_offset = local_clock() - last_time
+        if self._n_sample and self.sampling_rate and first_time - self._last_time > 1.5 / self.sampling_rate:
+            self.flush()
+        self._chunk.append(data)
+        self._n_sample += n_new
+        self._last_time = last_time
+        if not self.sampling_rate or self.chunk_size is None or self._n_sample >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Pushes the collected samples"""
+        if not self._n_sample:
+            return
+        chunk = self._chunk[0] if len(self._chunk) == 1 else np.concatenate(self._chunk)
+        self.outlet.push_chunk(chunk.ravel().tolist(), float(self.device_to_host(self._last_time)))
+        self._chunk = []
+        self._n_sample = 0
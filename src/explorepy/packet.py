@@ -5,6 +5,7 @@ import struct
 from functools import partial
 from enum import IntEnum
 from datetime import datetime
+from explorepy.timesync import sample_times
 
 
 class PACKET_ID(IntEnum):
@@ -25,28 +26,111 @@ class PACKET_ID(IntEnum):
     CALIBINFO = 195
 
 
+FLETCHER = b'\xaf\xbe\xad\xde'
+TS_FLETCHER = b'\xff\xff\xff\xff'
+INT24 = 'int24'
+MAX_PAYLOAD_SIZE = 512  # Upper bound of the payload size of non-ExG packets (bytes)
+
+
+class PacketSchema:
+    """Binary layout of an Explore packet type
+
+    A schema holds everything the shared decoder needs to convert the payload of a packet: the layout of the binary
+    data, the scale factor of each value, the fields the values are exposed as and the expected fletcher.
+    """
+
+    def __init__(self, packet_class, layout=None, fields=(), scale=None, n_chan=None, n_sample=None, v_ref=None,
+                 gain=6., status=False, fletcher=FLETCHER):
+        """
+        Args:
+            packet_class (type): Packet class exposing the decoded values
+            layout (str or struct.Struct): INT24 for ExG payloads, otherwise a precompiled struct of the payload
+            fields (tuple): Tuple of (attribute name, index or slice of the decoded values)
+            scale (float or list): Scale factor(s) of the decoded values (None to keep the raw integers)
+            n_chan (int): Number of ExG channels (ExG packets only)
+            n_sample (int): Number of samples per packet (ExG packets only)
+            v_ref (float): Reference voltage of the ADC (ExG packets only)
+            gain (float): Gain of the ADC (ExG packets only)
+            status (bool): True if the first channel of the ExG packet is the status word of the ADC
+            fletcher (bytes): Expected fletcher at the end of the payload
+        """
+        self.packet_class = packet_class
+        self.layout = layout
+        self.fields = fields
+        self.n_chan = n_chan
+        self.n_sample = n_sample
+        self.v_ref = v_ref
+        self.status = status
+        self.fletcher = fletcher
+        self.gain = gain
+        if layout == INT24:
+            self.n_row = n_chan + int(status)
+            self.scale = v_ref / ((2 ** 23) - 1) / gain
+        else:
+            self.scale = None if scale is None else np.asarray(scale, dtype=np.float64)
+
+    def is_valid_size(self, n_bytes):
+        """Checks if the given size of binary data (payload without timestamp and fletcher) fits the layout"""
+        if self.layout is None:
+            return n_bytes == 0
+        if self.layout == INT24:
+            return n_bytes == self.n_sample * self.n_row * 3
+        return self.layout.size <= n_bytes <= MAX_PAYLOAD_SIZE
+
+    def decode(self, bin_data):
+        """Convert the binary data (payload without fletcher) to values
+
+        Args:
+            bin_data (bytes): Binary data of the payload; for ExG packets, the binary data of several packets of this
+                type may be given at once
+
+        Returns:
+            np.ndarray of decoded values (for ExG packets with shape (n_row, n_sample))
+        """
+        if self.layout is None:
+            return None
+        if self.layout == INT24:
+            values = Packet.int24to32(bin_data).reshape((-1, self.n_row)).T.astype(np.float64)
+            # Scale the channels in place as data * v_ref / (2^23 - 1) / gain, step by step so the result is exact to the
+            # bit; the status row is kept as it is
+            data = values[self.n_row - self.n_chan:]
+            data *= self.v_ref
+            data /= (2 ** 23) - 1
+            data /= self.gain
+            return values
+        values = np.array(self.layout.unpack_from(bin_data))
+        if self.scale is None:
+            return values
+        return values * self.scale
+
+
 class Packet:
     """An abstract base class for Explore packet"""
     __metadata__ = abc.ABCMeta
+    pid = None
 
-    def __init__(self, timestamp, payload):
+    def __init__(self, timestamp, payload, schema=None):
         """
         Gets the timestamp and payload and initializes the packet object
 
         Args:
+            timestamp (float): Timestamp of the packet
             payload (bytearray): a byte array including binary data and fletcher
+            schema (PacketSchema): Schema of the packet (if None, the schema of the packet class' pid is used)
         """
         self.timestamp = timestamp
+        self.schema = PACKET_SCHEMA[self.pid] if schema is None else schema
+        self._check_fletcher(payload[-4:])
+        self._convert(self.schema.decode(payload[:-4]))
 
-    @abc.abstractmethod
-    def _convert(self, bin_data):
-        """Read the binary data and convert it to real values"""
-        pass
+    def _convert(self, values):
+        """Expose the decoded values as the fields given in the schema"""
+        for name, idx in self.schema.fields:
+            setattr(self, name, values[idx])
 
-    @abc.abstractmethod
     def _check_fletcher(self, fletcher):
         """Checks if the fletcher is valid"""
-        pass
+        assert fletcher == self.schema.fletcher, "Fletcher error!"
 
     @abc.abstractmethod
     def __str__(self):
@@ -58,6 +142,9 @@ class Packet:
         """
         converts binary data to int32
 
+        The 3-byte little-endian samples are copied into the upper three bytes of a 4-byte buffer which is then viewed
+        as int32 and arithmetically shifted back, so the sign extension is done by numpy for the whole payload at once.
+
         Args:
             bin_data (list): list of bytes with the structure of int24
 
@@ -65,9 +152,10 @@ class Packet:
             np.ndarray of int values
         """
         assert len(bin_data) % 3 == 0, "Packet length error!"
-        return np.asarray([int.from_bytes(bin_data[x:x + 3],
-                                          byteorder='little',
-                                          signed=True) for x in range(0, len(bin_data), 3)])
+        raw = np.frombuffer(bin_data, dtype=np.uint8).reshape(-1, 3)
+        buf = np.zeros((raw.shape[0], 4), dtype=np.uint8)
+        buf[:, 1:] = raw
+        return buf.view(np.dtype(np.int32).newbyteorder('<')).ravel() >> 8
 
     @abc.abstractmethod
     def push_to_dashboard(self, dashboard):
@@ -75,17 +163,45 @@ class Packet:
 
 
 class EEG(Packet):
+    """ExG packet
+
+    The number of channels, samples and the scaling of the data are given by the schema of the packet, so new ExG
+    packet variants only need a new entry in PACKET_SCHEMA.
+    """
+
+    def __str__(self):
+        return "EEG: " + str(self.data[:, -1]) + "\tEEG STATUS: " + str(getattr(self, 'status', None))
 
-    @abc.abstractmethod
     def write_to_csv(self, csv_writer):
         """
         Write EEG data to csv file
 
         Args:
-            csv_writer(csv_writer): csv writer object
+            csv_writer(explorepy.writers.CsvWriter): csv writer object
 
         """
-        pass
+        csv_writer.write(self.timestamp, self.data.T, resolution=self.schema.scale)
+
+    def apply_filter(self, exg_filter):
+        """Filtering of ExG data with all stages of the filter (notch and bandpass) in one pass
+
+        Args:
+        exg_filter: Filter object
+        """
+        self.data = exg_filter.apply(self.data, out=self.data)
+
+    def apply_pipeline(self, pipeline):
+        """Processing of ExG data with a pipeline of stages (e.g. filters, re-referencing and decimation)
+
+        Args:
+            pipeline (explorepy.pipeline.Pipeline): Pipeline object
+        """
+        data = pipeline.apply(self.data)
+        if data.shape == self.data.shape and self.data.dtype == np.float64:
+            self.data[...] = data
+        else:
+            self.data = data.copy()
+        self.timestamp += pipeline.time_shift
 
     def apply_bp_filter(self, exg_filter):
         """Bandpass filtering of ExG data
@@ -116,11 +232,9 @@ class EEG(Packet):
         """Push data to lsl socket
 
         Args:
-            outlet (lsl.StreamOutlet): lsl stream outlet
+            outlet (explorepy.outlets.ChunkedOutlet): lsl stream outlet
         """
-
-        for sample in self.data.T:
-            outlet.push_sample(sample.tolist())
+        outlet.push(self.timestamp, self.data.T)
 
     def calculate_impedance(self, imp_calib_info):
         """
@@ -136,7 +250,7 @@ class EEG(Packet):
 
     def push_to_dashboard(self, dashboard):
         n_sample = self.data.shape[1]
-        time_vector = np.linspace(self.timestamp, self.timestamp + (n_sample - 1) / 250., n_sample)
+        time_vector = sample_times(self.timestamp, n_sample, dashboard.sampling_rate)
         dashboard.doc.add_next_tick_callback(partial(dashboard.update_exg, time_vector=time_vector, ExG=self.data))
 
     def push_to_imp_dashboard(self, dashboard, imp_calib_info):
@@ -146,146 +260,35 @@ class EEG(Packet):
 
 class EEG94(EEG):
     """EEG packet for 4 channel device"""
+    pid = PACKET_ID.EEG94
 
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        data = Packet.int24to32(bin_data)
-        n_chan = -1
-        v_ref = 2.4
-        n_packet = 33
-        data = data.reshape((n_packet, n_chan)).astype(np.float).T
-        self.data = data[1:, :] * v_ref / ((2 ** 23) - 1) / 6.
-        self.dataStatus = data[0, :]
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
-
-    def __str__(self):
-        return "EEG: " + str(self.data[:, -1]) + "\tEEG STATUS: " + str(self.dataStatus[-1]  )
-
-    def write_to_csv(self, csv_writer):
-        tmpstmp = np.zeros([self.data.shape[1], 1])
-        tmpstmp[:, :] = self.timestamp
-        csv_writer.writerows(np.concatenate((tmpstmp, self.data.T), axis=1).tolist())
+    @property
+    def dataStatus(self):
+        return self.status
 
 
 class EEG98(EEG):
     """EEG packet for 8 channel device"""
-
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        data = Packet.int24to32(bin_data)
-        n_chan = -1
-        v_ref = 2.4
-        n_packet = 16
-        data = data.reshape((n_packet, n_chan)).astype(np.float).T
-        self.data = data[1:, :] * v_ref / ((2 ** 23) - 1) / 6.
-        self.status = (hex(bin_data[0]), hex(bin_data[1]), hex(bin_data[2]))
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
-
-    def __str__(self):
-        return "EEG: " + str(self.data[:, -1]) + "\tEEG STATUS: " + str((self.status))
-
-    def write_to_csv(self, csv_writer):
-        tmpstmp = np.zeros([self.data.shape[1], 1])
-        tmpstmp[:, :] = self.timestamp
-        csv_writer.writerows(np.concatenate((tmpstmp, self.data.T), axis=1).tolist())
+    pid = PACKET_ID.EEG98
 
 
 class EEG99s(EEG):
     """EEG packet for 8 channel device"""
-
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        data = Packet.int24to32(bin_data)
-        n_chan = -1
-        v_ref = 4.5
-        n_packet = 16
-        data = data.reshape((n_packet, n_chan)).astype(np.float).T
-        self.data = data[1:, :] * v_ref / ((2 ** 23) - 1) / 6.
-        self.status = data[0, :]
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
-
-    def __str__(self):
-        return "EEG: " + str(self.data[:, -1]) + "\tEEG STATUS: " + str(self.status )
-
-    def write_to_csv(self, csv_writer):
-        tmpstmp = np.zeros([self.data.shape[1], 1])
-        for i in range(0, 16):
-            tmpstmp[i, :] = (self.timestamp - 0.064 + i * 40) / 10000
-
-        csv_writer.writerows(np.concatenate((tmpstmp, self.data.T), axis=1).tolist())
-
-
-class EEG99(EEG):
-    """EEG packet for 8 channel device"""
-
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        data = Packet.int24to32(bin_data)
-        n_chan = -1
-        v_ref = 4.5
-        n_packet = 16
-        data = data.reshape((n_packet, n_chan)).astype(np.float).T
-        self.data = data * v_ref / ((2 ** 23) - 1) / 6.
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
-
-    def __str__(self):
-        return "EEG: " + str(self.data[:, -1])
-
-    def write_to_csv(self, csv_writer):
-        tmpstmp = np.zeros([self.data.shape[1], 1])
-        tmpstmp[:, :] = self.timestamp
-        csv_writer.writerows(np.concatenate((tmpstmp, self.data.T), axis=1).tolist())
+    pid = PACKET_ID.EEG99S
 
 
 class Orientation(Packet):
     """Orientation data packet"""
-
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        data = np.copy(np.frombuffer(bin_data, dtype=np.dtype(np.int16).newbyteorder('<'))).astype(np.float)
-        self.acc = 0.061 * data[0:3]  # Unit [mg/LSB]
-        self.gyro = 8.750 * data[3:6]  # Unit [mdps/LSB]
-        self.mag = 1.52 * data[6:]  # Unit [mgauss/LSB]
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
+    pid = PACKET_ID.ORN
 
     def __str__(self):
         return "Acc: " + str(self.acc) + "\tGyro: " + str(self.gyro) + "\tMag: " + str(self.mag)
 
     def write_to_csv(self, csv_writer):
-        csv_writer.writerow([self.timestamp] + self.acc.tolist() + self.gyro.tolist() + self.mag.tolist())
+        csv_writer.write(self.timestamp, np.concatenate((self.acc, self.gyro, self.mag))[np.newaxis, :])
 
     def push_to_lsl(self, outlet):
-        outlet.push_sample(self.acc.tolist() + self.gyro.tolist() + self.mag.tolist())
+        outlet.push(self.timestamp, np.concatenate((self.acc, self.gyro, self.mag))[np.newaxis, :])
 
     def push_to_dashboard(self, dashboard):
         data = self.acc.tolist() + self.gyro.tolist() + self.mag.tolist()
@@ -294,24 +297,12 @@ class Orientation(Packet):
 
 class Environment(Packet):
     """Environment data packet"""
+    pid = PACKET_ID.ENV
 
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        self.temperature = bin_data[0]
-        self.light = (1000 / 4095) * np.frombuffer(bin_data[1:3],
-                                                   dtype=np.dtype(np.uint16).newbyteorder('<'))  # Unit Lux
-        self.battery = (16.8 / 6.8) * (1.8 / 2457) * np.frombuffer(bin_data[3:5],
-                                                                   dtype=np.dtype(np.uint16).newbyteorder(
-                                                                       '<'))  # Unit Volt
+    def _convert(self, values):
+        super()._convert(values)
         self.battery_percentage = self._volt_to_percent(self.battery)
 
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
-
     def __str__(self):
         return "Temperature: " + str(self.temperature) + "\tLight: " + str(self.light) + "\tBattery: " + str(
             self.battery)
@@ -347,19 +338,12 @@ class Environment(Packet):
 
 class TimeStamp(Packet):
     """Time stamp data packet"""
+    pid = PACKET_ID.TS
 
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
+    def __init__(self, timestamp, payload, schema=None):
+        super().__init__(timestamp, payload, schema)
         self.raw_data = None
 
-    def _convert(self, bin_data):
-        self.hostTimeStamp = np.frombuffer(bin_data, dtype=np.dtype(np.uint64).newbyteorder('<'))
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xff\xff\xff\xff', "Fletcher error!"
-    
     def translate(self):
         now = datetime.now()
         timestamp = int(1000000000 * datetime.timestamp(now))  # time stamp in nanosecond
@@ -370,41 +354,31 @@ class TimeStamp(Packet):
         CNT = b'\x01'
         payload_len = b'\x10\x00'  # i.e. 0x0010
         device_ts = b'\x00\x00\x00\x00'
-        fletcher = b'\xFF\xFF\xFF\xFF'
+        fletcher = TS_FLETCHER
         self.raw_data = ID + CNT + payload_len + device_ts + host_ts + fletcher
 
     def __str__(self):
         return "Host timestamp: " + str(self.hostTimeStamp)
 
     def write_to_csv(self, csv_writer):
-        csv_writer.writerow([self.timestamp])
+        csv_writer.write(self.timestamp, np.empty((1, 0)))
 
     def push_to_lsl(self, outlet):
-        outlet.push_sample([1])
+        outlet.push(self.timestamp, [[1]])
+
 
-        
 class MarkerEvent(Packet):
     """Marker packet"""
-
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        self.marker_code = np.frombuffer(bin_data, dtype=np.dtype(np.uint16).newbyteorder('<'))[0]
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
+    pid = PACKET_ID.MARKER
 
     def __str__(self):
         return "Event marker: " + str(self.marker_code)
 
     def write_to_csv(self, csv_writer):
-        csv_writer.writerow([self.timestamp, self.marker_code])
+        csv_writer.write(self.timestamp, [[self.marker_code]])
 
     def push_to_lsl(self, outlet):
-        outlet.push_sample([self.marker_code])
+        outlet.push(self.timestamp, [[self.marker_code]])
 
     def push_to_dashboard(self, dashboard):
         pass
@@ -412,17 +386,7 @@ class MarkerEvent(Packet):
 
 class Disconnect(Packet):
     """Disconnect packet"""
-
-    def __init__(self, timestamp, payload):
-        super().__init__(timestamp, payload)
-        self._check_fletcher(payload)
-
-    def _convert(self, bin_data):
-        """Disconnect packet has no data"""
-        pass
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
+    pid = PACKET_ID.DISCONNECT
 
     def __str__(self):
         return "Device has been disconnected!"
@@ -430,18 +394,14 @@ class Disconnect(Packet):
 
 class DeviceInfo(Packet):
     """Device information packet"""
+    pid = PACKET_ID.INFO
 
-    def __init__(self, timestamp, payload):
-        super(DeviceInfo, self).__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        fw_num = np.frombuffer(bin_data, dtype=np.dtype(np.uint32).newbyteorder('<'))[0]
-        self.firmware_version = '.'.join([char for char in str(fw_num)])
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
+    def _convert(self, values):
+        self.firmware_version = '.'.join([char for char in str(values[0])])
+        # Newer firmwares send the data rate as a power of two divisor of 16 kHz and the ADC channel mask; older ones
+        # leave these bytes empty
+        self.sampling_rate = 16000 / (2 ** int(values[1])) if values[1] else None
+        self.adc_mask = int(values[2])
 
     def __str__(self):
         return "Firmware version: " + self.firmware_version
@@ -453,17 +413,7 @@ class DeviceInfo(Packet):
 
 class CommandRCV(Packet):
     """Command Status packet"""
-    def __init__(self, timestamp, payload):
-        super(CommandRCV, self).__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        self.opcode = bin_data[0]
-        pass
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
+    pid = PACKET_ID.CMDRCV
 
     def __str__(self):
         return "an acknowledge message for command with this opcode has been received: " + str(self.opcode)
@@ -471,17 +421,7 @@ class CommandRCV(Packet):
 
 class CommandStatus(Packet):
     """Command Status packet"""
-    def __init__(self, timestamp, payload):
-        super(CommandStatus, self).__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        self.opcode = bin_data[0]
-        self.status = bin_data[5]
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
+    pid = PACKET_ID.CMDSTAT
 
     def __str__(self):
         return "Command status: " + str(self.status) + "\tfor command with opcode: " + str(self.opcode)
@@ -489,38 +429,43 @@ class CommandStatus(Packet):
 
 class CalibrationInfo(Packet):
     """Calibration Info packet"""
-    def __init__(self, timestamp, payload):
-        super(CalibrationInfo, self).__init__(timestamp, payload)
-        self._convert(payload[:-4])
-        self._check_fletcher(payload[-4:])
-
-    def _convert(self, bin_data):
-        slope = np.frombuffer(bin_data, dtype=np.dtype(np.uint16).newbyteorder('<'), count=1, offset=0)
-        self.slope = slope * 10.0
-        offset = np.frombuffer(bin_data, dtype=np.dtype(np.uint16).newbyteorder('<'), count=1, offset=2)
-        self.offset = offset * 0.001
-
-    def _check_fletcher(self, fletcher):
-        assert fletcher == b'\xaf\xbe\xad\xde', "Fletcher error!"
+    pid = PACKET_ID.CALIBINFO
 
     def __str__(self):
         return "calibration info: slope = " + str(self.slope) + "\toffset = " + str(self.offset)
 
 
-PACKET_CLASS_DICT = {
-    PACKET_ID.ORN: Orientation,
-    PACKET_ID.ENV: Environment,
-    PACKET_ID.TS: TimeStamp,
-    PACKET_ID.DISCONNECT: Disconnect,
-    PACKET_ID.INFO: DeviceInfo,
-    PACKET_ID.EEG94: EEG94,
-    PACKET_ID.EEG98: EEG98,
-    PACKET_ID.EEG99S: EEG99s,
-    PACKET_ID.EEG99: EEG99s,
-    PACKET_ID.EEG94R: EEG94,
-    PACKET_ID.EEG98R: EEG98,
-    PACKET_ID.CMDRCV: CommandRCV,
-    PACKET_ID.CMDSTAT: CommandStatus,
-    PACKET_ID.CALIBINFO: CalibrationInfo,
-    PACKET_ID.MARKER: MarkerEvent
+_EXG_STATUS_FIELDS = (('status', 0), ('data', slice(1, None)))
+
+PACKET_SCHEMA = {
+    PACKET_ID.ORN: PacketSchema(Orientation, layout=struct.Struct('<9h'),
+                                fields=(('acc', slice(0, 3)), ('gyro', slice(3, 6)), ('mag', slice(6, 9))),
+                                scale=[0.061] * 3 + [8.750] * 3 + [1.52] * 3),  # Unit [mg/LSB], [mdps/LSB], [mgauss/LSB]
+    PACKET_ID.ENV: PacketSchema(Environment, layout=struct.Struct('<BHH'),
+                                fields=(('temperature', 0), ('light', 1), ('battery', 2)),
+                                scale=[1., 1000 / 4095, (16.8 / 6.8) * (1.8 / 2457)]),  # Unit [C], [Lux], [Volt]
+    PACKET_ID.TS: PacketSchema(TimeStamp, layout=struct.Struct('<Q'), fields=(('hostTimeStamp', 0),),
+                               fletcher=TS_FLETCHER),
+    PACKET_ID.DISCONNECT: PacketSchema(Disconnect),
+    PACKET_ID.INFO: PacketSchema(DeviceInfo, layout=struct.Struct('<HBB')),
+    PACKET_ID.EEG94: PacketSchema(EEG94, layout=INT24, fields=_EXG_STATUS_FIELDS, n_chan=4, n_sample=33, v_ref=2.4,
+                                  status=True),
+    PACKET_ID.EEG98: PacketSchema(EEG98, layout=INT24, fields=_EXG_STATUS_FIELDS, n_chan=8, n_sample=16, v_ref=2.4,
+                                  status=True),
+    PACKET_ID.EEG99S: PacketSchema(EEG99s, layout=INT24, fields=_EXG_STATUS_FIELDS, n_chan=8, n_sample=16, v_ref=4.5,
+                                   status=True),
+    PACKET_ID.EEG99: PacketSchema(EEG99s, layout=INT24, fields=_EXG_STATUS_FIELDS, n_chan=8, n_sample=16, v_ref=4.5,
+                                  status=True),
+    PACKET_ID.EEG94R: PacketSchema(EEG94, layout=INT24, fields=_EXG_STATUS_FIELDS, n_chan=4, n_sample=33, v_ref=2.4,
+                                   status=True),
+    PACKET_ID.EEG98R: PacketSchema(EEG98, layout=INT24, fields=_EXG_STATUS_FIELDS, n_chan=8, n_sample=16, v_ref=2.4,
+                                   status=True),
+    PACKET_ID.CMDRCV: PacketSchema(CommandRCV, layout=struct.Struct('<B'), fields=(('opcode', 0),)),
+    PACKET_ID.CMDSTAT: PacketSchema(CommandStatus, layout=struct.Struct('<B4xB'),
+                                    fields=(('opcode', 0), ('status', 1))),
+    PACKET_ID.CALIBINFO: PacketSchema(CalibrationInfo, layout=struct.Struct('<HH'),
+                                      fields=(('slope', 0), ('offset', 1)), scale=[10., 0.001]),
+    PACKET_ID.MARKER: PacketSchema(MarkerEvent, layout=struct.Struct('<H'), fields=(('marker_code', 0),)),
 }
+
+PACKET_CLASS_DICT = {pid: schema.packet_class for pid, schema in PACKET_SCHEMA.items()}
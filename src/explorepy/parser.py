@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import struct
-from explorepy.packet import PACKET_ID, PACKET_CLASS_DICT, TimeStamp, EEG, Environment, CommandRCV, CommandStatus,\
+import mmap
+from explorepy.packet import PACKET_ID, PACKET_SCHEMA, INT24, TimeStamp, EEG, Environment, CommandRCV, CommandStatus,\
                                 Orientation, DeviceInfo, Disconnect, MarkerEvent, CalibrationInfo
-from explorepy.filters import Filter
-import copy
+from explorepy.pipeline import Pipeline, Notch, Bandpass
+from explorepy.sequence import SequenceTracker, fill_gap
+from explorepy.timesync import ClockSync, CounterUnwrapper, TIMESTAMP_UNIT, sample_times
+from collections import deque
+
+HEADER = struct.Struct('<BBHI')  # pid, cnt, payload length, timestamp
+HEADER_SIZE = HEADER.size
+READ_BUFFER_SIZE = 1 << 16
+SAMPLING_RATES = (250, 500, 1000)
 
 
 def generate_packet(pid, timestamp, bin_data):
@@ -19,8 +27,9 @@ def generate_packet(pid, timestamp, bin_data):
         Packet
     """
 
-    if pid in PACKET_CLASS_DICT:
-        packet = PACKET_CLASS_DICT[pid](timestamp, bin_data)
+    if pid in PACKET_SCHEMA:
+        schema = PACKET_SCHEMA[pid]
+        packet = schema.packet_class(timestamp, bin_data, schema)
     else:
         print("Unknown Packet ID:" + str(pid))
         print("Length of the binary data:", len(bin_data))
@@ -28,8 +37,326 @@ def generate_packet(pid, timestamp, bin_data):
     return packet
 
 
+class StreamBuffer:
+    """Preallocated read buffer for the byte stream of a socket or file
+
+    The buffer is filled with as many bytes as the source can deliver in one recv_into/readinto call, so a packet
+    header and payload are usually served from memory without further system calls. Consumed bytes are dropped by
+    moving the unread tail to the front of the buffer, which keeps every packet contiguous for struct.unpack_from.
+    """
+
+    def __init__(self, source, size=READ_BUFFER_SIZE, tee=None):
+        """
+        Args:
+            source: Socket (with recv_into or recv) or binary file object (with readinto)
+            size (int): Initial size of the buffer in bytes
+            tee (explorepy.writers.RawWriter): Writer which gets a copy of all bytes read from the source
+        """
+        self.source = source
+        self.tee = tee
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._offset = 0  # Stream position of the first byte of the buffer
+        self._start = 0
+        self._end = 0
+        if hasattr(source, 'recv_into'):
+            self._read_into = source.recv_into
+        elif hasattr(source, 'readinto'):
+            self._read_into = source.readinto
+        else:
+            self._read_into = self._recv_copy
+
+    @property
+    def n_available(self):
+        """Number of buffered bytes which have not been consumed yet"""
+        return self._end - self._start
+
+    @property
+    def position(self):
+        """Position of the next unread byte in the stream"""
+        return self._offset + self._start
+
+    def _recv_copy(self, view):
+        byte_data = self.source.recv(len(view))
+        view[:len(byte_data)] = byte_data
+        return len(byte_data)
+
+    def fill(self, n_bytes):
+        """Reads from the source until at least n_bytes are available in the buffer
+
+        Partial reads of the source are accumulated; ValueError is raised if the source is exhausted or closed.
+        """
+        while self._end - self._start < n_bytes:
+            if len(self._buf) - self._start < n_bytes:
+                n_unread = self._end - self._start
+                if len(self._buf) < n_bytes:
+                    new_buf = bytearray(max(n_bytes, 2 * len(self._buf)))
+                    new_buf[:n_unread] = self._view[self._start:self._end]
+                    self._buf = new_buf
+                    self._view = memoryview(self._buf)
+                else:
+                    self._view[:n_unread] = self._view[self._start:self._end]
+                self._offset += self._start
+                self._start, self._end = 0, n_unread
+            n_read = self._read_into(self._view[self._end:])
+            if not n_read:
+                raise ValueError("Number of received bytes is less than expected")
+            if self.tee is not None:
+                self.tee.write(self._view[self._end:self._end + n_read])
+            self._end += n_read
+
+    def peek(self, n_bytes):
+        """Returns a view of the next n_bytes without consuming them
+
+        The view is only valid until the next call of fill/peek/read.
+        """
+        self.fill(n_bytes)
+        return self._view[self._start:self._start + n_bytes]
+
+    def consume(self, n_bytes):
+        """Drops the next n_bytes of the buffer"""
+        self._start += n_bytes
+
+    def read(self, n_bytes):
+        """Reads and consumes n_bytes
+
+        Returns:
+            bytes
+        """
+        byte_data = bytes(self.peek(n_bytes))
+        self._start += n_bytes
+        return byte_data
+
+    def clear(self):
+        """Drops all buffered bytes"""
+        self._offset += self._end
+        self._start = self._end = 0
+
+    def close(self):
+        """Releases the buffer (the source is not closed)"""
+        self._view.release()
+
+
+class MappedBuffer(StreamBuffer):
+    """Zero-copy read buffer over a memory-mapped binary file
+
+    The whole file is exposed as one memoryview, so packets are parsed in place and their payloads are handed to the
+    decoders without copying or any read calls.
+    """
+
+    def __init__(self, fid, start=0, end=None):
+        """
+        Args:
+            fid (file object): Binary file object opened for reading
+            start (int): Byte offset where reading starts
+            end (int): Byte offset where reading stops (if None, the end of the file)
+        """
+        self.source = fid
+        self.tee = None
+        fid.seek(0, 2)
+        if fid.tell():
+            self._buf = mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buf = b''  # Empty files cannot be mapped
+        self._view = memoryview(self._buf)
+        self._offset = 0
+        self._start = start
+        self._end = len(self._view) if end is None else end
+
+    def fill(self, n_bytes):
+        if self._end - self._start < n_bytes:
+            raise ValueError("Number of received bytes is less than expected")
+
+    def clear(self):
+        self._start = self._end
+
+    def seek(self, position):
+        """Moves the read position to the given byte offset of the file"""
+        self._start = position
+
+    def close(self):
+        """Unmaps the file (the file object is not closed)"""
+        self._view.release()
+        if isinstance(self._buf, mmap.mmap):
+            try:
+                self._buf.close()
+            except BufferError:
+                # Views returned by peek are still alive; the map is closed when they are released
+                pass
+
+
+class DataBlock:
+    """A block of data collected from consecutive packets
+
+    ExG samples of all packets are stored in one contiguous array with a timestamp for each sample. Orientation, marker
+    and environment packets are gathered in side arrays with one row per packet.
+    """
+
+    def __init__(self, exg, exg_timestamp, orn, orn_timestamp, marker, marker_timestamp, env, env_timestamp,
+                 exg_resolution=None):
+        """
+        Args:
+            exg (np.ndarray): ExG data with shape (n_chan, n_sample)
+            exg_timestamp (np.ndarray): Timestamp of each ExG sample
+            orn (np.ndarray): Orientation data with shape (n_packet, 9) (acc, gyro, mag)
+            orn_timestamp (np.ndarray): Timestamps of the orientation packets
+            marker (np.ndarray): Marker codes
+            marker_timestamp (np.ndarray): Timestamps of the markers
+            env (np.ndarray): Environment data with shape (n_packet, 3) (temperature, light, battery)
+            env_timestamp (np.ndarray): Timestamps of the environment packets
+            exg_resolution (float): Volts per ADC count of the ExG data (None if unknown)
+        """
+        self.exg = exg
+        self.exg_timestamp = exg_timestamp
+        self.orn = orn
+        self.orn_timestamp = orn_timestamp
+        self.marker = marker
+        self.marker_timestamp = marker_timestamp
+        self.env = env
+        self.env_timestamp = env_timestamp
+        self.exg_resolution = exg_resolution
+
+    @property
+    def n_sample(self):
+        return self.exg.shape[1]
+
+    def write_to_files(self, file_writers):
+        """Writes the ExG, orientation and marker data to file writers
+
+        Args:
+            file_writers (tuple): Tuple of file writers (ExG, ORN, marker), e.g. CsvWriter objects (see
+                explorepy.writers.open_file_writers)
+        """
+        # Markers are written first, so writers which store them with the ExG data (e.g. BdfWriter) get them in time
+        if len(self.marker_timestamp):
+            file_writers[2].write(self.marker_timestamp, self.marker[:, np.newaxis])
+        if self.n_sample:
+            file_writers[0].write(self.exg_timestamp, self.exg.T, resolution=self.exg_resolution)
+        if len(self.orn_timestamp):
+            file_writers[1].write(self.orn_timestamp, self.orn)
+
+    def __str__(self):
+        return "ExG samples: " + str(self.exg.shape[1]) + "\tORN samples: " + str(self.orn.shape[0]) + \
+               "\tMarkers: " + str(self.marker.shape[0])
+
+
+class BlockBuilder:
+    """Collects the data of consecutive packets in preallocated arrays and builds a DataBlock out of them"""
+
+    def __init__(self, max_packets, sampling_rate):
+        """
+        Args:
+            max_packets (int): Maximum number of packets in the block
+            sampling_rate (float): Sampling rate of ExG data
+        """
+        self.sampling_rate = sampling_rate
+        self.max_packets = max_packets
+        self.n_chan = None
+        self.resolution = None
+        self.n_exg = self.n_orn = self.n_marker = self.n_env = 0
+        self.exg = self.exg_ts = None
+        self.orn = np.empty((max_packets, 9))
+        self.orn_ts = np.empty(max_packets)
+        self.marker = np.empty(max_packets, dtype=np.int32)
+        self.marker_ts = np.empty(max_packets)
+        self.env = np.empty((max_packets, 3))
+        self.env_ts = np.empty(max_packets)
+
+    @property
+    def exg_span(self):
+        """Time span of the collected ExG data in seconds"""
+        if not self.n_exg:
+            return 0.
+        return self.exg_ts[self.n_exg - 1] - self.exg_ts[0]
+
+    def add(self, packet):
+        """Adds the data of a packet to the block
+
+        Args:
+            packet (Packet): Packet object
+
+        Returns:
+            False if the ExG packet does not fit in the block (different number of channels or full block)
+        """
+        if isinstance(packet, EEG):
+            return self.add_exg(packet.data, packet.timestamp, packet.schema.scale)
+        elif isinstance(packet, Orientation):
+            self.orn[self.n_orn, :3] = packet.acc
+            self.orn[self.n_orn, 3:6] = packet.gyro
+            self.orn[self.n_orn, 6:] = packet.mag
+            self.orn_ts[self.n_orn] = packet.timestamp
+            self.n_orn += 1
+        elif isinstance(packet, MarkerEvent):
+            self.marker[self.n_marker] = packet.marker_code
+            self.marker_ts[self.n_marker] = packet.timestamp
+            self.n_marker += 1
+        elif isinstance(packet, Environment):
+            self.env[self.n_env, :] = [packet.temperature, packet.light, packet.battery]
+            self.env_ts[self.n_env] = packet.timestamp
+            self.n_env += 1
+        return True
+
+    def add_exg(self, data, timestamp, resolution=None):
+        """Adds the ExG data of one or more packets with the same number of samples
+
+        Args:
+            data (np.ndarray): ExG data with shape (n_chan, n_sample) of the packets after each other
+            timestamp (float or np.ndarray): Timestamp of each packet
+            resolution (float): Volts per ADC count of the data
+
+        Returns:
+            False if the data does not fit in the block (different number of channels or full block)
+        """
+        n_new = data.shape[1]
+        n_sample = n_new // np.size(timestamp)
+        if self.exg is None:
+            self.n_chan = data.shape[0]
+            self.exg = np.empty((self.n_chan, self.max_packets * n_sample))
+            self.exg_ts = np.empty(self.exg.shape[1])
+        if data.shape[0] != self.n_chan or self.n_exg + n_new > self.exg.shape[1]:
+            return False
+        self.exg[:, self.n_exg:self.n_exg + n_new] = data
+        self.exg_ts[self.n_exg:self.n_exg + n_new] = sample_times(timestamp, n_sample, self.sampling_rate)
+        self.n_exg += n_new
+        if resolution is not None:
+            self.resolution = resolution
+        return True
+
+    def get_block(self):
+        """Returns the collected data as a DataBlock"""
+        if self.exg is None:
+            exg, exg_ts = np.empty((0, 0)), np.empty(0)
+        else:
+            exg, exg_ts = self.exg[:, :self.n_exg], self.exg_ts[:self.n_exg]
+        return DataBlock(exg=exg, exg_timestamp=exg_ts,
+                         orn=self.orn[:self.n_orn], orn_timestamp=self.orn_ts[:self.n_orn],
+                         marker=self.marker[:self.n_marker], marker_timestamp=self.marker_ts[:self.n_marker],
+                         env=self.env[:self.n_env], env_timestamp=self.env_ts[:self.n_env],
+                         exg_resolution=self.resolution)
+
+
+class _ExgBatch:
+    """Binary data and timestamps of consecutive ExG packets of the same type, decoded together by parse_block"""
+
+    def __init__(self):
+        self.schema = None
+        self.bin_data = bytearray()
+        self.timestamps = []
+
+    def add(self, schema, timestamp, bin_data):
+        self.schema = schema
+        self.bin_data += bin_data
+        self.timestamps.append(timestamp)
+
+    def clear(self):
+        self.schema = None
+        del self.bin_data[:]
+        self.timestamps = []
+
+
 class Parser:
-    def __init__(self, bp_freq=None, notch_freq=50, socket=None, fid=None):
+    def __init__(self, bp_freq=None, notch_freq=50, socket=None, fid=None, resync=True, use_mmap=False,
+                 byte_range=None, gap_policy=None):
         """Parser class for explore device
 
         Args:
@@ -37,12 +364,58 @@ class Parser:
             fid (file object): File object for reading data (Should be None if socket is provided)
             bp_freq (tuple): Tuple of cut-off frequencies of bandpass filter (low cut-off frequency, high cut-off frequency)
             notch_freq (int): Notch filter frequency (50 or 60 Hz)
+            resync (bool): If True, corrupt or misaligned packets are skipped by scanning forward to the next valid
+                packet instead of raising an error
+            use_mmap (bool): If True, the file given by fid is memory-mapped and parsed in place (for complete files only)
+            byte_range (tuple): Tuple of (start, end) byte offsets of the part of the memory-mapped file to be parsed
+            gap_policy (str): Filling of missing ExG samples {'nan', 'hold', 'interpolate', None}. If given, the
+                samples lost before an ExG packet are inserted at the start of its data, so the ExG data has no gaps
+                (see explorepy.sequence.fill_gap). Lost packets are counted in self.sequence in any case.
         """
-        self.socket = socket
+        self._stream = None
+        self._socket = None
+        self._raw_tee = None
         self.fid = fid
+        self.use_mmap = use_mmap
+        self.byte_range = byte_range
+        self.socket = socket
+        self.resync = resync
+        self.bytes_skipped = 0
+        self.packets_dropped = 0
+        self._in_sync = True
+        self._resync_pid = None
+        self._resync_start = 0
         self.dt_int16 = np.dtype(np.int16).newbyteorder('<')
         self.dt_uint16 = np.dtype(np.uint16).newbyteorder('<')
         self.time_offset = None
+        self.unwrap_timestamp = CounterUnwrapper()
+        self.clock = ClockSync()
+        self.sequence = SequenceTracker()
+        self.gap_policy = gap_policy
+        self.samples_filled = 0
+        self._last_exg = None
+        self._sampling_rate = 250
+        self.sampling_rate_known = False
+        self.sampling_rate_callbacks = []
+        self._last_exg_time = None
+        self._rate_estimates = []
+        self._replay = deque()
+        self._pending_packet = None
+        self.firmware_version = None
+        self.set_filters(bp_freq, notch_freq)
+
+        self.imp_calib_info = {}
+
+    def set_filters(self, bp_freq=None, notch_freq=50):
+        """Sets the filters of the visualize and impedance modes
+
+        The filters can be changed while parsing, e.g. when switching from visualization to impedance measurement, so
+        the bytes and packets already read from the device are kept.
+
+        Args:
+            bp_freq (tuple): Tuple of cut-off frequencies of bandpass filter (low cut-off frequency, high cut-off frequency)
+            notch_freq (int): Notch filter frequency (50 or 60 Hz)
+        """
         if bp_freq is not None:
             assert bp_freq[0] < bp_freq[1], "High cut-off frequency must be larger than low cut-off frequency"
             self.bp_freq = bp_freq
@@ -51,42 +424,144 @@ class Parser:
             self.apply_bp_filter = False
             self.bp_freq = (0, 100)  # dummy values
         self.notch_freq = notch_freq
-        self.firmware_version = None
-        self.filter = None
+        self.pipeline = None
+        self.noise_pipeline = None
         if self.apply_bp_filter or notch_freq:
-            # Initialize filters
-            self.filter = Filter(l_freq=self.bp_freq[0], h_freq=self.bp_freq[1], line_freq=notch_freq)
+            stages = [Notch(notch_freq)] if notch_freq else []
+            self.pipeline = Pipeline(stages + ([Bandpass(*self.bp_freq)] if self.apply_bp_filter else []),
+                                     sampling_rate=self.sampling_rate)
+            if self.apply_bp_filter:
+                # Noise level for the impedance measurement in a band next to the measurement band
+                self.noise_pipeline = Pipeline(stages + [Bandpass(self.bp_freq[0] + 4, self.bp_freq[1] + 4)],
+                                               sampling_rate=self.sampling_rate)
 
-        self.imp_calib_info = {}
+    @property
+    def sampling_rate(self):
+        """Sampling rate of ExG data (250 Hz until it is known from the device info or the ExG timestamps)"""
+        return self._sampling_rate
+
+    @sampling_rate.setter
+    def sampling_rate(self, sampling_rate):
+        """Sets the sampling rate and updates the filters
+
+        If the rate changes (e.g. by a device info packet after a sampling rate command), the functions in
+        self.sampling_rate_callbacks are called with the new rate, so that consumers of the data (writers, outlets,
+        dashboard) can follow or refuse the change.
+        """
+        is_changed = sampling_rate != self._sampling_rate
+        self._sampling_rate = sampling_rate
+        self.sampling_rate_known = True
+        for pipeline in (self.pipeline, self.noise_pipeline):
+            if pipeline is not None:
+                pipeline.set_sampling_rate(sampling_rate)
+        if is_changed:
+            for callback in list(self.sampling_rate_callbacks):
+                callback(sampling_rate)
 
-    def parse_packet(self, mode="print", csv_files=None, outlets=None, dashboard=None):
+    def _update_sampling_rate(self, packet):
+        """Estimates the sampling rate from the timestamps of the first ExG packets"""
+        if self._last_exg_time is not None and packet.timestamp > self._last_exg_time:
+            self._rate_estimates.append(packet.data.shape[1] / (packet.timestamp - self._last_exg_time))
+        self._last_exg_time = packet.timestamp
+        if len(self._rate_estimates) >= 3:
+            # Lost packets only lower the estimates, so the highest one is used
+            rate = max(self._rate_estimates)
+            self.sampling_rate = min(SAMPLING_RATES, key=lambda valid_rate: abs(valid_rate - rate))
+
+    def detect_sampling_rate(self, max_packets=100):
+        """Reads packets until the sampling rate is known from the device info or the timestamps of ExG packets
+
+        The packets read are kept and returned by the next calls of parse_packet, so no data is lost.
+
+        Args:
+            max_packets (int): Maximum number of packets to be read
+
+        Returns:
+            Sampling rate of ExG data
+        """
+        while not self.sampling_rate_known and len(self._replay) < max_packets:
+            try:
+                self._replay.append(self._read_packet())
+            except ValueError:
+                break
+        return self.sampling_rate
+
+    @property
+    def socket(self):
+        return self._socket
+
+    @socket.setter
+    def socket(self, socket):
+        """Sets the socket (e.g. after a reconnection) and drops the bytes buffered from the previous one"""
+        self._socket = socket
+        if socket is not None:
+            self._stream = StreamBuffer(socket, tee=self._raw_tee)
+        elif self.fid is not None:
+            if self.use_mmap:
+                self._stream = MappedBuffer(self.fid, *(self.byte_range or ()))
+            else:
+                self._stream = StreamBuffer(self.fid)
+        else:
+            self._stream = None
+
+    def close(self):
+        """Releases the read buffer (and the memory map of the file); the socket or file is not closed"""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def raw_tee(self):
+        return self._raw_tee
+
+    @raw_tee.setter
+    def raw_tee(self, tee):
+        """Sets a writer which gets a copy of all bytes read from the socket (None to stop copying)
+
+        Bytes which are buffered but not parsed yet are passed to the new writer first, so it gets the exact stream
+        from the current position on.
+        """
+        self._raw_tee = tee
+        if self._socket is not None:
+            self._stream.tee = tee
+            if tee is not None and self._stream.n_available:
+                tee.write(self._stream.peek(self._stream.n_available))
+
+    def parse_packet(self, mode="print", csv_files=None, outlets=None, dashboard=None, pipeline=None):
         """Reads and parses a package from a file or socket
 
         Args:
             mode (str): logging mode {'print', 'record', 'lsl', 'visualize', None}
-            csv_files (tuple): Tuple of csv file objects (EEG_csv_file, ORN_csv_file, Marker_csv_file)
-            outlets (tuple): Tuple of lsl StreamOutlet (orientation_outlet, EEG_outlet, marker_outlet)
+            csv_files (tuple): Tuple of file writers (ExG, ORN, marker), e.g. CsvWriter objects or a BdfWriter for
+                ExG and markers
+            outlets (tuple): Tuple of ChunkedOutlet objects (orientation_outlet, EEG_outlet, marker_outlet)
             dashboard (Dashboard): Dashboard object for visualization
+            pipeline (explorepy.pipeline.Pipeline): Processing of ExG data in the record, lsl and visualize modes (in
+                visualize mode, the filters of the parser are used if it is None)
         Returns:
             packet object
         """
-        pid = struct.unpack('B', self.read(1))[0]
-        cnt = self.read(1)[0]
-        payload = struct.unpack('<H', self.read(2))[0]
-        timestamp = struct.unpack('<I', self.read(4))[0]
-
-        # Timestamp conversion
-        if self.time_offset is None:
-            self.time_offset = timestamp
-            timestamp = 0
+        if self._pending_packet is not None:
+            # Packet read ahead by parse_block
+            packet, self._pending_packet = self._pending_packet, None
+        elif self._replay:
+            packet = self._replay.popleft()
         else:
-            timestamp = (timestamp - self.time_offset) * .0001  # Timestamp unit is .1 ms
-
-        payload_data = self.read(payload - 4)
-        packet = generate_packet(pid, timestamp, payload_data)
+            packet = self._read_packet()
+        if mode == "visualize" and pipeline is None:
+            pipeline = self.pipeline
+        if pipeline is not None and mode in ("record", "lsl", "visualize") and isinstance(packet, EEG):
+            packet.apply_pipeline(pipeline)
+            if not packet.data.shape[1]:
+                # All samples of the packet have been dropped by decimation
+                return packet
 
-        if isinstance(packet, DeviceInfo):
-            self.firmware_version = packet.firmware_version
         if mode == "print":
             print(packet)
 
@@ -108,11 +583,6 @@ class Parser:
                 packet.push_to_lsl(outlets[2])
 
         elif mode == "visualize":
-            if isinstance(packet, EEG):
-                if self.notch_freq:
-                    packet.apply_notch_filter(exg_filter=self.filter)
-                if self.apply_bp_filter:
-                    packet.apply_bp_filter(exg_filter=self.filter)
             packet.push_to_dashboard(dashboard)
 
         elif mode == "listen":
@@ -129,19 +599,183 @@ class Parser:
         
         elif mode == "impedance":
             if isinstance(packet, EEG):
-                if self.notch_freq:
-                    packet.apply_notch_filter(exg_filter=self.filter)
-                if self.apply_bp_filter:
-                    temp_packet = copy.deepcopy(packet)
-                    temp_packet.apply_bp_filter_noise(exg_filter=self.filter)
-                    mag = np.ptp(temp_packet.data, axis=1)
-                    self.imp_calib_info['noise_level'] = mag
-                    packet.apply_bp_filter(exg_filter=self.filter)
+                if self.noise_pipeline is not None:
+                    self.imp_calib_info['noise_level'] = np.ptp(self.noise_pipeline.apply(packet.data), axis=1)
+                if self.pipeline is not None:
+                    packet.apply_pipeline(self.pipeline)
                 packet.push_to_imp_dashboard(dashboard, self.imp_calib_info)
             elif isinstance(packet, Environment) | isinstance(packet, DeviceInfo):
                 packet.push_to_dashboard(dashboard)
         return packet
 
+    def _read_packet(self):
+        """Reads the next packet and converts its timestamp"""
+        pid, cnt, timestamp, payload_data = self.read_raw_packet()
+        timestamp = self._convert_timestamp(pid, cnt, timestamp)
+        return self._process_packet(generate_packet(pid, timestamp, payload_data))
+
+    def _convert_timestamp(self, pid, cnt, timestamp):
+        """Converts the device timestamp of a packet to seconds and updates the clock and sequence tracking"""
+        timestamp = self.unwrap_timestamp(timestamp)
+        if self.time_offset is None:
+            self.time_offset = timestamp
+            timestamp = 0
+        else:
+            timestamp = (timestamp - self.time_offset) * TIMESTAMP_UNIT
+        if self._socket is not None:
+            self.clock.add(timestamp)
+        self.sequence.update(pid, cnt, timestamp)
+        return timestamp
+
+    def _process_packet(self, packet):
+        """Updates the device state from a new packet (firmware, sampling rate) and fills ExG gaps"""
+        if isinstance(packet, DeviceInfo):
+            self.firmware_version = packet.firmware_version
+            if packet.sampling_rate is not None:
+                self.sampling_rate = packet.sampling_rate
+        elif isinstance(packet, EEG):
+            if not self.sampling_rate_known:
+                self._update_sampling_rate(packet)
+            if self.gap_policy is not None:
+                self._fill_exg_gap(packet)
+        return packet
+
+    def _fill_exg_gap(self, packet):
+        """Inserts the samples missing before an ExG packet according to the gap policy"""
+        if self._last_exg is not None and packet.data.shape[0] == self._last_exg[1].shape[0]:
+            next_time, last_sample = self._last_exg
+            n_missing = int(round((packet.timestamp - next_time) * self.sampling_rate))
+            if n_missing > 0:
+                gap = fill_gap(last_sample, packet.data[:, 0], n_missing, self.gap_policy)
+                packet.data = np.concatenate((gap, packet.data), axis=1)
+                packet.timestamp -= n_missing / self.sampling_rate
+                self.samples_filled += n_missing
+        self._last_exg = (packet.timestamp + packet.data.shape[1] / self.sampling_rate, packet.data[:, -1].copy())
+
+    def parse_block(self, max_packets=100, max_ms=None):
+        """Reads and parses several packets at once and collects their data in contiguous arrays
+
+        The payloads of consecutive ExG packets of the same type (other packet types in between do not matter) are
+        decoded together into one array without creating packet objects. While the sampling rate is unknown or when
+        gaps are filled (see gap_policy), ExG packets are decoded one by one. A packet which does not fit in the block
+        is kept for the next call of parse_block or parse_packet.
+
+        Args:
+            max_packets (int): Maximum number of packets to be parsed
+            max_ms (float): Maximum time span of ExG data in the block in milliseconds (if None, only max_packets is
+                used)
+
+        Returns:
+            DataBlock object
+        """
+        if not self.sampling_rate_known:
+            self.detect_sampling_rate()
+        builder = BlockBuilder(max_packets, self.sampling_rate)
+        batch = _ExgBatch()
+        for n_packet in range(max_packets):
+            if self._pending_packet is not None or self._replay:
+                packet = self.parse_packet(mode=None)
+            else:
+                try:
+                    pid, cnt, timestamp, payload = self.read_raw_packet()
+                except ValueError:
+                    if n_packet == 0:
+                        raise
+                    break
+                timestamp = self._convert_timestamp(pid, cnt, timestamp)
+                schema = PACKET_SCHEMA.get(pid)
+                if schema is not None and schema.layout == INT24 and self.sampling_rate_known and \
+                        self.gap_policy is None:
+                    assert payload[-4:] == schema.fletcher, "Fletcher error!"
+                    if schema.n_chan != (batch.schema or schema).n_chan or \
+                            builder.n_chan not in (None, schema.n_chan):
+                        # Number of channels has changed; keep the packet for the next block
+                        self._pending_packet = generate_packet(pid, timestamp, payload)
+                        break
+                    if batch.schema is not schema:
+                        self._add_batch(builder, batch)
+                    batch.add(schema, timestamp, payload[:-4])
+                    first_time = builder.exg_ts[0] if builder.n_exg else batch.timestamps[0]
+                    last_time = timestamp + (schema.n_sample - 1) / self.sampling_rate
+                    if max_ms is not None and (last_time - first_time) * 1000 >= max_ms:
+                        break
+                    continue
+                packet = self._process_packet(generate_packet(pid, timestamp, payload))
+
+            if isinstance(packet, (EEG, DeviceInfo)):
+                # Collected ExG data is added first to keep the order of the ExG samples and their sampling rate;
+                # other packets go to their own arrays and do not interrupt the batch
+                self._add_batch(builder, batch)
+                builder.sampling_rate = self.sampling_rate
+            if not builder.add(packet):
+                # Packet layout has changed; keep it for the next block
+                self._pending_packet = packet
+                break
+            if max_ms is not None and isinstance(packet, EEG) and builder.exg_span * 1000 >= max_ms:
+                break
+        self._add_batch(builder, batch)
+        return builder.get_block()
+
+    @staticmethod
+    def _add_batch(builder, batch):
+        """Decodes the collected ExG payloads at once and adds the data to the block"""
+        if batch.timestamps:
+            values = batch.schema.decode(bytes(batch.bin_data))
+            builder.add_exg(values[batch.schema.n_row - batch.schema.n_chan:], np.array(batch.timestamps),
+                            batch.schema.scale)
+            batch.clear()
+
+    @property
+    def position(self):
+        """Byte offset of the next packet in the stream"""
+        return self._stream.position
+
+    def read_raw_packet(self):
+        """Reads the header and the payload (binary data and fletcher) of the next packet without decoding it
+
+        In resync mode, the header and fletcher are validated against the packet schema. If they don't match, the stream
+        is scanned forward byte by byte until the next valid packet, so only the damaged bytes are dropped.
+
+        Returns:
+            Tuple of (pid, cnt, timestamp, payload). The payload is a view of the read buffer which is only valid until
+            the next read.
+        """
+        stream = self._stream
+        while True:
+            pid, cnt, payload_len, timestamp = HEADER.unpack_from(stream.peek(HEADER_SIZE))
+            packet_len = payload_len + 4
+            if not self.resync:
+                payload = stream.peek(packet_len)[HEADER_SIZE:]
+                stream.consume(packet_len)
+                return pid, cnt, timestamp, payload
+
+            schema = PACKET_SCHEMA.get(pid)
+            if schema is not None and schema.is_valid_size(payload_len - 8):
+                payload = stream.peek(packet_len)[HEADER_SIZE:]
+                if payload[-4:] == schema.fletcher:
+                    stream.consume(packet_len)
+                    if not self._in_sync:
+                        self._report_resync()
+                    return pid, cnt, timestamp, payload
+
+            # Misaligned or corrupt packet: drop one byte and look for the next valid header
+            stream.consume(1)
+            self.bytes_skipped += 1
+            if self._in_sync:
+                self.packets_dropped += 1
+                self._in_sync = False
+                self._resync_pid = pid
+                self._resync_start = self.bytes_skipped - 1
+
+    def _report_resync(self):
+        """Print the packet which caused the stream to lose sync and the number of bytes skipped to resync"""
+        self._in_sync = True
+        if self._resync_pid in PACKET_SCHEMA:
+            reason = "Corrupt packet (ID: " + str(self._resync_pid) + ")"
+        else:
+            reason = "Unknown Packet ID:" + str(self._resync_pid)
+        print("Warning: " + reason + "; skipped", self.bytes_skipped - self._resync_start, "bytes to resync")
+
     def read(self, n_bytes):
         """Read n_bytes from socket or file
 
@@ -151,16 +785,9 @@ class Parser:
         Returns:
             list of bytes
         """
-        if self.socket is not None:
-            byte_data = self.socket.recv(n_bytes)
-        elif not self.fid.closed:
-            byte_data = self.fid.read(n_bytes)
-        else:
-            raise ValueError("File has been closed unexpectedly!")
-        if len(byte_data) != n_bytes:
-            raise ValueError("Number of received bytes is less than expected")
-            # TODO: Create a specific exception for this case
-        return byte_data
+        if self._stream is None:
+            raise ValueError("No socket or file to read from!")
+        return self._stream.read(n_bytes)
 
     def send_msg(self, msg):
         """
@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+"""Real-time processing pipeline of ExG data
+
+A Pipeline is a list of stages (e.g. notch filter, bandpass filter, re-referencing, decimation, resampling, scaling and
+channel selection) which is configured once for the channel count and sampling rate of the data. Configuring validates
+the stages, merges consecutive IIR filter stages into one SOS cascade and allocates all intermediate buffers, so
+processing a block of data does not allocate any arrays.
+"""
+import math
+from fractions import Fraction
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import firwin
+from explorepy.filters import Filter, design_sos
+
+
+class Stage:
+    """Base class of pipeline stages
+
+    A stage is configured with the channel count and sampling rate of its input and processes blocks with shape
+    (n_chan, n_sample) into an output array provided by the pipeline.
+    """
+    in_place = True  # The output has the shape of the input and may be written over it
+
+    def __init__(self):
+        self.time_shift = 0.  # Time of the first output sample of the last block relative to the first input sample
+
+    def configure(self, n_chan, sampling_rate):
+        """Validates the input format and resets the state of the stage
+
+        Args:
+            n_chan (int): Number of input channels
+            sampling_rate (float): Input sampling rate
+
+        Returns:
+            Number of output channels
+        """
+        return n_chan
+
+    def output_rate(self, sampling_rate):
+        """Output sampling rate for the given input sampling rate"""
+        return sampling_rate
+
+    def allocate(self, max_samples):
+        """Allocates the internal buffers for blocks of up to max_samples samples"""
+
+    def max_out(self, n_sample):
+        """Maximum number of output samples for a block of n_sample samples"""
+        return n_sample
+
+    def n_out(self, n_sample):
+        """Number of output samples for the next block of n_sample samples"""
+        return n_sample
+
+    def process(self, data, out):
+        """Processes a block of data
+
+        Args:
+            data (np.ndarray): Input data with shape (n_chan, n_sample)
+            out (np.ndarray): Output array with shape (n_chan_out, n_out(n_sample)); it may be data itself for in-place
+                stages
+
+        Returns:
+            out
+        """
+        raise NotImplementedError
+
+
+class SosStage(Stage):
+    """Base class of IIR filter stages; consecutive SOS stages are run as one cascade"""
+
+    def design(self, sampling_rate):
+        """Returns the second-order sections of the filter for the sampling rate"""
+        raise NotImplementedError
+
+    def configure(self, n_chan, sampling_rate):
+        self.design(sampling_rate)
+        return n_chan
+
+
+class Notch(SosStage):
+    """Notch filter for the line noise"""
+
+    def __init__(self, line_freq=50, order=5):
+        """
+        Args:
+            line_freq (float): Line frequency (50 or 60 Hz)
+            order (int): Filter order
+        """
+        super().__init__()
+        self.line_freq = line_freq
+        self.order = order
+
+    def design(self, sampling_rate):
+        assert self.line_freq + 2 < sampling_rate / 2, "Notch frequency must be below the Nyquist frequency!"
+        return design_sos('bandstop', (self.line_freq - 2, self.line_freq + 2), self.order, sampling_rate)
+
+
+class Bandpass(SosStage):
+    """Butterworth bandpass filter (highpass or lowpass filter if one of the cut-off frequencies is None)"""
+
+    def __init__(self, l_freq, h_freq, order=5):
+        """
+        Args:
+            l_freq (float): Low cut-off frequency (None for a lowpass filter)
+            h_freq (float): High cut-off frequency (None for a highpass filter)
+            order (int): Filter order
+        """
+        super().__init__()
+        assert l_freq is not None or h_freq is not None, "No cut-off frequency has been given!"
+        self.l_freq = l_freq
+        self.h_freq = h_freq
+        self.order = order
+
+    def design(self, sampling_rate):
+        assert self.h_freq is None or self.h_freq < sampling_rate / 2, \
+            "High cut-off frequency must be below the Nyquist frequency!"
+        if self.l_freq is None:
+            return design_sos('lowpass', self.h_freq, self.order, sampling_rate)
+        if self.h_freq is None:
+            return design_sos('highpass', self.l_freq, self.order, sampling_rate)
+        assert 0 < self.l_freq < self.h_freq, "High cut-off frequency must be larger than low cut-off frequency"
+        return design_sos('band', (self.l_freq, self.h_freq), self.order, sampling_rate)
+
+
+class _Cascade(Stage):
+    """Consecutive SOS stages run as one cascade (created by Pipeline.configure)"""
+
+    def __init__(self, stages):
+        super().__init__()
+        self.stages = stages
+        self._filter = None
+
+    def configure(self, n_chan, sampling_rate):
+        self._filter = Filter(l_freq=None, h_freq=None, line_freq=None, sampling_rate=sampling_rate)
+        for stage in self.stages:
+            self._filter.add_stage(stage.design(sampling_rate))
+        return n_chan
+
+    def process(self, data, out):
+        return self._filter.apply(data, out=out)
+
+
+class Rereference(Stage):
+    """Subtracts the mean of the reference channels from all channels"""
+
+    def __init__(self, channels=None):
+        """
+        Args:
+            channels (list): Indices of the reference channels (None for common average reference)
+        """
+        super().__init__()
+        self.channels = channels
+        self._weights = None
+        self._ref = None
+
+    def configure(self, n_chan, sampling_rate):
+        channels = np.arange(n_chan) if self.channels is None else np.asarray(self.channels)
+        assert channels.size and np.all((0 <= channels) & (channels < n_chan)), "Invalid reference channels!"
+        self._weights = np.zeros(n_chan)
+        np.add.at(self._weights, channels, 1. / channels.size)
+        return n_chan
+
+    def allocate(self, max_samples):
+        self._ref = np.empty(max_samples)
+
+    def process(self, data, out):
+        ref = self._ref[:data.shape[1]]
+        np.dot(self._weights, data, out=ref)
+        return np.subtract(data, ref, out=out)
+
+
+class Decimate(Stage):
+    """Decimation by an integer factor with an anti-aliasing lowpass filter
+
+    The lowpass filter is a Butterworth filter at 80% of the output Nyquist frequency. The position of the next output
+    sample is carried from block to block, so the output is the same as for the whole signal.
+    """
+    in_place = False
+
+    def __init__(self, factor, order=8):
+        """
+        Args:
+            factor (int): Decimation factor
+            order (int): Order of the anti-aliasing filter
+        """
+        super().__init__()
+        assert int(factor) == factor and factor >= 1, "Decimation factor must be a positive integer!"
+        self.factor = int(factor)
+        self.order = order
+        self._filter = None
+        self._filtered = None
+        self._n_chan = None
+        self._sampling_rate = None
+        self._phase = 0
+
+    def configure(self, n_chan, sampling_rate):
+        self._filter = Filter(l_freq=None, h_freq=None, line_freq=None, sampling_rate=sampling_rate)
+        self._filter.add_stage(design_sos('lowpass', .8 * sampling_rate / 2 / self.factor, self.order, sampling_rate))
+        self._n_chan = n_chan
+        self._sampling_rate = sampling_rate
+        self._phase = 0
+        return n_chan
+
+    def output_rate(self, sampling_rate):
+        return sampling_rate / self.factor
+
+    def allocate(self, max_samples):
+        self._filtered = np.empty(self._n_chan * max_samples)
+
+    def max_out(self, n_sample):
+        return -(-n_sample // self.factor)
+
+    def n_out(self, n_sample):
+        return len(range(self._phase, n_sample, self.factor))
+
+    def process(self, data, out):
+        n_sample = data.shape[1]
+        filtered = self._filter.apply(data, out=self._filtered[:data.size].reshape(data.shape))
+        out[...] = filtered[:, self._phase::self.factor]
+        self.time_shift = self._phase / self._sampling_rate
+        self._phase = (self._phase - n_sample) % self.factor
+        return out
+
+
+class Resample(Stage):
+    """Polyphase resampling by a rational factor up/down
+
+    The anti-aliasing filter is a linear-phase FIR filter designed like in scipy.signal.resample_poly; only the
+    output samples are computed, from one polyphase branch of the filter each. The last input samples and the position
+    of the next output sample are carried from block to block, so the output equals the causal filtering of the whole
+    signal (scipy.signal.upfirdn). The filter delay is compensated in time_shift, so the output times match the input.
+
+    A stage created by from_rates keeps its output rate: the factors and the filter are designed again when the input
+    sampling rate changes.
+    """
+    in_place = False
+
+    def __init__(self, up, down, window=('kaiser', 5.0)):
+        """
+        Args:
+            up (int): Upsampling factor
+            down (int): Downsampling factor
+            window: Window of the FIR filter design (see scipy.signal.firwin)
+        """
+        super().__init__()
+        assert int(up) == up >= 1 and int(down) == down >= 1, "Resampling factors must be positive integers!"
+        self.window = window
+        self.target_rate = None
+        self._design(up, down)
+        self._buffer = None
+        self._result = None
+        self._n_chan = None
+        self._sampling_rate = None
+        self._next = 0
+
+    def _design(self, up, down):
+        divisor = math.gcd(int(up), int(down))
+        self.up = int(up) // divisor
+        self.down = int(down) // divisor
+        max_rate = max(self.up, self.down)
+        if max_rate == 1:
+            self.half_len, taps = 0, np.ones(1)
+        else:
+            self.half_len = 10 * max_rate
+            taps = firwin(2 * self.half_len + 1, 1. / max_rate, window=self.window) * self.up
+        # Polyphase branches, reversed for the dot product with the input windows
+        self.n_taps = -(-taps.size // self.up)
+        branches = np.zeros(self.n_taps * self.up)
+        branches[:taps.size] = taps
+        self._branches = branches.reshape(self.n_taps, self.up).T[:, ::-1].copy()
+
+    @staticmethod
+    def _get_factors(sampling_rate, target_rate):
+        ratio = Fraction(target_rate / sampling_rate).limit_denominator(1000)
+        return ratio.numerator, ratio.denominator
+
+    @classmethod
+    def from_rates(cls, sampling_rate, target_rate, **kwargs):
+        """Creates a resampling stage from the input and output sampling rates
+
+        Args:
+            sampling_rate (float): Input sampling rate
+            target_rate (float): Output sampling rate
+        """
+        stage = cls(*cls._get_factors(sampling_rate, target_rate), **kwargs)
+        stage.target_rate = target_rate
+        return stage
+
+    def configure(self, n_chan, sampling_rate):
+        if self.target_rate is not None:
+            factors = self._get_factors(sampling_rate, self.target_rate)
+            if factors != (self.up, self.down):
+                self._design(*factors)
+        self._n_chan = n_chan
+        self._sampling_rate = sampling_rate
+        self._next = 0
+        self._buffer = None
+        return n_chan
+
+    def output_rate(self, sampling_rate):
+        if self.target_rate is not None:
+            up, down = self._get_factors(sampling_rate, self.target_rate)
+            return sampling_rate * up / down
+        return sampling_rate * self.up / self.down
+
+    def allocate(self, max_samples):
+        history = self._buffer[:, -(self.n_taps - 1):] if self._buffer is not None and self.n_taps > 1 else None
+        self._buffer = np.zeros((self._n_chan, self.n_taps - 1 + max_samples))
+        if history is not None and history.shape[0] == self._n_chan:
+            self._buffer[:, :self.n_taps - 1] = history
+        self._result = np.empty(self._n_chan * self.max_out(max_samples))
+
+    def max_out(self, n_sample):
+        return -(-n_sample * self.up // self.down) + 1
+
+    def n_out(self, n_sample):
+        return len(range(self._next, n_sample * self.up, self.down))
+
+    def process(self, data, out):
+        n_sample = data.shape[1]
+        if not n_sample:
+            return out
+        n_hist = self.n_taps - 1
+        self._buffer[:, n_hist:n_hist + n_sample] = data
+        windows = sliding_window_view(self._buffer[:, :n_hist + n_sample], self.n_taps, axis=1)
+        n_out = out.shape[1]
+        # Output samples with the same polyphase branch have input positions spaced by down
+        for first in range(min(self.up, n_out)):
+            position = self._next + first * self.down
+            branch, start = position % self.up, position // self.up
+            n_branch = len(range(first, n_out, self.up))
+            result = self._result[:self._n_chan * n_branch].reshape(self._n_chan, n_branch)
+            np.matmul(windows[:, start::self.down][:, :n_branch], self._branches[branch], out=result)
+            out[:, first::self.up] = result
+        self.time_shift = (self._next - self.half_len) / self.up / self._sampling_rate
+        self._next += n_out * self.down - n_sample * self.up
+        self._buffer[:, :n_hist] = self._buffer[:, n_sample:n_sample + n_hist]
+        return out
+
+
+class Scale(Stage):
+    """Multiplies the data by a gain and adds an offset (e.g. for unit conversion)"""
+
+    def __init__(self, gain, offset=0.):
+        """
+        Args:
+            gain (float or list): Gain for all channels or one gain per channel
+            offset (float): Offset added after the multiplication
+        """
+        super().__init__()
+        self.gain = gain
+        self.offset = offset
+        self._gain = None
+
+    def configure(self, n_chan, sampling_rate):
+        self._gain = np.asarray(self.gain, dtype=np.float64).reshape(-1, 1)
+        assert self._gain.shape[0] in (1, n_chan), "The number of gains must match the number of channels!"
+        return n_chan
+
+    def process(self, data, out):
+        np.multiply(data, self._gain, out=out)
+        if self.offset:
+            np.add(out, self.offset, out=out)
+        return out
+
+
+class ChannelSelect(Stage):
+    """Selects (or reorders) channels"""
+    in_place = False
+
+    def __init__(self, channels):
+        """
+        Args:
+            channels (list): Indices of the selected channels
+        """
+        super().__init__()
+        self.channels = np.asarray(channels, dtype=np.intp)
+
+    def configure(self, n_chan, sampling_rate):
+        assert self.channels.size and np.all((0 <= self.channels) & (self.channels < n_chan)), \
+            "Invalid channel selection!"
+        return self.channels.size
+
+    def process(self, data, out):
+        return np.take(data, self.channels, axis=0, out=out, mode='clip')
+
+
+class Pipeline:
+    """Chain of processing stages for blocks of ExG data
+
+    The pipeline is configured at the first block (or by configure) and again when the sampling rate changes. The
+    output of apply is a view of an internal buffer, which is valid until the next call.
+    """
+
+    def __init__(self, stages, sampling_rate=250., n_chan=None, max_samples=64):
+        """
+        Args:
+            stages (list): List of Stage objects in the order of processing
+            sampling_rate (float): Input sampling rate
+            n_chan (int): Number of input channels (if None, the pipeline is configured at the first block)
+            max_samples (int): Initial size of the buffers in samples (they grow for longer blocks)
+        """
+        self.stages = list(stages)
+        self.sampling_rate = float(sampling_rate)
+        self.max_samples = max_samples
+        self.n_chan = None
+        self.n_chan_out = None
+        self.time_shift = 0.
+        self._steps = None
+        self._plan = None
+        if n_chan is not None:
+            self.configure(n_chan)
+
+    @property
+    def sampling_rate_out(self):
+        """Output sampling rate"""
+        sampling_rate = self.sampling_rate
+        for stage in self.stages:
+            sampling_rate = stage.output_rate(sampling_rate)
+        return sampling_rate
+
+    def configure(self, n_chan, sampling_rate=None):
+        """Validates the stages for the input format and prepares the execution of the pipeline
+
+        Args:
+            n_chan (int): Number of input channels
+            sampling_rate (float): Input sampling rate (if None, the current sampling rate is kept)
+        """
+        if sampling_rate is not None:
+            self.sampling_rate = float(sampling_rate)
+        self._steps = []
+        for stage in self.stages:
+            if isinstance(stage, SosStage):
+                if self._steps and isinstance(self._steps[-1], _Cascade):
+                    self._steps[-1].stages.append(stage)
+                else:
+                    self._steps.append(_Cascade([stage]))
+            else:
+                self._steps.append(stage)
+        self._plan = []
+        rate = self.sampling_rate
+        n_chan_out = n_chan
+        for step in self._steps:
+            n_chan_out = step.configure(n_chan_out, rate)
+            rate = step.output_rate(rate)
+            self._plan.append([step, n_chan_out, None])
+        self.n_chan = n_chan
+        self.n_chan_out = n_chan_out
+        self._allocate(self.max_samples)
+
+    def _allocate(self, max_samples):
+        self.max_samples = max_samples
+        buffer = None
+        n_chan = self.n_chan
+        for step_plan in self._plan:
+            step, n_chan_out, _ = step_plan
+            step.allocate(max_samples)
+            n_out = step.max_out(max_samples)
+            # In-place stages write over the output of the previous stage
+            if buffer is None or not step.in_place or n_chan_out != n_chan:
+                buffer = np.empty(n_chan_out * n_out)
+            step_plan[2] = buffer
+            n_chan, max_samples = n_chan_out, n_out
+
+    def set_sampling_rate(self, sampling_rate):
+        """Changes the input sampling rate; a configured pipeline is configured again (which resets its state)
+
+        Args:
+            sampling_rate (float): Input sampling rate
+        """
+        if float(sampling_rate) != self.sampling_rate:
+            self.sampling_rate = float(sampling_rate)
+            if self.n_chan is not None:
+                self.configure(self.n_chan)
+
+    def reset(self):
+        """Resets the state of all stages (e.g. after a gap in the data)"""
+        if self.n_chan is not None:
+            self.configure(self.n_chan)
+
+    def apply(self, data):
+        """Processes a block of data
+
+        Args:
+            data (np.ndarray): Data with shape (n_chan, n_sample)
+
+        Returns:
+            Processed data with shape (n_chan_out, n_sample_out); a view of an internal buffer, valid until the next
+            call. The time of the first output sample relative to the first input sample is given by self.time_shift.
+        """
+        data = np.asarray(data, dtype=np.float64)
+        if len(data.shape) < 2:
+            data = data[np.newaxis, :]
+        if self.n_chan is None:
+            self.configure(data.shape[0])
+        assert data.shape[0] == self.n_chan, "The pipeline has been configured for " + str(self.n_chan) + \
+                                             " channels, the data has " + str(data.shape[0]) + " channels!"
+        if data.shape[1] > self.max_samples:
+            self._allocate(data.shape[1])
+        self.time_shift = 0.
+        last_buffer = None
+        for step, n_chan_out, buffer in self._plan:
+            if buffer is last_buffer:
+                out = data
+            else:
+                n_out = step.n_out(data.shape[1])
+                out = buffer[:n_chan_out * n_out].reshape(n_chan_out, n_out)
+            data = step.process(data, out)
+            self.time_shift += step.time_shift
+            last_buffer = buffer
+        return data
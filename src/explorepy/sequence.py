@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Detection of lost packets and filling of gaps in ExG data"""
+import numpy as np
+
+COUNTER_SIZE = 256  # The packet counter in the header is one byte
+GAP_POLICIES = ['nan', 'hold', 'interpolate']
+
+
+class SequenceTracker:
+    """Detects lost packets from the packet counter (cnt) in the packet headers
+
+    The device increments the counter with every packet it sends, so a jump of the counter means packets have been lost
+    on the link (or skipped by the parser as corrupt). By default one counter is tracked for all packets; with
+    per_type, each packet type is tracked on its own (for firmwares counting each type separately). As the counter is
+    one byte, a gap of more than 255 packets (e.g. a reconnection) is counted modulo 256, while its duration is still
+    measured from the timestamps.
+    """
+
+    def __init__(self, per_type=False):
+        """
+        Args:
+            per_type (bool): Track a separate counter for each packet type
+        """
+        self.per_type = per_type
+        self.n_received = {}
+        self.n_lost = 0
+        self.n_gaps = 0
+        self.longest_gap = 0
+        self.longest_gap_duration = 0.
+        self._last = {}
+
+    @property
+    def n_packets(self):
+        """Number of received packets"""
+        return sum(self.n_received.values())
+
+    @property
+    def loss_rate(self):
+        """Ratio of lost packets to all packets sent by the device"""
+        n_sent = self.n_packets + self.n_lost
+        return self.n_lost / n_sent if n_sent else 0.
+
+    def update(self, pid, cnt, timestamp):
+        """Adds a received packet
+
+        Args:
+            pid (int): Packet ID
+            cnt (int): Packet counter
+            timestamp (float): Packet timestamp in seconds
+
+        Returns:
+            Number of packets lost before this packet
+        """
+        key = pid if self.per_type else None
+        self.n_received[pid] = self.n_received.get(pid, 0) + 1
+        last = self._last.get(key)
+        self._last[key] = (cnt, timestamp)
+        if last is None:
+            return 0
+        n_lost = (cnt - last[0] - 1) % COUNTER_SIZE
+        if n_lost == COUNTER_SIZE - 1:
+            # Repeated counter value (e.g. a packet sent twice); nothing is lost
+            return 0
+        if n_lost:
+            self.n_lost += n_lost
+            self.n_gaps += 1
+            self.longest_gap = max(self.longest_gap, n_lost)
+            self.longest_gap_duration = max(self.longest_gap_duration, timestamp - last[1])
+        return n_lost
+
+    def reset(self):
+        """Forgets the last counter values (e.g. when the device has been restarted)"""
+        self._last = {}
+
+    def __str__(self):
+        return "Received packets: " + str(self.n_packets) + "\tLost packets: " + str(self.n_lost) + \
+               " (%.3f%%)" % (100 * self.loss_rate) + "\tGaps: " + str(self.n_gaps) + \
+               "\tLongest gap: " + str(self.longest_gap) + " packets (%.3f s)" % self.longest_gap_duration
+
+
+def fill_gap(last_sample, next_sample, n_missing, policy):
+    """Generates the missing ExG samples of a gap
+
+    Args:
+        last_sample (np.ndarray): Last sample before the gap (one value per channel)
+        next_sample (np.ndarray): First sample after the gap
+        n_missing (int): Number of missing samples
+        policy (str): Gap policy {'nan', 'hold', 'interpolate'}
+
+    Returns:
+        np.ndarray of samples with shape (n_chan, n_missing)
+    """
+    assert policy in GAP_POLICIES, "Invalid gap policy! Valid policies are: " + str(GAP_POLICIES)
+    last_sample = np.asarray(last_sample, dtype=np.float64)[:, np.newaxis]
+    if policy == 'nan':
+        return np.full((last_sample.shape[0], n_missing), np.nan)
+    if policy == 'hold':
+        return np.repeat(last_sample, n_missing, axis=1)
+    weights = np.arange(1, n_missing + 1) / (n_missing + 1)
+    return last_sample + (np.asarray(next_sample, dtype=np.float64)[:, np.newaxis] - last_sample) * weights
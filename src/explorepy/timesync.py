@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""Device timestamps and synchronization of the device clock with the host clock"""
+from collections import deque
+import numpy as np
+from pylsl import local_clock
+
+TIMESTAMP_UNIT = .0001  # Device timestamp unit is .1 ms
+COUNTER_BITS = 32
+
+
+def unwrap_counter(timestamp, n_bits=COUNTER_BITS):
+    """Unwraps a sequence of device timestamps across rollovers of the counter
+
+    Args:
+        timestamp (np.ndarray): Raw device timestamps in the order of the packets
+        n_bits (int): Size of the counter in bits
+
+    Returns:
+        np.ndarray of monotonic timestamps (int64)
+    """
+    timestamp = np.asarray(timestamp, dtype=np.int64)
+    if not timestamp.size:
+        return timestamp
+    n_wraps = np.cumsum(np.diff(timestamp, prepend=timestamp[0]) < -(1 << (n_bits - 1)))
+    return timestamp + (n_wraps << n_bits)
+
+
+def sample_times(timestamp, n_sample, sampling_rate):
+    """Generates the time of each sample from packet timestamps
+
+    Args:
+        timestamp (float or np.ndarray): Time of the first sample of each packet in seconds
+        n_sample (int): Number of samples per packet
+        sampling_rate (float): Sampling rate
+
+    Returns:
+        np.ndarray of sample times (packets after each other)
+    """
+    timestamp = np.asarray(timestamp, dtype=np.float64)
+    return (timestamp[..., np.newaxis] + np.arange(n_sample) / sampling_rate).ravel()
+
+
+class CounterUnwrapper:
+    """Unwraps device timestamps packet by packet (see unwrap_counter)"""
+
+    def __init__(self, last=None, n_wraps=0, n_bits=COUNTER_BITS):
+        """
+        Args:
+            last (int): Raw timestamp of the previous packet (None at the start of a stream)
+            n_wraps (int): Number of rollovers before the previous packet
+            n_bits (int): Size of the counter in bits
+        """
+        self.last = last
+        self.n_wraps = n_wraps
+        self.n_bits = n_bits
+
+    def __call__(self, timestamp):
+        if self.last is not None and timestamp < self.last - (1 << (self.n_bits - 1)):
+            self.n_wraps += 1
+        self.last = timestamp
+        return timestamp + (self.n_wraps << self.n_bits)
+
+
+class ClockSync:
+    """Online estimate of the offset and drift of the device clock relative to the host clock
+
+    Device timestamps are paired with the host time at which their packets arrive. The arrival is delayed by a random
+    transmission time, so only the pair with the smallest delay in each period is kept, and a line (offset and drift)
+    is fitted to the pairs of a sliding window. Pairs far off the line (e.g. after a burst of retransmissions) are
+    discarded and the line is fitted again. The constant part of the transmission latency cannot be observed; mapped
+    times are those of the fastest packets.
+
+    The mapping is used for the LSL streams only; recorded files keep the device time, so they match the files converted
+    from the BIN files of the device.
+    """
+
+    def __init__(self, period=1., window=600, host_clock=local_clock):
+        """
+        Args:
+            period (float): Duration (in device seconds) of the periods in which the fastest packet is selected
+            window (int): Number of periods used for the fit
+            host_clock (callable): Host clock returning the time in seconds (by default the lsl clock)
+        """
+        self.period = period
+        self.host_clock = host_clock
+        self.t_ref = None
+        self.offset = None
+        self.drift = 0.
+        self._device_time = deque(maxlen=window)
+        self._delay = deque(maxlen=window)
+        self._period_start = None
+        self._best_pair = None
+
+    @property
+    def n_pairs(self):
+        """Number of time pairs used in the current fit"""
+        return len(self._device_time)
+
+    def add(self, device_time, host_time=None):
+        """Adds a pair of device and host time
+
+        Args:
+            device_time (float): Device time in seconds
+            host_time (float): Host time in seconds (if None, the current time of the host clock is used)
+        """
+        if host_time is None:
+            host_time = self.host_clock()
+        delay = host_time - device_time
+        if self._best_pair is None:
+            self.t_ref = device_time
+            self.offset = delay
+            self._period_start = device_time
+            self._best_pair = (device_time, delay)
+            return
+        if device_time - self._period_start >= self.period:
+            self._device_time.append(self._best_pair[0])
+            self._delay.append(self._best_pair[1])
+            self._fit()
+            self._period_start = device_time
+            self._best_pair = (device_time, delay)
+        elif delay < self._best_pair[1]:
+            self._best_pair = (device_time, delay)
+            if not self._device_time:
+                self.offset = delay
+
+    def _fit(self):
+        x = np.array(self._device_time) - self.t_ref
+        y = np.array(self._delay)
+        if len(x) < 3:
+            self.offset = y.min()
+            return
+        drift, offset = np.polyfit(x, y, 1)
+        residual = y - (offset + drift * x)
+        mad = np.median(np.abs(residual - np.median(residual)))
+        inliers = np.abs(residual) <= 3 * 1.4826 * mad + 1e-4
+        if 2 < inliers.sum() < len(x):
+            drift, offset = np.polyfit(x[inliers], y[inliers], 1)
+        self.drift, self.offset = drift, offset
+
+    def device_to_host(self, device_time):
+        """Maps device times to host times
+
+        Args:
+            device_time (float or np.ndarray): Device times in seconds
+
+        Returns:
+            Host times in seconds
+        """
+        assert self.offset is not None, "No time pairs have been added yet!"
+        device_time = np.asarray(device_time, dtype=np.float64)
+        return device_time + self.offset + self.drift * (device_time - self.t_ref)
+
+    def host_to_device(self, host_time):
+        """Maps host times (e.g. of software markers) to device times
+
+        Args:
+            host_time (float or np.ndarray): Host times in seconds
+
+        Returns:
+            Device times in seconds
+        """
+        assert self.offset is not None, "No time pairs have been added yet!"
+        host_time = np.asarray(host_time, dtype=np.float64)
+        return (host_time - self.offset + self.drift * self.t_ref) / (1 + self.drift)
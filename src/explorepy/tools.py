@@ -1,10 +1,14 @@
 # -*- coding: utf-8 -*-
 from explorepy.parser import Parser
 import os.path
-import csv
+import io
 import bluetooth
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from explorepy.filters import Filter
+from explorepy.timesync import CounterUnwrapper, COUNTER_BITS, unwrap_counter
+from explorepy.writers import create_csv_writers, get_out_files, open_file_writers, EXG_HEADER, ORN_HEADER
+from contextlib import ExitStack
 from scipy import signal
 
 
@@ -32,7 +36,11 @@ def bt_scan():
     return explore_devices
 
 
-def bin2csv(bin_file, do_overwrite=False, out_dir=None):
+BIN2CSV_CHUNK_SIZE = 1 << 23  # Approximate size of the parts of a BIN file converted in parallel (bytes)
+BIN2CSV_BLOCK_SIZE = 1000  # Number of packets parsed at once
+
+
+def bin2csv(bin_file, do_overwrite=False, out_dir=None, workers=1, file_type='csv'):
 
     """Binary to CSV file converter.
     This function converts the given binary file to ExG and ORN csv files.
@@ -41,6 +49,10 @@ def bin2csv(bin_file, do_overwrite=False, out_dir=None):
         bin_file (str): Binary file full address
         out_dir (str): Output directory (if None, uses the same directory as binary file)
         do_overwrite (bool): Overwrite if files exist already
+        workers (int): Number of worker processes. If larger than 1, the file is split at packet boundaries and the
+            parts are converted in parallel (the output is identical to the serial conversion).
+        file_type (str): Output file type {'csv', 'bdf', 'exz', 'npy'} (see Explore.record_data). Only csv files are
+            converted in parallel.
 
     Returns:
 
@@ -49,37 +61,118 @@ def bin2csv(bin_file, do_overwrite=False, out_dir=None):
     filename, extension = os.path.splitext(full_filename)
     assert os.path.isfile(bin_file), "Error: File does not exist!"
     assert extension == '.BIN', "File type error! File extension must be BIN."
+    assert workers >= 1, "Number of workers must be at least 1"
     if out_dir is None:
         out_dir = head_path + '/'
 
-    eeg_out_file = out_dir + filename + '_eeg.csv'
-    orn_out_file = out_dir + filename + '_orn.csv'
-    marker_out_file = out_dir + filename + '_marker.csv'
+    out_files = get_out_files(out_dir + filename, file_type, suffixes=('_eeg', '_orn', '_marker'))
 
     if not do_overwrite:
-        assert not os.path.isfile(eeg_out_file), eeg_out_file + " already exists!"
-        assert not os.path.isfile(orn_out_file), orn_out_file + " already exists!"
-        assert not os.path.isfile(marker_out_file), marker_out_file + " already exists!"
-
-    with open(bin_file, "rb") as f_bin, open(eeg_out_file, "w") as f_eeg, open(orn_out_file, "w") as f_orn, \
-        open(marker_out_file, "w") as f_marker:
-        parser = Parser(fid=f_bin)
-        f_orn.write('TimeStamp,ax,ay,az,gx,gy,gz,mx,my,mz\n')
-        # f_orn.write('hh:mm:ss, mg/LSB, mg/LSB, mg/LSB, mdps/LSB, mdps/LSB, mdps/LSB,'
-        #             ' mgauss/LSB, mgauss/LSB, mgauss/LSB\n')
-        f_eeg.write('TimeStamp,ch1,ch2,ch3,ch4,ch5,ch6,ch7,ch8\n')
-
-        csv_eeg = csv.writer(f_eeg, delimiter=',')
-        csv_orn = csv.writer(f_orn, delimiter=',')
-        csv_marker = csv.writer(f_marker, delimiter=',')
-
+        for out_file in out_files.values():
+            assert not os.path.isfile(out_file), out_file + " already exists!"
+
+    if file_type == 'csv' and workers > 1:
+        with open(out_files['exg'], "w") as f_eeg, open(out_files['orn'], "w") as f_orn, \
+                open(out_files['marker'], "w") as f_marker:
+            f_orn.write(ORN_HEADER + '\n')
+            f_eeg.write(EXG_HEADER + '\n')
+            print("Converting...")
+            is_truncated = _bin2csv_parallel(bin_file, (f_eeg, f_orn, f_marker), workers)
+        _print_conversion_end(is_truncated)
+        return
+
+    with open(bin_file, "rb") as f_bin, ExitStack() as stack:
+        parser = stack.enter_context(Parser(fid=f_bin, use_mmap=True))
+        writers, file_writer = open_file_writers(stack, file_type, out_files,
+                                                 sampling_rate=parser.detect_sampling_rate(),
+                                                 marker_header=False)
         print("Converting...")
         while True:
             try:
-                parser.parse_packet(mode='record', csv_files=(csv_eeg, csv_orn, csv_marker))
+                parser.parse_block(max_packets=BIN2CSV_BLOCK_SIZE).write_to_files(writers)
+            except ValueError:
+                break
+        for writer in writers:
+            writer.flush()
+        if file_writer is not None:
+            file_writer.close()
+        is_truncated = parser.position < os.path.getsize(bin_file)
+    _print_conversion_end(is_truncated)
+
+
+def _print_conversion_end(is_truncated):
+    """Prints the end of a conversion; a partial packet at the end of the file is reported"""
+    if is_truncated:
+        print("Binary file ended suddenly! Conversion finished!")
+    else:
+        print("Conversion finished!")
+
+
+def _bin2csv_parallel(bin_file, out_files, workers):
+    """Converts the parts of a BIN file in a process pool and writes the outputs in order
+
+    The file is split at the packet offsets of its index, i.e. at the packet boundaries the serial parser finds.
+
+    Args:
+        bin_file (str): Binary file full address
+        out_files (tuple): Tuple of output files (ExG, ORN, marker)
+        workers (int): Number of worker processes
+
+    Returns:
+        True if the file ends with a partial packet
+    """
+    from explorepy.bin_index import get_index
+    index = get_index(bin_file)
+    if not len(index):
+        return index.file_size > 0
+    n_chunk = max(workers, int(np.ceil(index.file_size / BIN2CSV_CHUNK_SIZE)))
+    first_packets = np.unique(np.linspace(0, len(index), n_chunk, endpoint=False).astype(int))
+    bounds = np.append(index.offset[first_packets], index.file_size)
+    # The first part gets its time offset from its first packet like the serial parser
+    time_offsets = [None] + [int(index.timestamp[0])] * (len(bounds) - 2)
+    # Counter rollovers before the first packet of each part
+    n_wraps = (unwrap_counter(index.timestamp)[first_packets] - index.timestamp[first_packets]) >> COUNTER_BITS
+    chunks = [(bin_file, int(start), int(end), time_offset, (int(last), int(n_wrap)), index.sampling_rate)
+              for start, end, time_offset, last, n_wrap in zip(bounds[:-1], bounds[1:], time_offsets,
+                                                               index.timestamp[first_packets], n_wraps)]
+    is_truncated = False
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for outputs, is_chunk_truncated in executor.map(_bin2csv_chunk, *zip(*chunks)):
+            for out_file, output in zip(out_files, outputs):
+                out_file.write(output)
+            is_truncated = is_truncated or is_chunk_truncated
+    return is_truncated
+
+
+def _bin2csv_chunk(bin_file, start, end, time_offset, counter_state, sampling_rate):
+    """Converts a part of a BIN file to csv rows
+
+    Args:
+        bin_file (str): Binary file full address
+        start (int): Byte offset of the first packet of the part
+        end (int): Byte offset of the end of the part
+        time_offset (int): Device timestamp of the first packet of the file (None for the first part)
+        counter_state (tuple): Raw timestamp of the first packet of the part and the number of counter rollovers before
+        sampling_rate (float): Sampling rate of ExG data
+
+    Returns:
+        Tuple of csv strings (ExG, ORN, marker) and True if the part ends with a partial packet
+    """
+    out_buffers = (io.StringIO(), io.StringIO(), io.StringIO())
+    with open(bin_file, "rb") as f_bin, Parser(fid=f_bin, use_mmap=True, byte_range=(start, end)) as parser:
+        parser.time_offset = time_offset
+        parser.unwrap_timestamp = CounterUnwrapper(*counter_state)
+        parser.sampling_rate = sampling_rate
+        csv_files = create_csv_writers(*out_buffers, sampling_rate=sampling_rate)
+        while True:
+            try:
+                parser.parse_block(max_packets=BIN2CSV_BLOCK_SIZE).write_to_files(csv_files)
             except ValueError:
-                print("Binary file ended suddenly! Conversion finished!")
                 break
+        is_truncated = parser.position < end
+    for csv_writer in csv_files:
+        csv_writer.flush()
+    return tuple(out_buffer.getvalue() for out_buffer in out_buffers), is_truncated
 
 
 class HeartRateEstimator:
@@ -107,7 +200,7 @@ class HeartRateEstimator:
         self.prev_times = np.zeros(smoothing_win)
         self.prev_max_slope = 0
 
-        self.bp_filter = Filter(l_freq=1, h_freq=30, order=3)
+        self.bp_filter = Filter(l_freq=1, h_freq=30, order=3, sampling_rate=fs)
         self.hamming_window = signal.windows.hamming(smoothing_win, sym=True)
         self.hamming_window /= self.hamming_window.sum()
 
@@ -0,0 +1,818 @@
+# -*- coding: utf-8 -*-
+"""File writers for recorded data"""
+import os
+import json
+import time
+import queue
+import struct
+from contextlib import ExitStack
+from threading import Thread, current_thread
+from datetime import datetime
+from fractions import Fraction
+import numpy as np
+from explorepy.timesync import sample_times
+
+EXG_FORMAT = '%.9f'  # Volt; finer than the ADC resolution, so the ADC counts can be recovered
+ORN_FORMAT = '%.3f'
+MARKER_FORMAT = '%d'
+TIMESTAMP_FORMAT = '%.4f'  # Resolution of the device clock is .1 ms
+
+EXG_HEADER = 'TimeStamp,ch1,ch2,ch3,ch4,ch5,ch6,ch7,ch8'
+ORN_HEADER = 'TimeStamp,ax,ay,az,gx,gy,gz,mx,my,mz'
+MARKER_HEADER = 'TimeStamp,Marker_code'
+FILE_TYPES = ['csv', 'bdf', 'exz', 'npy']
+
+BDF_DIGITAL_MAX = (2 ** 23) - 1
+BDF_ANNOTATION_SEP = b'\x14'
+NPY_HEADER_SIZE = 128
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+
+class WriterThread:
+    """Background thread which executes file writes handed off through a bounded queue
+
+    The acquisition loop only puts filled buffers in the queue, so a stalling file system never blocks reading from
+    the device. If the queue is full, the block is dropped and counted instead of waiting.
+    """
+
+    def __init__(self, max_queue=64):
+        """
+        Args:
+            max_queue (int): Maximum number of blocks waiting to be written
+        """
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped_blocks = 0
+        self.written_blocks = 0
+        self.error = None
+        self._stopped = False
+        self._thread = Thread(target=self._run, name="explorepy-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        """Number of blocks waiting to be written"""
+        return self._queue.qsize()
+
+    def put(self, func, *args, block=False):
+        """Hands off a write job to the writer thread
+
+        Args:
+            func (callable): Function writing the block
+            *args: Arguments of func
+            block (bool): Wait for a free place in the queue instead of dropping the job (for jobs which must not be
+                lost, e.g. closing files)
+
+        Returns:
+            True if the job has been queued, False if it has been dropped
+        """
+        try:
+            self._queue.put((func, args), block=block)
+            return True
+        except queue.Full:
+            self.dropped_blocks += 1
+            return False
+
+    def run_job(self, func, *args):
+        """Runs a job which must not be lost after the queued jobs
+
+        The job is queued with a blocking put. If it is called by a job of the writer thread itself or after the thread
+        has been stopped, it is executed directly.
+
+        Args:
+            func (callable): Function of the job
+            *args: Arguments of func
+        """
+        if self._stopped or current_thread() is self._thread:
+            func(*args)
+        else:
+            self.put(func, *args, block=True)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            func, args = job
+            try:
+                func(*args)
+                self.written_blocks += 1
+            except Exception as error:
+                if self.error is None:
+                    self.error = error
+
+    def stop(self):
+        """Waits until all queued blocks are written and stops the thread"""
+        self._stopped = True
+        self._queue.put(None)
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class CsvWriter:
+    """Buffered csv writer which formats whole blocks of rows at once
+
+    Rows are collected in a preallocated array and written when the buffer is full or when flush_interval seconds have
+    passed since the last write. Each block is formatted with fixed precision by a single string formatting operation
+    instead of converting every value to its repr.
+
+    If a WriterThread is given, filled buffers are formatted and written in the background while the acquisition
+    continues with a spare buffer.
+    """
+
+    def __init__(self, fid, fmt, header=None, buffer_size=4096, flush_interval=1., writer_thread=None,
+                 sampling_rate=None):
+        """
+        Args:
+            fid (file object): Output file object (text mode)
+            fmt (str): Format of the data columns (e.g. '%.6f')
+            header (str): Header line of the file (without newline), if None no header is written
+            buffer_size (int): Number of rows to be buffered before writing
+            flush_interval (float): Maximum time in seconds that rows are kept in the buffer
+            writer_thread (WriterThread): Writer thread for writing in the background (if None, blocks are written
+                directly)
+            sampling_rate (float): Sampling rate of the rows; if given, a scalar timestamp is the time of the first
+                row and the following rows are timestamped by the sampling rate
+        """
+        self.fid = fid
+        self.fmt = fmt
+        self.sampling_rate = sampling_rate
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.writer_thread = writer_thread
+        self._buffer = None
+        self._spare_buffers = []
+        self._row_fmt = None
+        self._n_row = 0
+        self._last_flush = time.monotonic()
+        if header is not None:
+            fid.write(header + '\n')
+
+    def _init_buffer(self, n_col):
+        self._buffer = np.empty((self.buffer_size, n_col + 1))
+        self._row_fmt = ','.join([TIMESTAMP_FORMAT] + [self.fmt] * n_col) + '\n'
+
+    def write(self, timestamp, data, resolution=None):
+        """Adds rows to the buffer
+
+        Args:
+            timestamp (float or np.ndarray): Timestamp of each row (a scalar is used for all rows if no sampling rate is
+                set)
+            data (np.ndarray): Data with shape (n_row, n_col)
+            resolution (float): Volts per ADC count of ExG data (not used in csv files)
+        """
+        data = np.asarray(data)
+        if self.sampling_rate and np.isscalar(timestamp):
+            timestamp = sample_times(timestamp, data.shape[0], self.sampling_rate)
+        if self._buffer is None:
+            self._init_buffer(data.shape[1])
+        assert data.shape[1] == self._buffer.shape[1] - 1, "Number of columns has changed!"
+        n_new = data.shape[0]
+        start = 0
+        while start < n_new:
+            n_copy = min(n_new - start, self.buffer_size - self._n_row)
+            rows = self._buffer[self._n_row:self._n_row + n_copy]
+            rows[:, 0] = timestamp if np.isscalar(timestamp) else timestamp[start:start + n_copy]
+            rows[:, 1:] = data[start:start + n_copy]
+            self._n_row += n_copy
+            start += n_copy
+            if self._n_row == self.buffer_size:
+                self.flush()
+        if self._n_row and time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Formats and writes the buffered rows (or hands them off to the writer thread)"""
+        if self._n_row:
+            if self.writer_thread is None:
+                self._write_block(self._buffer, self._n_row)
+            else:
+                buffer = self._buffer
+                self._buffer = self._spare_buffers.pop() if self._spare_buffers else np.empty_like(buffer)
+                if not self.writer_thread.put(self._write_block, buffer, self._n_row, True):
+                    self._spare_buffers.append(buffer)
+            self._n_row = 0
+        self._last_flush = time.monotonic()
+
+    def _write_block(self, buffer, n_row, recycle=False):
+        self.fid.write((self._row_fmt * n_row) % tuple(buffer[:n_row].ravel().tolist()))
+        if recycle:
+            self._spare_buffers.append(buffer)
+
+
+def create_csv_writers(f_exg, f_orn, f_marker, sampling_rate=250, **kwargs):
+    """Creates the csv writers of ExG, orientation and marker files
+
+    Args:
+        f_exg (file object): ExG output file
+        f_orn (file object): Orientation output file
+        f_marker (file object): Marker output file
+        sampling_rate (float): Sampling rate of ExG data
+        **kwargs: Keyword arguments of CsvWriter (buffer_size, flush_interval, writer_thread)
+
+    Returns:
+        Tuple of CsvWriter objects (ExG, ORN, marker)
+    """
+    return (CsvWriter(f_exg, EXG_FORMAT, sampling_rate=sampling_rate, **kwargs),
+            CsvWriter(f_orn, ORN_FORMAT, **kwargs),
+            CsvWriter(f_marker, MARKER_FORMAT, **kwargs))
+
+
+def _ascii_field(value, width):
+    return str(value).ljust(width)[:width].encode('ascii')
+
+
+def _format_number(value):
+    """Formats a number to fit in an 8 character header field"""
+    for precision in range(8, 0, -1):
+        text = '%.*g' % (precision, value)
+        if len(text) <= 8:
+            return text
+    raise ValueError("Number does not fit in a header field: " + str(value))
+
+
+class BdfWriter:
+    """Streaming BDF+ writer
+
+    ExG samples are stored as 24-bit ADC counts, i.e. without loss, in data records of record_duration seconds and
+    markers are stored as annotations. The header is written with the first ExG samples and the number of data records
+    is patched in when the file is closed. If samples are missing, the current record is completed with zeros, the next
+    record starts at the time of the following samples and the file is marked as discontinuous (BDF+D).
+    """
+
+    def __init__(self, fid, sampling_rate=250, record_duration=1, start_time=None, annotation_size=120,
+                 writer_thread=None):
+        """
+        Args:
+            fid (file object): Output file object (binary mode, seekable)
+            sampling_rate (float): Sampling rate of ExG data
+            record_duration (float): Duration of data records in seconds; it is extended to the smallest multiple which
+                holds a whole number of samples (e.g. 3 s at 250/3 Hz after decimation)
+            start_time (datetime): Start date and time of the recording (if None, the current time is used)
+            annotation_size (int): Number of bytes reserved for annotations in each data record (multiple of 3)
+            writer_thread (WriterThread): Writer thread for writing in the background (if None, records are written
+                directly)
+        """
+        assert annotation_size % 3 == 0, "Annotation size must be a multiple of 3 bytes"
+        record_duration = Fraction(record_duration).limit_denominator(1000)
+        samples_per_record = record_duration * Fraction(sampling_rate).limit_denominator(1000)
+        record_duration *= samples_per_record.denominator
+        samples_per_record *= samples_per_record.denominator
+        self.fid = fid
+        self.sampling_rate = sampling_rate
+        self.record_duration = float(record_duration)
+        self.start_time = datetime.now() if start_time is None else start_time
+        self.annotation_size = annotation_size
+        self.writer_thread = writer_thread
+        self.samples_per_record = int(samples_per_record)
+        self.is_continuous = True
+        self._buffer = None
+        self._resolution = None
+        self._n_sample = 0
+        self._n_record = 0
+        self._header_size = None
+        self._record_size = None
+        self._time_offset = None
+        self._record_onset = 0.
+        self._next_time = None
+        self._annotations = []
+
+    def _write_header(self, n_chan, resolution):
+        physical_max = _format_number(resolution * BDF_DIGITAL_MAX * 1e6) if n_chan else ''
+        n_signal = n_chan + 1
+        labels = ['ch' + str(i + 1) for i in range(n_chan)] + ['BDF Annotations']
+        signal_fields = [(labels, 16),
+                         ([''] * n_signal, 80),
+                         (['uV'] * n_chan + [''], 8),
+                         (['-' + physical_max] * n_chan + ['-1'], 8),
+                         ([physical_max] * n_chan + ['1'], 8),
+                         ([-BDF_DIGITAL_MAX] * n_chan + [-BDF_DIGITAL_MAX - 1], 8),
+                         ([BDF_DIGITAL_MAX] * n_signal, 8),
+                         ([''] * n_signal, 80),
+                         ([self.samples_per_record] * n_chan + [self.annotation_size // 3], 8),
+                         ([''] * n_signal, 32)]
+        self._header_size = 256 * (n_signal + 1)
+        self._record_size = 3 * self.samples_per_record * n_chan + self.annotation_size
+        start = self.start_time
+        header = [b'\xffBIOSEMI',
+                  _ascii_field('X X X X', 80),
+                  _ascii_field('Startdate %02d-%s-%d X X X' % (start.day, MONTHS[start.month - 1], start.year), 80),
+                  _ascii_field(start.strftime('%d.%m.%y'), 8),
+                  _ascii_field(start.strftime('%H.%M.%S'), 8),
+                  _ascii_field(self._header_size, 8),
+                  _ascii_field('BDF+C', 44),
+                  _ascii_field(-1, 8),
+                  _ascii_field(_format_number(self.record_duration), 8),
+                  _ascii_field(n_signal, 4)]
+        for values, width in signal_fields:
+            header += [_ascii_field(value, width) for value in values]
+        self.fid.write(b''.join(header))
+
+    def write(self, timestamp, data, resolution=None):
+        """Adds ExG samples to the current data record
+
+        Args:
+            timestamp (float or np.ndarray): Timestamp of the first sample or of each sample
+            data (np.ndarray): ExG data in Volts with shape (n_sample, n_chan)
+            resolution (float): Volts per ADC count of the data
+        """
+        data = np.asarray(data)
+        if not np.isscalar(timestamp):
+            # A block of several packets may contain gaps; each continuous part is written on its own
+            gaps = np.flatnonzero(np.diff(timestamp) > 1.5 / self.sampling_rate) + 1
+            if len(gaps):
+                for part_ts, part in zip(np.split(timestamp, gaps), np.split(data, gaps)):
+                    self.write(part_ts, part, resolution=resolution)
+                return
+        start_time = timestamp if np.isscalar(timestamp) else timestamp[0]
+        if self._buffer is None:
+            assert resolution is not None, "ADC resolution is needed for BDF files!"
+            self._write_header(data.shape[1], resolution)
+            self._buffer = np.zeros((self.samples_per_record, data.shape[1]), dtype=np.int32)
+            self._resolution = resolution
+            self._time_offset = start_time
+            self._next_time = start_time
+        assert data.shape[1] == self._buffer.shape[1], "Number of channels has changed!"
+
+        if start_time - self._next_time > 1.5 / self.sampling_rate:
+            # Samples are missing; close the current record and start a new one at the time of the new samples
+            if self._n_sample:
+                self._write_record()
+            self._record_onset = start_time - self._time_offset
+            self.is_continuous = False
+        self._next_time = start_time + data.shape[0] / self.sampling_rate
+
+        counts = np.clip(np.rint(data / self._resolution), -BDF_DIGITAL_MAX, BDF_DIGITAL_MAX)
+        start = 0
+        while start < counts.shape[0]:
+            n_copy = min(counts.shape[0] - start, self.samples_per_record - self._n_sample)
+            self._buffer[self._n_sample:self._n_sample + n_copy] = counts[start:start + n_copy]
+            self._n_sample += n_copy
+            start += n_copy
+            if self._n_sample == self.samples_per_record:
+                self._write_record()
+
+    def add_annotation(self, timestamp, text):
+        """Adds an annotation which is written with the next data record
+
+        Args:
+            timestamp (float): Time of the annotation
+            text (str): Annotation text
+        """
+        self._annotations.append((timestamp, text.encode('utf-8')))
+
+    def write_marker(self, timestamp, data):
+        """Adds marker rows (marker code) as annotations"""
+        data = np.asarray(data)
+        for row_timestamp, row in zip(np.broadcast_to(timestamp, data.shape[:1]), data):
+            self.add_annotation(row_timestamp, str(int(row[0])))
+
+    @property
+    def marker_writer(self):
+        """Writer object storing the rows of marker data as annotations"""
+        return StreamWriter(self.write_marker)
+
+    def _write_record(self):
+        data = self._buffer.astype('<i4').T.copy().view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        annotations = [b'%+.4f' % self._record_onset + BDF_ANNOTATION_SEP * 2 + b'\x00']
+        size = len(annotations[0])
+        while self._annotations:
+            timestamp, text = self._annotations[0]
+            if timestamp - self._time_offset >= self._record_onset + self.record_duration:
+                # Annotations of later records (e.g. markers written ahead of the ExG data of a block)
+                break
+            tal = b'%+.4f' % (timestamp - self._time_offset) + BDF_ANNOTATION_SEP + text + BDF_ANNOTATION_SEP + b'\x00'
+            if size + len(tal) > self.annotation_size:
+                break
+            annotations.append(tal)
+            size += len(tal)
+            self._annotations.pop(0)
+        record = data + b''.join(annotations).ljust(self.annotation_size, b'\x00')
+        if self.writer_thread is None:
+            self.fid.write(record)
+        else:
+            self.writer_thread.put(self.fid.write, record, block=True)
+        self._buffer[:] = 0
+        self._n_sample = 0
+        self._n_record += 1
+        self._record_onset += self.record_duration
+
+    def flush(self):
+        """Data records are written as soon as they are complete; the last record is written by close()"""
+        pass
+
+    def close(self):
+        """Writes the last data record and pending annotations and patches the header
+
+        If a writer thread is used, it has to be stopped before closing, so that all records are in the file. If
+        markers but no ExG samples were written, the file only has the annotation signal.
+        """
+        if self._buffer is None:
+            if not self._annotations:
+                return
+            self._write_header(0, None)
+            self._buffer = np.zeros((self.samples_per_record, 0), dtype=np.int32)
+            self._time_offset = self._annotations[0][0]
+        self.writer_thread = None
+        if self._n_sample:
+            self._write_record()
+        while self._annotations:
+            onset = self._annotations[0][0] - self._time_offset
+            if not self._buffer.shape[1] and onset >= self._record_onset + self.record_duration:
+                # Without ExG samples, no empty records are written between the annotations
+                self._record_onset = onset
+                self.is_continuous = False
+            self._write_record()
+        self.fid.seek(192)
+        self.fid.write(_ascii_field('BDF+C' if self.is_continuous else 'BDF+D', 44))
+        self.fid.write(_ascii_field(self._n_record, 8))
+        self.fid.seek(0, 2)
+        self.fid.flush()
+
+
+class NpyWriter:
+    """Writer of ExG data to a growing memory-mapped .npy file
+
+    Rows of (timestamp, ch1, ..., chN) are copied into a memory map of the file, which is extended by extent_size rows
+    whenever it is full. The header always describes the allocated rows, so the file can be loaded even if the
+    recording is interrupted. On close, the file is cut to the written rows and the header gets the final shape.
+    Number of channels, sampling rate and the marker table are written to a JSON sidecar file.
+
+    If a WriterThread is given, copying the rows to the memory map and extending the file are done in the background;
+    the rows are never dropped, i.e. writing waits if the queue of the thread is full.
+    """
+
+    def __init__(self, file_name, sampling_rate=250, extent_size=1 << 18, sidecar_file=None, writer_thread=None):
+        """
+        Args:
+            file_name (str): Output .npy file name
+            sampling_rate (float): Sampling rate of ExG data
+            extent_size (int): Number of rows the file is extended by when it is full
+            sidecar_file (str): JSON sidecar file name (if None, the name of the .npy file with .json extension)
+            writer_thread (WriterThread): Writer thread for writing in the background (if None, rows are written
+                directly)
+        """
+        self.file_name = file_name
+        self.sidecar_file = os.path.splitext(file_name)[0] + '.json' if sidecar_file is None else sidecar_file
+        self.sampling_rate = sampling_rate
+        self.extent_size = extent_size
+        self.writer_thread = writer_thread
+        self.n_sample = 0
+        self.markers = []
+        self._n_col = None
+        self._capacity = 0
+        self._map = None
+        self._fid = open(file_name, "w+b")
+
+    def _write_header(self, n_row):
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (n_row, self._n_col or 0)
+        self._fid.seek(0)
+        self._fid.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', NPY_HEADER_SIZE - 10) +
+                        header.ljust(NPY_HEADER_SIZE - 11).encode('latin1') + b'\n')
+
+    def _grow(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map = None
+        self._capacity += self.extent_size
+        self._fid.truncate(NPY_HEADER_SIZE + self._capacity * self._n_col * 8)
+        self._write_header(self._capacity)
+        self._fid.flush()
+        self._map = np.memmap(self._fid, dtype='<f8', mode='r+', offset=NPY_HEADER_SIZE,
+                              shape=(self._capacity, self._n_col))
+
+    def write(self, timestamp, data, resolution=None):
+        """Adds ExG samples to the file
+
+        Args:
+            timestamp (float or np.ndarray): Timestamp of the first sample or of each sample
+            data (np.ndarray): ExG data with shape (n_sample, n_chan)
+            resolution (float): Volts per ADC count of ExG data (not used)
+        """
+        data = np.asarray(data)
+        if self._n_col is None:
+            self._n_col = data.shape[1] + 1
+        assert data.shape[1] == self._n_col - 1, "Number of channels has changed!"
+        n_new = data.shape[0]
+        if np.isscalar(timestamp):
+            timestamp = sample_times(timestamp, n_new, self.sampling_rate)
+        if self.writer_thread is None:
+            self._write_rows(self.n_sample, timestamp, data)
+        else:
+            # The data may be a view of a buffer which is reused by the caller. The rows are placed at fixed positions
+            # of the file, so they are queued with a blocking put; a dropped block would leave rows of zeros.
+            self.writer_thread.put(self._write_rows, self.n_sample, np.array(timestamp, dtype=np.float64),
+                                   np.array(data, dtype=np.float64), block=True)
+        self.n_sample += n_new
+
+    def _write_rows(self, start, timestamp, data):
+        while start + data.shape[0] > self._capacity:
+            self._grow()
+        rows = self._map[start:start + data.shape[0]]
+        rows[:, 0] = timestamp
+        rows[:, 1:] = data
+
+    def write_marker(self, timestamp, data):
+        """Adds marker rows (marker code) to the marker table"""
+        data = np.asarray(data)
+        for row_timestamp, row in zip(np.broadcast_to(timestamp, data.shape[:1]), data):
+            self.markers.append([float(row_timestamp), int(row[0])])
+
+    @property
+    def marker_writer(self):
+        """Writer object adding marker rows to the marker table"""
+        return StreamWriter(self.write_marker)
+
+    def flush(self):
+        """Flushes the written samples of the memory map to the file"""
+        if self.writer_thread is None:
+            self._flush_map()
+        else:
+            self.writer_thread.put(self._flush_map)
+
+    def _flush_map(self):
+        if self._map is not None:
+            self._map.flush()
+
+    def close(self):
+        """Cuts the file to the written samples, writes the final header and the sidecar file
+
+        With a writer thread, the file is closed after the queued rows are written.
+        """
+        if self.writer_thread is None:
+            self._close()
+        else:
+            self.writer_thread.run_job(self._close)
+
+    def _close(self):
+        self._flush_map()
+        self._map = None
+        n_col = self._n_col or 0
+        self._fid.truncate(NPY_HEADER_SIZE + self.n_sample * n_col * 8)
+        self._write_header(self.n_sample)
+        self._fid.close()
+        n_chan = max(n_col - 1, 0)
+        with open(self.sidecar_file, "w") as f_sidecar:
+            json.dump({'sampling_rate': self.sampling_rate,
+                       'n_chan': n_chan,
+                       'n_sample': self.n_sample,
+                       'columns': ['TimeStamp'] + ['ch' + str(i + 1) for i in range(n_chan)],
+                       'unit': 'V',
+                       'markers': self.markers}, f_sidecar, indent=2)
+
+
+class RawWriter:
+    """Writer of the raw byte stream of the device to a BIN file
+
+    The bytes are appended exactly as they are read from the socket, so the file has the format of the BIN files
+    recorded by the device and can be converted with bin2csv. The file is synced to disk every fsync_interval seconds;
+    with a writer thread, the sync is done in the background.
+    """
+
+    def __init__(self, fid, fsync_interval=1., writer_thread=None):
+        """
+        Args:
+            fid (file object): Output file object (binary mode)
+            fsync_interval (float): Time in seconds between syncs of the file to disk
+            writer_thread (WriterThread): Writer thread for syncing in the background (if None, the file is synced
+                directly)
+        """
+        self.fid = fid
+        self.fsync_interval = fsync_interval
+        self.writer_thread = writer_thread
+        self.n_bytes = 0
+        self._last_sync = time.monotonic()
+
+    def write(self, byte_data):
+        """Appends bytes to the file"""
+        self.fid.write(byte_data)
+        self.n_bytes += len(byte_data)
+        if time.monotonic() - self._last_sync > self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Flushes the file and syncs it to disk"""
+        self.fid.flush()
+        self._last_sync = time.monotonic()
+        if self.writer_thread is None:
+            os.fsync(self.fid.fileno())
+        else:
+            self.writer_thread.put(os.fsync, self.fid.fileno())
+
+    def close(self):
+        """Syncs the file; the writer thread has to be stopped before"""
+        self.writer_thread = None
+        self.sync()
+
+
+class StreamWriter:
+    """Adapter exposing one data stream of a file writer with the interface of the csv writers"""
+
+    def __init__(self, write_func):
+        """
+        Args:
+            write_func (callable): Function taking the timestamp(s) and the rows of data
+        """
+        self._write_func = write_func
+
+    def write(self, timestamp, data, resolution=None):
+        self._write_func(timestamp, data)
+
+    def flush(self):
+        pass
+
+
+def get_out_files(file_name, file_type, suffixes=('_ExG', '_ORN', '_Marker')):
+    """Returns the names of the output files of a recording
+
+    Args:
+        file_name (str): Output file name without extension
+        file_type (str): File type {'csv', 'bdf', 'exz', 'npy'}
+        suffixes (tuple): File name suffixes of ExG, orientation and marker files
+
+    Returns:
+        Dictionary of output file names by kind of data ('exg', 'orn', 'marker', 'sidecar'); for EXZ files all data
+        is in one file ('exz')
+    """
+    assert file_type in FILE_TYPES, "Invalid file type! Valid file types are: " + str(FILE_TYPES)
+    if file_type == 'exz':
+        return {'exz': file_name + '.exz'}
+    out_files = {'exg': file_name + suffixes[0] + '.' + file_type, 'orn': file_name + suffixes[1] + '.csv'}
+    if file_type == 'csv':
+        out_files['marker'] = file_name + suffixes[2] + '.csv'
+    elif file_type == 'npy':
+        out_files['sidecar'] = file_name + suffixes[0] + '.json'
+    return out_files
+
+
+def open_file_writers(stack, file_type, out_files, sampling_rate=250, writer_thread=None, marker_header=True):
+    """Opens the output files of a recording and creates their file writers
+
+    Args:
+        stack (contextlib.ExitStack): Exit stack which closes the files
+        file_type (str): File type {'csv', 'bdf', 'exz', 'npy'}
+        out_files (dict): Output file names as returned by get_out_files
+        sampling_rate (float): Sampling rate of ExG data
+        writer_thread (WriterThread): Writer thread for writing in the background
+        marker_header (bool): Write the header line of the marker csv file
+
+    Returns:
+        Tuple of the file writers (ExG, ORN, marker) and the writer which has to be closed after the recording (None
+        for csv files)
+    """
+    if file_type == 'exz':
+        from explorepy.chunked import ChunkedWriter
+        exz_writer = ChunkedWriter(stack.enter_context(open(out_files['exz'], "wb")), sampling_rate=sampling_rate,
+                                   writer_thread=writer_thread)
+        return (exz_writer, exz_writer.orn_writer, exz_writer.marker_writer), exz_writer
+
+    f_orn = stack.enter_context(open(out_files['orn'], "w"))
+    f_orn.write(ORN_HEADER + '\n')
+    orn_writer = CsvWriter(f_orn, ORN_FORMAT, writer_thread=writer_thread)
+    if file_type == 'bdf':
+        bdf_writer = BdfWriter(stack.enter_context(open(out_files['exg'], "wb")), sampling_rate=sampling_rate,
+                               writer_thread=writer_thread)
+        return (bdf_writer, orn_writer, bdf_writer.marker_writer), bdf_writer
+    if file_type == 'npy':
+        npy_writer = NpyWriter(out_files['exg'], sampling_rate=sampling_rate, sidecar_file=out_files['sidecar'],
+                               writer_thread=writer_thread)
+        return (npy_writer, orn_writer, npy_writer.marker_writer), npy_writer
+
+    f_exg = stack.enter_context(open(out_files['exg'], "w"))
+    f_marker = stack.enter_context(open(out_files['marker'], "w"))
+    f_exg.write(EXG_HEADER + '\n')
+    if marker_header:
+        f_marker.write(MARKER_HEADER + '\n')
+    return (CsvWriter(f_exg, EXG_FORMAT, writer_thread=writer_thread, sampling_rate=sampling_rate), orn_writer,
+            CsvWriter(f_marker, MARKER_FORMAT, writer_thread=writer_thread)), None
+
+
+class SegmentedRecording:
+    """File writers of a recording which is split into segments of limited duration or size
+
+    The writers (ExG, ORN, marker) forward the data to the files of the current segment. A new segment is started at an
+    ExG packet boundary, so every sample is in exactly one segment and the timestamps continue across segments.
+    Segment files are written with a '.part' suffix. Finalizing a segment (closing its files and renaming them) is done
+    by the writer thread after the queued data of the segment, so the acquisition is not delayed. A JSON manifest lists
+    the files and the time range of every finalized segment.
+    """
+
+    def __init__(self, file_name, file_type, sampling_rate=250, writer_thread=None, segment_duration=None,
+                 segment_size=None):
+        """
+        Args:
+            file_name (str): Output file name (segment files get the segment number as suffix, e.g. name_001_ExG.csv)
+            file_type (str): File type {'csv', 'bdf', 'exz', 'npy'}
+            sampling_rate (float): Sampling rate of ExG data
+            writer_thread (WriterThread): Writer thread for writing and finalizing in the background
+            segment_duration (float): Maximum duration of a segment in seconds
+            segment_size (int): Maximum size of the files of a segment in bytes (checked once per second of data)
+        """
+        self.file_name = file_name
+        self.file_type = file_type
+        self.sampling_rate = sampling_rate
+        self.writer_thread = writer_thread
+        self.segment_duration = segment_duration
+        self.segment_size = segment_size
+        self.manifest_file = file_name + '_manifest.json'
+        self.segments = []
+        self.writers = tuple(_SegmentStreamWriter(self, i) for i in range(3))
+        self._segment = None
+        self._next_size_check = None
+        self._start_segment(1)
+
+    @staticmethod
+    def get_segment_files(file_name, file_type, index):
+        """Returns the output file names of a segment (see get_out_files)"""
+        return get_out_files(file_name + '_%03d' % index, file_type)
+
+    def _start_segment(self, index):
+        stack = ExitStack()
+        out_files = self.get_segment_files(self.file_name, self.file_type, index)
+        part_files = {kind: out_file + '.part' for kind, out_file in out_files.items()}
+        writers, file_writer = open_file_writers(stack, self.file_type, part_files, sampling_rate=self.sampling_rate,
+                                                 writer_thread=self.writer_thread)
+        self._segment = {'index': index, 'stack': stack, 'out_files': out_files, 'part_files': part_files,
+                         'writers': writers, 'file_writer': file_writer, 't_start': None, 't_end': None,
+                         'n_sample': 0}
+
+    def _is_segment_full(self, timestamp):
+        segment = self._segment
+        if self.segment_duration is not None and timestamp - segment['t_start'] >= self.segment_duration:
+            return True
+        if self.segment_size is not None and timestamp >= self._next_size_check:
+            self._next_size_check = timestamp + 1
+            size = sum(os.path.getsize(part_file) for part_file in segment['part_files'].values()
+                       if os.path.isfile(part_file))
+            return size >= self.segment_size
+        return False
+
+    def _add_exg(self, timestamp, n_sample):
+        if np.isscalar(timestamp):
+            t_first, t_last = timestamp, timestamp + (n_sample - 1) / self.sampling_rate
+        else:
+            t_first, t_last = timestamp[0], timestamp[-1]
+        if self._segment['t_start'] is None:
+            self._segment['t_start'] = t_first
+            self._next_size_check = t_first + 1
+        elif self._is_segment_full(t_first):
+            self._rotate()
+            self._segment['t_start'] = t_first
+        self._segment['t_end'] = t_last
+        self._segment['n_sample'] += n_sample
+
+    def _rotate(self):
+        segment = self._segment
+        for writer in segment['writers']:
+            writer.flush()
+        self._start_segment(segment['index'] + 1)
+        self._hand_off(segment)
+
+    def _hand_off(self, segment):
+        if self.writer_thread is None:
+            self._finalize(segment)
+        else:
+            self.writer_thread.put(self._finalize, segment, block=True)
+
+    def _finalize(self, segment):
+        if segment['file_writer'] is not None:
+            segment['file_writer'].close()
+        segment['stack'].close()
+        for kind, part_file in segment['part_files'].items():
+            if os.path.isfile(part_file):
+                os.replace(part_file, segment['out_files'][kind])
+        self.segments.append({'index': segment['index'],
+                              'files': sorted(os.path.basename(out_file) for out_file in segment['out_files'].values()),
+                              't_start': segment['t_start'],
+                              't_end': segment['t_end'],
+                              'n_sample': segment['n_sample']})
+        manifest = {'file_type': self.file_type, 'sampling_rate': self.sampling_rate, 'segments': self.segments}
+        with open(self.manifest_file + '.part', "w") as f_manifest:
+            json.dump(manifest, f_manifest, indent=2)
+        os.replace(self.manifest_file + '.part', self.manifest_file)
+
+    def close(self):
+        """Flushes the writers and finalizes the last segment
+
+        With a writer thread, the segment is finalized when the thread is stopped.
+        """
+        for writer in self._segment['writers']:
+            writer.flush()
+        self._hand_off(self._segment)
+
+
+class _SegmentStreamWriter:
+    """Writer forwarding one data stream (0: ExG, 1: ORN, 2: marker) to the current segment of a recording"""
+
+    def __init__(self, recording, stream):
+        self.recording = recording
+        self.stream = stream
+
+    def write(self, timestamp, data, resolution=None):
+        if self.stream == 0:
+            self.recording._add_exg(timestamp, len(data))
+        self.recording._segment['writers'][self.stream].write(timestamp, data, resolution=resolution)
+
+    def flush(self):
+        self.recording._segment['writers'][self.stream].flush()
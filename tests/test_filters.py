@@ -0,0 +1,49 @@
+import numpy as np
+from scipy.signal import butter, sosfilt, sosfiltfilt
+
+from explorepy import filters
+from explorepy.filters import Filter
+from explorepy.offline import filtfilt_chunked
+
+
+def test_filter_cascade():
+    x = np.random.RandomState(0).randn(4, 33 * 20)
+    exg_filter = Filter(l_freq=1, h_freq=30, line_freq=50)
+    filtered = np.concatenate([exg_filter.apply(x[:, i:i + 33]) for i in range(0, x.shape[1], 33)], axis=1)
+
+    notch = butter(5, [48, 52], btype='bandstop', output='sos', fs=250)
+    bandpass = butter(5, [1, 30], btype='band', output='sos', fs=250)
+    np.testing.assert_allclose(filtered, sosfilt(bandpass, sosfilt(notch, x)), atol=1e-12)
+
+    # Filtering in place gives the same result
+    in_place = x.copy()
+    Filter(l_freq=1, h_freq=30, line_freq=50).apply(in_place, out=in_place)
+    np.testing.assert_allclose(in_place, filtered, atol=1e-12)
+
+
+def test_design_cache(tmp_path):
+    filters.design_sos('band', (61, 64), 5, 250)[:] = 0
+    n_design = len(filters._design_cache)
+    # The design is taken from the cache; changing a returned copy does not change the cache
+    sos = filters.design_sos('band', [61., 64.], 5, 250.)
+    assert len(filters._design_cache) == n_design
+    np.testing.assert_array_equal(sos, butter(5, [61, 64], btype='band', output='sos', fs=250))
+    cache_file = str(tmp_path / 'filters.npz')
+    filters.save_design_cache(cache_file)
+    filters._design_cache.clear()
+    filters.load_design_cache(cache_file)
+    np.testing.assert_array_equal(filters.design_sos('band', (61, 64), 5, 250), sos)
+
+
+def test_filtfilt_chunked(tmp_path):
+    sos = np.concatenate([filters.design_sos('bandstop', (48, 52), 5, 250),
+                          filters.design_sos('band', (1, 30), 5, 250)])
+    x = np.random.RandomState(0).randn(2000, 3)
+    expected = sosfiltfilt(sos, x, axis=0)
+    np.testing.assert_allclose(filtfilt_chunked(sos, x, chunk_size=37, n_jobs=2), expected, atol=1e-12)
+
+    # Memory-mapped arrays are filtered in place
+    data = np.lib.format.open_memmap(str(tmp_path / 'data.npy'), mode='w+', shape=x.shape)
+    data[:] = x
+    filtfilt_chunked(sos, data, out=data, chunk_size=100)
+    np.testing.assert_allclose(data, expected, atol=1e-12)
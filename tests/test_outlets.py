@@ -0,0 +1,26 @@
+import numpy as np
+
+from explorepy.outlets import ChunkedOutlet
+
+
+class FakeOutlet:
+    def __init__(self):
+        self.chunks = []
+
+    def push_chunk(self, x, timestamp):
+        self.chunks.append((x, timestamp))
+
+
+def test_chunked_outlet():
+    lsl_outlet = FakeOutlet()
+    outlet = ChunkedOutlet(lsl_outlet, sampling_rate=100, chunk_size=20)
+    for i in range(4):
+        outlet.push(i * .1, np.full((10, 2), i))
+    # A gap of one packet pushes the samples collected before
+    outlet.push(.5, np.full((10, 2), 5))
+    outlet.flush()
+
+    assert [len(chunk) for chunk, _ in lsl_outlet.chunks] == [40, 40, 20]
+    assert lsl_outlet.chunks[0][0][:2] == [0, 0]
+    times = np.array([timestamp for _, timestamp in lsl_outlet.chunks]) - outlet.time_offset
+    np.testing.assert_allclose(times, [.19, .39, .59])
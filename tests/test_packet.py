@@ -0,0 +1,92 @@
+import struct
+
+import numpy as np
+
+from explorepy.packet import FLETCHER, TS_FLETCHER, PACKET_ID, PACKET_CLASS_DICT, Packet
+
+# Payloads with the values decoded by the per-class packet implementation of explorepy 0.5.0
+EXG98_DATA = bytes((i * 37 + 11) % 256 for i in range(16 * 9 * 3))
+EXG94_DATA = bytes((i * 53 + 7) % 256 for i in range(33 * 5 * 3))
+
+
+def decode(pid, bin_data, fletcher=FLETCHER):
+    return PACKET_CLASS_DICT[pid](0, bin_data + fletcher)
+
+
+def test_int24to32():
+    samples = [0, 1, -1, 2 ** 23 - 1, -2 ** 23, 123456, -654321]
+    bin_data = b''.join(x.to_bytes(3, byteorder='little', signed=True) for x in samples)
+    np.testing.assert_array_equal(Packet.int24to32(bin_data), samples)
+
+
+def test_decode_eeg98():
+    packet = decode(PACKET_ID.EEG98, EXG98_DATA)
+    assert packet.data.shape == (8, 16)
+    np.testing.assert_allclose(packet.data[:, 0], [-0.1855532867375954, 0.15955702776396605, -0.29221995976209164,
+                                                   0.05601535511199893, -0.3988866327865878, -0.05065131791249727,
+                                                   0.294446789556359, -0.15731799093699347], rtol=1e-12)
+    np.testing.assert_allclose(packet.data[:, -1], [0.24111345304411091, -0.21065132744924156, 0.13445898705231987,
+                                                    -0.31731800047373776, 0.030917314400352763, 0.37601542186920894,
+                                                    -0.07574935862414343, 0.2693487488447128], rtol=1e-12)
+    # The status was a tuple of the hex strings of the first three bytes, ('0xb', '0x30', '0x55'); it is now the
+    # status row of the packet
+    assert packet.status.shape == (16,)
+    assert packet.status[0] == 0x55300b
+
+
+def test_decode_eeg99():
+    packet = decode(PACKET_ID.EEG99S, EXG98_DATA)
+    np.testing.assert_allclose(packet.data[:, 0], [-0.3479124126329914, 0.2991694270574364, -0.5479124245539218,
+                                                   0.105028790834998, -0.7479124364748522, -0.09497122108593238,
+                                                   0.5520877304181732, -0.29497123300686273], rtol=1e-12)
+    np.testing.assert_allclose(packet.data[:, -1], [0.45208772445770795, -0.39497123896732794, 0.2521106007230998,
+                                                    -0.5949712508882583, 0.057969964500661435, 0.705028916004767,
+                                                    -0.14203004742026895, 0.5050289040838366], rtol=1e-12)
+
+
+def test_decode_eeg94():
+    packet = decode(PACKET_ID.EEG94, EXG94_DATA)
+    assert packet.data.shape == (4, 33)
+    np.testing.assert_allclose(packet.data[:, 0], [0.05268126162067194, -0.25163248200803784, 0.24406607676340064,
+                                                   -0.05712266649278003], rtol=1e-12)
+    np.testing.assert_allclose(packet.data[:, -1], [0.35072054275519166, 0.049544006531716166, -0.2547697370969936,
+                                                    0.24092882167444485], rtol=1e-12)
+    np.testing.assert_array_equal(packet.dataStatus[:3], [7420935., -7579870., -5803459.])
+
+
+def test_decode_orientation():
+    packet = decode(PACKET_ID.ORN, struct.pack('<9h', 100, -200, 300, -400, 500, -600, 700, -800, 900))
+    np.testing.assert_allclose(packet.acc, [6.1, -12.2, 18.3])
+    np.testing.assert_allclose(packet.gyro, [-3500., 4375., -5250.])
+    np.testing.assert_allclose(packet.mag, [1064., -1216., 1368.])
+
+
+def test_decode_environment():
+    packet = decode(PACKET_ID.ENV, struct.pack('<BHH', 25, 2000, 2300))
+    assert packet.temperature == 25
+    np.testing.assert_allclose(packet.light, 488.4004884)
+    np.testing.assert_allclose(packet.battery, 4.16289593)
+    assert packet.battery_percentage == 96
+
+
+def test_decode_device_info():
+    # The payload used to be decoded as one uint32 firmware version; the second and third bytes are the sampling
+    # rate as 16000 / 2 ** n and the ADC mask
+    packet = decode(PACKET_ID.INFO, struct.pack('<HBB', 258, 6, 255))
+    assert packet.firmware_version == '2.5.8'
+    assert packet.sampling_rate == 250
+    assert packet.adc_mask == 255
+    assert decode(PACKET_ID.INFO, struct.pack('<I', 258)).sampling_rate is None
+
+
+def test_decode_commands():
+    assert decode(PACKET_ID.CMDRCV, bytes([0xa2])).opcode == 162
+    packet = decode(PACKET_ID.CMDSTAT, bytes([0xa2, 0, 0, 0, 0, 1]))
+    assert (packet.opcode, packet.status) == (162, 1)
+
+
+def test_decode_other():
+    packet = decode(PACKET_ID.CALIBINFO, struct.pack('<HH', 123, 4567))
+    np.testing.assert_allclose([packet.slope, packet.offset], [1230., 4.567])
+    assert decode(PACKET_ID.MARKER, struct.pack('<H', 513)).marker_code == 513
+    assert decode(PACKET_ID.TS, struct.pack('<Q', 1234567890123), TS_FLETCHER).hostTimeStamp == 1234567890123
@@ -0,0 +1,227 @@
+import io
+import os
+import struct
+
+import numpy as np
+
+from explorepy.packet import FLETCHER
+from explorepy.packet import PACKET_ID
+from explorepy.bin_index import BinIndex, get_index_file, read_range
+from explorepy import tools
+from explorepy.parser import Parser
+from explorepy.writers import RawWriter, create_csv_writers
+
+
+def make_packet(pid, timestamp, bin_data, cnt=0):
+    return struct.pack('<BBHI', pid, cnt, len(bin_data) + 8, timestamp) + bin_data + FLETCHER
+
+
+def make_stream(n_packet=20, start_time=1000, skip=(), period=640):
+    orn_data = np.arange(9, dtype='<i2').tobytes()
+    exg_data = bytes(range(144)) * 3  # 16 samples x 9 channels x 3 bytes
+    packets = []
+    for i in range(n_packet):
+        if i in skip:
+            continue
+        packets.append(make_packet(PACKET_ID.EEG98, (start_time + period * i) % 2 ** 32, exg_data, cnt=2 * i))
+        packets.append(make_packet(PACKET_ID.ORN, (start_time + period * i) % 2 ** 32, orn_data, cnt=2 * i + 1))
+    return b''.join(packets)
+
+
+def parse_all(parser):
+    packets = []
+    while True:
+        try:
+            packets.append(parser.parse_packet(mode=None))
+        except ValueError:
+            return packets
+
+
+def test_resync():
+    stream = bytearray(make_stream())
+    stream[1000:1000] = b'\x92garbage'
+    parser = Parser(fid=io.BytesIO(bytes(stream)))
+    packets = parse_all(parser)
+    assert len(packets) == 39
+    assert parser.packets_dropped == 1
+    assert parser.bytes_skipped > 0
+
+
+def test_resync_unknown_pid(capsys):
+    stream = make_stream(n_packet=4)
+    unknown = make_packet(0x7f, 2000, b'\x00' * 12)
+    parser = Parser(fid=io.BytesIO(stream[:len(stream) // 2] + unknown + stream[len(stream) // 2:]))
+    assert len(parse_all(parser)) == 8
+    assert parser.bytes_skipped == len(unknown)
+    assert capsys.readouterr().out.count("Unknown Packet ID:127; skipped " + str(len(unknown)) + " bytes") == 1
+
+
+def test_mmap(tmp_path):
+    bin_file = tmp_path / 'test.BIN'
+    bin_file.write_bytes(make_stream())
+    with open(str(bin_file), 'rb') as fid:
+        packets = parse_all(Parser(fid=fid, use_mmap=True))
+    expected = parse_all(Parser(fid=io.BytesIO(make_stream())))
+    assert len(packets) == len(expected) == 40
+    np.testing.assert_array_equal(packets[-2].data, expected[-2].data)
+
+
+class FakeSocket:
+    def __init__(self, stream, chunk_size=100):
+        self.stream = io.BytesIO(stream)
+        self.chunk_size = chunk_size
+
+    def recv(self, n_bytes):
+        return self.stream.read(min(n_bytes, self.chunk_size))
+
+
+def test_raw_tee():
+    stream = make_stream()
+    parser = Parser(socket=FakeSocket(stream))
+    parser.parse_packet(mode=None)
+    position = parser.position
+    tee = RawWriter(io.BytesIO(), fsync_interval=float('inf'))
+    parser.raw_tee = tee
+    assert len(parse_all(parser)) == 39
+    assert tee.fid.getvalue() == stream[position:]
+
+
+def test_set_filters():
+    parser = Parser(socket=FakeSocket(make_stream(), chunk_size=1000))
+    packets = [parser.parse_packet(mode=None) for _ in range(5)]
+    assert parser._stream.n_available > 0
+    # Switching from visualization to impedance filters keeps the bytes read ahead from the socket
+    parser.set_filters(bp_freq=(61, 64), notch_freq=50)
+    assert parser.noise_pipeline is not None
+    packets += parse_all(parser)
+    assert len(packets) == 40
+    assert parser.packets_dropped == 0 and parser.bytes_skipped == 0
+
+
+def test_sampling_rate_change():
+    # The device switches from 250 to 500 Hz in the middle of the stream
+    info = make_packet(PACKET_ID.INFO, 1000, struct.pack('<HBB', 258, 6, 255))
+    new_info = make_packet(PACKET_ID.INFO, 1000 + 640 * 10, struct.pack('<HBB', 258, 5, 255))
+    parser = Parser(fid=io.BytesIO(info + make_stream(10) + new_info + make_stream(10, start_time=1000 + 640 * 10,
+                                                                          period=320)))
+    rates = []
+    parser.sampling_rate_callbacks.append(rates.append)
+    packets = parse_all(parser)
+    assert len(packets) == 42
+    assert rates == [500]
+    assert parser.pipeline.sampling_rate_out == 500
+
+
+def test_close_mmap(tmp_path):
+    bin_file = tmp_path / 'test.BIN'
+    bin_file.write_bytes(make_stream())
+    with open(str(bin_file), 'rb') as fid:
+        with Parser(fid=fid, use_mmap=True) as parser:
+            stream = parser._stream
+            assert len(parse_all(parser)) == 40
+        assert stream._buf.closed
+
+
+def test_timestamp_rollover(tmp_path):
+    bin_file = tmp_path / 'test.BIN'
+    bin_file.write_bytes(make_stream(start_time=2 ** 32 - 640 * 5))
+    with open(str(bin_file), 'rb') as fid:
+        packets = parse_all(Parser(fid=fid))
+    np.testing.assert_allclose([packet.timestamp for packet in packets[::2]], np.arange(20) * .064)
+    np.testing.assert_allclose(BinIndex.build(str(bin_file)).time[::2], np.arange(20) * .064)
+
+
+def test_bin2csv_parallel(tmp_path, monkeypatch, capsys):
+    bin_file = tmp_path / 'test.BIN'
+    stream = make_stream(100, start_time=2 ** 32 - 640 * 50)
+    monkeypatch.setattr(tools, 'BIN2CSV_CHUNK_SIZE', 4000)
+    # Complete file and truncated packet at the end of the file
+    for tail, message in ((b'', 'Conversion finished!\n'), (make_stream(1)[:100], 'Binary file ended suddenly!')):
+        bin_file.write_bytes(stream + tail)
+        for workers in (1, 3):
+            out_dir = tmp_path / (str(workers) + str(len(tail)))
+            out_dir.mkdir()
+            tools.bin2csv(str(bin_file), out_dir=str(out_dir) + '/', workers=workers)
+            output = capsys.readouterr().out
+            assert output.count(message) == 1 and output.count('suddenly') == len(tail) // 100
+        for name in ('test_eeg.csv', 'test_orn.csv', 'test_marker.csv'):
+            assert (tmp_path / ('1' + str(len(tail))) / name).read_bytes() == \
+                (tmp_path / ('3' + str(len(tail))) / name).read_bytes()
+
+
+def test_read_range(tmp_path):
+    bin_file = tmp_path / 'test.BIN'
+    bin_file.write_bytes(make_stream(period=320))
+    # The index is kept in memory if the sidecar file cannot be written
+    os.mkdir(get_index_file(str(bin_file)))
+    block = read_range(str(bin_file), .1, .2)
+    np.testing.assert_allclose(block.exg_timestamp, np.arange(50, 100) / 500)
+    expected = parse_all(Parser(fid=io.BytesIO(make_stream(period=320))))
+    expected_exg = np.concatenate([packet.data for packet in expected[6:14:2]], axis=1)
+    np.testing.assert_array_equal(block.exg, expected_exg[:, 2:52])
+    assert block.orn_timestamp.shape == (3,)
+
+
+def test_gap_filling():
+    parser = Parser(fid=io.BytesIO(make_stream(skip=(5, 6))), gap_policy='interpolate')
+    packets = parse_all(parser)
+    assert parser.sequence.n_lost == 4
+    assert parser.sequence.longest_gap == 4
+    assert parser.samples_filled == 32
+    assert packets[10].data.shape[1] == 48
+    np.testing.assert_allclose(packets[10].timestamp, 5 * .064)
+
+
+def test_sampling_rate():
+    parser = Parser(fid=io.BytesIO(make_stream()), notch_freq=50)
+    assert parser.detect_sampling_rate() == 250
+    assert len(parse_all(parser)) == 40
+
+    device_info = make_packet(PACKET_ID.INFO, 0, struct.pack('<HBB', 221, 4, 255))
+    parser = Parser(fid=io.BytesIO(device_info + make_stream()), notch_freq=50)
+    assert parser.detect_sampling_rate() == 1000
+    assert parser.pipeline.sampling_rate == 1000
+    assert parser.parse_packet(mode=None).firmware_version == '2.2.1'
+
+
+def test_parse_block():
+    expected = [packet for packet in parse_all(Parser(fid=io.BytesIO(make_stream()))) if hasattr(packet, 'data')]
+    parser = Parser(fid=io.BytesIO(make_stream()))
+    block = parser.parse_block(max_packets=11)
+    assert block.n_sample == 6 * 16 and block.orn.shape[0] == 5
+    np.testing.assert_array_equal(block.exg, np.concatenate([packet.data for packet in expected[:6]], axis=1))
+    np.testing.assert_allclose(block.exg_timestamp[16], expected[1].timestamp)
+
+    # Mixed calls continue with the next packet
+    assert hasattr(parser.parse_packet(mode=None), 'acc')
+    np.testing.assert_array_equal(parser.parse_packet(mode=None).data, expected[6].data)
+    block = parser.parse_block(max_packets=100)
+    assert block.n_sample == 13 * 16
+
+    # A change of the number of channels ends the block; the packet is kept for the next call
+    stream = make_stream(n_packet=2) + make_packet(PACKET_ID.EEG94, 2000, bytes(range(165)) * 3, cnt=4)
+    parser = Parser(fid=io.BytesIO(stream))
+    assert parser.parse_block().exg.shape == (8, 32)
+    assert parser.parse_packet(mode=None).data.shape == (4, 33)
+
+
+def test_block_write_to_files():
+    stream = make_stream(skip=(5,)) + make_packet(PACKET_ID.MARKER, 3000, struct.pack('<H', 7), cnt=40)
+    outputs = []
+    for use_blocks in (False, True):
+        out_files = (io.StringIO(), io.StringIO(), io.StringIO())
+        writers = create_csv_writers(*out_files)
+        parser = Parser(fid=io.BytesIO(stream))
+        while True:
+            try:
+                if use_blocks:
+                    parser.parse_block(max_packets=7).write_to_files(writers)
+                else:
+                    parser.parse_packet(mode='record', csv_files=writers)
+            except ValueError:
+                break
+        for writer in writers:
+            writer.flush()
+        outputs.append([out_file.getvalue() for out_file in out_files])
+    assert outputs[1] == outputs[0]
+    assert outputs[1][2] == '0.2000,7\n'
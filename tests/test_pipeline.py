@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from scipy.signal import sosfilt, firwin, upfirdn
+
+from explorepy.filters import design_sos
+from explorepy.pipeline import Pipeline, Notch, Bandpass, Rereference, Decimate, Resample, Scale, \
+    ChannelSelect
+
+
+def run_blocks(pipeline, x, block_size=33):
+    return np.concatenate([pipeline.apply(x[:, i:i + block_size]).copy() for i in range(0, x.shape[1], block_size)],
+                          axis=1)
+
+
+def test_pipeline():
+    x = np.random.RandomState(0).randn(4, 33 * 20)
+    pipeline = Pipeline([Notch(50), Bandpass(1, 30), Rereference(), Scale(2., offset=1.), ChannelSelect([3, 0])])
+    y = run_blocks(pipeline, x)
+    assert pipeline.n_chan_out == 2
+
+    expected = sosfilt(design_sos('bandstop', (48, 52), 5, 250), x)
+    expected = sosfilt(design_sos('band', (1, 30), 5, 250), expected)
+    expected = (expected - expected.mean(axis=0)) * 2. + 1.
+    np.testing.assert_allclose(y, expected[[3, 0]], atol=1e-12)
+
+    with pytest.raises(AssertionError):
+        pipeline.apply(x[:2, :33])
+    with pytest.raises(AssertionError):
+        Pipeline([Bandpass(1, 200)], sampling_rate=250, n_chan=4)
+
+
+def test_decimate():
+    x = np.random.RandomState(0).randn(2, 33 * 20)
+    pipeline = Pipeline([Decimate(4)], sampling_rate=1000)
+    assert pipeline.sampling_rate_out == 250
+    y = run_blocks(pipeline, x)
+    expected = sosfilt(design_sos('lowpass', 100, 8, 1000), x)[:, ::4]
+    np.testing.assert_allclose(y, expected, atol=1e-12)
+
+    # The second block starts at sample 33, its first output sample is sample 36
+    pipeline.reset()
+    pipeline.apply(x[:, :33])
+    pipeline.apply(x[:, 33:66])
+    assert pipeline.time_shift == .003
+
+
+def test_resample():
+    x = np.random.RandomState(0).randn(2, 33 * 20)
+    resample = Resample.from_rates(250, 100)
+    assert (resample.up, resample.down) == (2, 5)
+    pipeline = Pipeline([resample], sampling_rate=250, max_samples=16)
+    assert pipeline.sampling_rate_out == 100
+    y = run_blocks(pipeline, x, block_size=7)
+
+    taps = firwin(2 * resample.half_len + 1, 1. / 5, window=('kaiser', 5.0)) * 2
+    np.testing.assert_allclose(y, upfirdn(taps, x, 2, 5)[:, :y.shape[1]], atol=1e-12)
+
+    # The output rate is kept when the input rate changes
+    pipeline.set_sampling_rate(500)
+    assert (resample.up, resample.down) == (1, 5)
+    assert pipeline.sampling_rate_out == 100
+    taps = firwin(2 * resample.half_len + 1, 1. / 5, window=('kaiser', 5.0))
+    y = run_blocks(pipeline, x, block_size=7)
+    np.testing.assert_allclose(y, upfirdn(taps, x, 1, 5)[:, :y.shape[1]], atol=1e-12)
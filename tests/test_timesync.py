@@ -0,0 +1,20 @@
+import numpy as np
+
+from explorepy.timesync import ClockSync
+
+
+def test_clock_sync():
+    rng = np.random.RandomState(42)
+    device_time = np.arange(0, 1200, 1 / 16)
+    true_host = 1000 + device_time * (1 + 50e-6)
+    delay = .005 + rng.exponential(.01, device_time.shape)
+    delay[rng.rand(len(delay)) < .01] += 1.  # Late packets after retransmissions
+    clock = ClockSync(window=300)
+    for t_device, t_host in zip(device_time, true_host + delay):
+        clock.add(t_device, t_host)
+
+    assert clock.n_pairs == 300
+    np.testing.assert_allclose(clock.drift, 50e-6, rtol=.05)
+    error = clock.device_to_host(device_time[-1000:]) - true_host[-1000:] - .005
+    assert np.abs(error).max() < 1e-3
+    np.testing.assert_allclose(clock.host_to_device(clock.device_to_host(device_time)), device_time, atol=1e-9)
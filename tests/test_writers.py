@@ -0,0 +1,190 @@
+import io
+import json
+import threading
+
+import numpy as np
+
+from explorepy.chunked import ChunkedReader
+from explorepy.chunked import ChunkedWriter
+from explorepy.writers import BdfWriter
+from explorepy.writers import CsvWriter
+from explorepy.writers import NpyWriter
+from explorepy.writers import SegmentedRecording
+from explorepy.writers import WriterThread
+from explorepy.writers import create_csv_writers
+
+
+def test_csv_formats():
+    f_exg, f_orn, f_marker = io.StringIO(), io.StringIO(), io.StringIO()
+    exg_writer, orn_writer, marker_writer = create_csv_writers(f_exg, f_orn, f_marker, sampling_rate=250)
+    exg_writer.write(1.23456, [[1.5e-6, -2.25e-7], [1e-9, 0.]])
+    orn_writer.write(1.23456, [[1.23456, -2.]])
+    marker_writer.write(1.23456, [[7]])
+    for writer in (exg_writer, orn_writer, marker_writer):
+        writer.flush()
+    assert f_exg.getvalue().splitlines() == ['1.2346,0.000001500,-0.000000225', '1.2386,0.000000001,0.000000000']
+    assert f_orn.getvalue().splitlines() == ['1.2346,1.235,-2.000']
+    assert f_marker.getvalue().splitlines() == ['1.2346,7']
+
+
+def test_csv_flush_on_close():
+    fid = io.StringIO()
+    writer_thread = WriterThread()
+    writer = CsvWriter(fid, '%d', buffer_size=100, flush_interval=float('inf'), writer_thread=writer_thread)
+    writer.write(0, np.ones((30, 2)))
+    assert fid.getvalue() == ''
+    # Closing a recording flushes the partially filled buffer and waits for the writer thread
+    writer.flush()
+    writer_thread.stop()
+    assert fid.getvalue() == '0.0000,1,1\n' * 30
+
+
+def test_writer_thread_drops_blocks():
+    fid = io.StringIO()
+    writer_thread = WriterThread(max_queue=1)
+    started, release = threading.Event(), threading.Event()
+    writer_thread.put(lambda: (started.set(), release.wait()))
+    started.wait()
+    writer = CsvWriter(fid, '%d', buffer_size=10, writer_thread=writer_thread)
+    writer.write(0, np.zeros((10, 1)))
+    # The queue is full, so the next block is dropped instead of blocking the acquisition
+    writer.write(1, np.ones((10, 1)))
+    assert writer_thread.dropped_blocks == 1
+    release.set()
+    writer_thread.stop()
+    assert fid.getvalue() == '0.0000,0\n' * 10
+
+
+def test_bdf_writer():
+    resolution = 2.4 / ((2 ** 23) - 1) / 6
+    counts = np.arange(-300, 300).reshape(75, 8) * 10000
+    f_bdf = io.BytesIO()
+    writer = BdfWriter(f_bdf, sampling_rate=50)
+    writer.marker_writer.write(.5, [[7]])
+    writer.write(0, counts * resolution, resolution=resolution)
+    writer.close()
+
+    data = f_bdf.getvalue()
+    header_size = int(data[184:192])
+    assert header_size == 256 * 10
+    assert data[192:197] == b'BDF+C'
+    assert int(data[236:244]) == 2
+    record = data[header_size:header_size + 3 * 50 * 8]
+    raw = np.frombuffer(record, dtype=np.uint8).reshape(8, 50, 3).astype(np.int32)
+    values = raw[..., 0] | raw[..., 1] << 8 | raw[..., 2] << 16
+    values[values >= 2 ** 23] -= 2 ** 24
+    np.testing.assert_array_equal(values.T, counts[:50])
+    assert data[header_size + 3 * 50 * 8:].startswith(b'+0.0000\x14\x14\x00+0.5000\x147\x14\x00')
+
+
+def test_bdf_writer_markers_only():
+    f_bdf = io.BytesIO()
+    writer = BdfWriter(f_bdf, sampling_rate=50)
+    writer.marker_writer.write(np.array([10., 10.5, 30.]), [[7], [8], [9]])
+    writer.close()
+
+    data = f_bdf.getvalue()
+    assert int(data[184:192]) == 256 * 2
+    assert data[192:197] == b'BDF+D'
+    assert int(data[236:244]) == 2
+    assert int(data[252:256]) == 1
+    records = data[512:]
+    assert len(records) == 2 * 120
+    assert records[:120].startswith(b'+0.0000\x14\x14\x00+0.0000\x147\x14\x00+0.5000\x148\x14\x00')
+    assert records[120:].startswith(b'+20.0000\x14\x14\x00+20.0000\x149\x14\x00')
+
+
+def test_bdf_record_duration():
+    # The output rate of a pipeline with decimation by 3 needs records of 3 s
+    writer = BdfWriter(io.BytesIO(), sampling_rate=250 / 3)
+    assert writer.record_duration == 3
+    assert writer.samples_per_record == 250
+
+
+def test_chunked_file(tmp_path):
+    resolution = 2.4 / ((2 ** 23) - 1) / 6
+    counts = np.arange(-4000, 4000).reshape(1000, 8) * 1000
+    file_name = str(tmp_path / 'rec.exz')
+    with open(file_name, 'wb') as f_exz:
+        writer = ChunkedWriter(f_exz, sampling_rate=100, chunk_duration=2)
+        for i in range(0, 1000, 20):
+            writer.orn_writer.write(i / 100, np.full((1, 9), i))
+            if i == 340:
+                writer.marker_writer.write(3.5, [[7]])
+            writer.write(i / 100, counts[i:i + 20] * resolution, resolution=resolution)
+        writer.close()
+
+    with ChunkedReader(file_name) as reader:
+        assert len(reader) == 5
+        block = reader.read(3, 4.5)
+    np.testing.assert_array_equal(np.rint(block.exg / resolution), counts[300:450].T)
+    np.testing.assert_array_equal(block.orn[:, 0], np.arange(300, 450, 20))
+    assert block.marker.tolist() == [7]
+
+
+def test_npy_writer(tmp_path):
+    file_name = str(tmp_path / 'rec_ExG.npy')
+    writer = NpyWriter(file_name, sampling_rate=100, extent_size=64)
+    for i in range(10):
+        writer.write(i / 10, np.full((10, 4), i))
+    writer.marker_writer.write(.55, [[3]])
+    writer.close()
+    check_npy_file(tmp_path)
+
+
+def test_npy_writer_thread(tmp_path):
+    writer_thread = WriterThread()
+    writer = NpyWriter(str(tmp_path / 'rec_ExG.npy'), sampling_rate=100, extent_size=64, writer_thread=writer_thread)
+    data = np.empty((10, 4))
+    for i in range(10):
+        # The buffer is reused, so the writer has to copy it
+        data[:] = i
+        writer.write(i / 10, data)
+    writer.marker_writer.write(.55, [[3]])
+    writer.close()
+    writer_thread.stop()
+    check_npy_file(tmp_path)
+
+
+def test_npy_writer_thread_full_queue(tmp_path):
+    writer_thread = WriterThread(max_queue=1)
+    started, release = threading.Event(), threading.Event()
+    writer_thread.put(lambda: (started.set(), release.wait()))
+    started.wait()
+    writer = NpyWriter(str(tmp_path / 'rec_ExG.npy'), sampling_rate=100, extent_size=64, writer_thread=writer_thread)
+    # The rows wait for a free place in the queue instead of being dropped
+    threading.Timer(.1, release.set).start()
+    for i in range(10):
+        writer.write(i / 10, np.full((10, 4), i))
+    writer.marker_writer.write(.55, [[3]])
+    writer.close()
+    writer_thread.stop()
+    assert writer_thread.dropped_blocks == 0
+    check_npy_file(tmp_path)
+
+
+def check_npy_file(tmp_path):
+    file_name = str(tmp_path / 'rec_ExG.npy')
+    data = np.load(file_name, mmap_mode='r')
+    assert data.shape == (100, 5)
+    np.testing.assert_allclose(data[:, 0], np.arange(100) / 100)
+    np.testing.assert_array_equal(data[:, 1], np.repeat(np.arange(10), 10))
+    with open(str(tmp_path / 'rec_ExG.json')) as f_sidecar:
+        sidecar = json.load(f_sidecar)
+    assert sidecar['n_chan'] == 4
+    assert sidecar['markers'] == [[.55, 3]]
+
+
+def test_segmented_recording(tmp_path):
+    file_name = str(tmp_path / 'rec')
+    recording = SegmentedRecording(file_name, 'csv', sampling_rate=100, segment_duration=1)
+    for i in range(25):
+        recording.writers[0].write(i / 10, np.full((10, 2), i), resolution=1.)
+    recording.close()
+
+    with open(file_name + '_manifest.json') as f_manifest:
+        segments = json.load(f_manifest)['segments']
+    assert [segment['n_sample'] for segment in segments] == [100, 100, 50]
+    assert segments[1]['t_start'] == 1.
+    data = np.loadtxt(file_name + '_002_ExG.csv', delimiter=',', skiprows=1)
+    np.testing.assert_array_equal(data[:, 1], np.repeat(np.arange(10, 20), 10))